@@ -0,0 +1,85 @@
+from typing import Iterable, Optional, Tuple
+
+import torch
+from torch import autograd, nn, Tensor
+from torch.optim.optimizer import Optimizer
+
+from .common import get_logger
+from . import utils
+
+class Amp:
+    """Mixed precision using native torch.autocast.
+
+    On CUDA, forward runs in float16 and losses are scaled by GradScaler so
+    small grads don't underflow. On CPU, bfloat16 is used which has same
+    range as float32 so no loss scaling is needed. When not enabled, all
+    methods behave same as plain float32 training.
+    """
+    def __init__(self, use_amp:bool, device)->None:
+        logger = get_logger()
+
+        self._use_amp = use_amp
+        self._device_type = torch.device(device).type
+        self._dtype = torch.float16 if self._device_type == 'cuda' \
+                      else torch.bfloat16
+
+        if self._use_amp:
+            utils.ensure_pytorch_ver('1.10.0', 'torch.autocast is not available.')
+            logger.info(f'Mixed precision is enabled with {self._dtype}')
+
+        loss_scaling = self._use_amp and self._device_type == 'cuda'
+        if hasattr(torch.amp, 'GradScaler'):
+            self._scaler = torch.amp.GradScaler(self._device_type,
+                                                enabled=loss_scaling)
+        else: # older PyTorch
+            self._scaler = torch.cuda.amp.GradScaler(enabled=loss_scaling)
+
+    def available(self)->bool:
+        return self._use_amp
+
+    def autocast(self):
+        """Context for forward pass and loss computation"""
+        return torch.autocast(self._device_type, dtype=self._dtype,
+                              enabled=self._use_amp)
+
+    def backward(self, loss:Tensor)->None:
+        # grads are unscaled once in clip_grad() or step() so they can be
+        # accumulated over several backward calls
+        self._scaler.scale(loss).backward()
+
+    def grads(self, loss:Tensor, params:Iterable[Tensor])->Tuple[Tensor, ...]:
+        """Same as autograd.grad but with loss scaling, returned grads are
+        unscaled"""
+        if not self._scaler.is_enabled():
+            return autograd.grad(loss, params)
+        scale = self._scaler.get_scale()
+        return tuple(g / scale
+                     for g in autograd.grad(self._scaler.scale(loss), params))
+
+    def grads_finite(self, grads:Iterable[Tensor])->bool:
+        """False if float16 overflowed in grads from grads(), always True
+        when loss scaling is not used"""
+        if not self._scaler.is_enabled():
+            return True
+        return bool(torch.stack([torch.isfinite(g).all() for g in grads]).all())
+
+    def clip_grad(self, clip:float, model:nn.Module, optim:Optimizer)->None:
+        if clip > 0.0:
+            self._scaler.unscale_(optim)
+            nn.utils.clip_grad_norm_(model.parameters(), clip)
+
+    def step(self, optim:Optimizer)->None:
+        # step is skipped if grads have inf or nan because of loss scaling
+        self._scaler.step(optim)
+        self._scaler.update()
+
+    def state_dict(self)->Optional[dict]:
+        return self._scaler.state_dict() if self._scaler.is_enabled() else None
+
+    def load_state_dict(self, state_dict:Optional[dict])->None:
+        if self._scaler.is_enabled():
+            if state_dict is None:
+                raise RuntimeError('checkpoint state_dict is None but '
+                                   'mixed precision with loss scaling is enabled')
+            self._scaler.load_state_dict(state_dict)
+        # scale is meaningless without loss scaling so ignore it
@@ -0,0 +1,107 @@
+from typing import Dict, Optional, Tuple
+import queue
+import threading
+import time
+
+import torch
+from torch.utils.tensorboard import SummaryWriter
+
+_STOP = object() # tells writer thread to exit
+
+class AsyncSummaryWriter:
+    """Drop-in for SummaryWriter.add_scalar that writes from background thread.
+
+    Scalars are put in bounded queue so training thread only pays for queue
+    insertion, the caller blocks only if the queue is full. Tensor values are
+    converted to float in the writer thread so the training thread doesn't
+    wait for the device either.
+
+    The writer thread wakes up every flush_secs and writes everything queued
+    so far in one go. Writing each value as soon as it arrives would have the
+    writer thread compete for the GIL with training thread on every step.
+
+    If downsample_steps > 1 then values of each tag are averaged over windows
+    of that many global steps and only one point per window is written.
+    Values without global_step are always written as is.
+    """
+    def __init__(self, log_dir:Optional[str], max_queue:int=10000,
+                 downsample_steps:int=1, flush_secs:float=1.0) -> None:
+        assert downsample_steps >= 1
+        self._writer = SummaryWriter(log_dir=log_dir)
+        self._downsample_steps = downsample_steps
+        self._flush_secs = flush_secs
+        self._wakeup = threading.Event()
+        self._queue:queue.Queue = queue.Queue(maxsize=max_queue)
+        # tag -> (window, sum, count, last step, last walltime)
+        self._windows:Dict[str, Tuple[int, float, int, int, float]] = {}
+        self._closed = False
+
+        self._thread = threading.Thread(target=self._run,
+                                        name='AsyncSummaryWriter', daemon=True)
+        self._thread.start()
+
+    def add_scalar(self, tag:str, scalar_value, global_step:Optional[int]=None,
+                   walltime:Optional[float]=None)->None:
+        if isinstance(scalar_value, torch.Tensor):
+            scalar_value = scalar_value.detach()
+        item = (tag, scalar_value, global_step,
+                walltime if walltime is not None else time.time())
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full: # wake up writer and wait for room
+            self._wakeup.set()
+            self._queue.put(item)
+
+    def flush(self)->None:
+        """Waits until all queued values are written, partial downsampling
+        windows are kept open"""
+        self._wakeup.set()
+        self._queue.join()
+        self._writer.flush()
+
+    def close(self)->None:
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._wakeup.set()
+        self._thread.join()
+        self._writer.close()
+
+    def _run(self)->None:
+        while True:
+            self._wakeup.wait(self._flush_secs)
+            self._wakeup.clear()
+            while True: # drain the queue
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                try:
+                    if item is _STOP:
+                        for tag in list(self._windows.keys()):
+                            self._write_window(tag)
+                        return
+                    self._add(*item)
+                except Exception: # keep writing other values
+                    from .common import get_logger
+                    get_logger().exception(f'failed to write scalar {item[0]}')
+                finally:
+                    self._queue.task_done()
+
+    def _add(self, tag:str, value, step:Optional[int], walltime:float)->None:
+        value = float(value)
+        if self._downsample_steps == 1 or step is None:
+            self._writer.add_scalar(tag, value, step, walltime)
+            return
+
+        window = step // self._downsample_steps
+        if tag in self._windows and self._windows[tag][0] != window:
+            self._write_window(tag)
+        w, val_sum, count, _, _ = self._windows.get(tag,
+                                                    (window, 0.0, 0, step, 0.0))
+        self._windows[tag] = (w, val_sum + value, count + 1, step, walltime)
+
+    def _write_window(self, tag:str)->None:
+        _, val_sum, count, step, walltime = self._windows.pop(tag)
+        self._writer.add_scalar(tag, val_sum / count, step, walltime)
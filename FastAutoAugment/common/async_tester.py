@@ -0,0 +1,196 @@
+from typing import Deque, Dict, Optional, Tuple
+from collections import deque
+import atexit
+import copy
+import queue
+import time
+import traceback
+
+import torch
+from torch import nn, Tensor
+from torch.utils.data import DataLoader
+import torch.multiprocessing as mp
+
+from overrides import overrides
+
+from .tester import Tester
+from .metrics import Metrics
+from .config import Config
+from .amp_utils import Amp
+from . import utils
+
+class AsyncTester(Tester):
+    """Tester that evaluates in background process so training can continue.
+
+    On each test_epoch() model weights and buffers are copied to shared
+    memory snapshot and background process with its own copy of model and
+    data loader evaluates it. The trainer only waits if background process
+    hasn't picked up the previous snapshot yet.
+
+    Results are merged into metrics in epoch order as they arrive, including
+    epochs without test, so best epoch is same as with Tester. Metrics may lag
+    behind training until state_dict() or post_test() which wait for all
+    pending results so checkpoints are consistent. pre_step and post_step
+    hooks are not called because test steps run in other process.
+    """
+
+    def __init__(self, conf_eval:Config, model:nn.Module, device,
+                 aux_tower:bool, epochs:int=1, amp:bool=False)->None:
+        super().__init__(conf_eval, model, device, aux_tower,
+                         epochs=epochs, amp=amp)
+        self._conf_lossfn = conf_eval['lossfn']
+        self._use_amp = amp
+        self._process:Optional[mp.Process] = None
+        # for each epoch not yet in metrics, True if result is awaited
+        self._pending:Deque[bool] = deque()
+        atexit.register(self._stop)
+
+    @overrides
+    def test_epoch(self, test_dl: DataLoader)->None:
+        if self._process is None:
+            self._start(test_dl)
+
+        # background process loads snapshot before testing it so we only
+        # wait here if it's still busy with the one before previous
+        while not self._snapshot_free.wait(timeout=1.0):
+            self._check_alive()
+        self._snapshot_free.clear()
+        with torch.no_grad():
+            for name, t in self.model.state_dict().items():
+                self._snapshot[name].copy_(t)
+        self._requests.put(True)
+        self._pending.append(True)
+
+        self._merge_results(wait=False)
+
+    @overrides
+    def increment_epoch(self):
+        if self._pending:
+            self._pending.append(False)
+        else:
+            super().increment_epoch()
+
+    @overrides
+    def get_metrics(self)->Metrics:
+        self._merge_results(wait=False)
+        return super().get_metrics()
+
+    @overrides
+    def state_dict(self)->dict:
+        self._merge_results(wait=True)
+        return super().state_dict()
+
+    @overrides
+    def pre_test(self, resuming:bool)->None:
+        self._merge_results(wait=True)
+        super().pre_test(resuming)
+
+    @overrides
+    def post_test(self)->None:
+        self._merge_results(wait=True)
+        self._stop()
+        super().post_test()
+
+    def _start(self, test_dl:DataLoader)->None:
+        ctx = mp.get_context('spawn') # fork is not safe once CUDA is used
+        self._snapshot:Dict[str, Tensor] = {
+            name: t.detach().to('cpu', copy=True).share_memory_()
+                for name, t in self.model.state_dict().items()}
+        self._snapshot_free = ctx.Event()
+        self._snapshot_free.set()
+        self._requests, self._results = ctx.Queue(), ctx.Queue()
+
+        loader_kwargs = {'batch_size': test_dl.batch_size,
+                         'sampler': test_dl.sampler,
+                         'num_workers': test_dl.num_workers,
+                         'collate_fn': test_dl.collate_fn,
+                         'pin_memory': test_dl.pin_memory,
+                         'drop_last': test_dl.drop_last}
+        model = copy.deepcopy(self.model).to('cpu')
+        # not daemon so it can have data loader workers, _stop() is
+        # registered with atexit so exit won't wait for it forever
+        self._process = ctx.Process(target=_test_worker, name='AsyncTester',
+            args=(model, test_dl.dataset, loader_kwargs, self._conf_lossfn,
+                  self._aux_tower, self._use_amp, self.device, self._snapshot,
+                  self._snapshot_free, self._requests, self._results))
+        self._process.start()
+
+    def _stop(self)->None:
+        if self._process is not None:
+            if self._process.is_alive():
+                self._requests.put(False)
+            self._process.join()
+            self._process = None
+
+    def _check_alive(self)->None:
+        if self._process is None or not self._process.is_alive():
+            raise RuntimeError('AsyncTester background process has exited')
+
+    def _merge_results(self, wait:bool)->None:
+        while self._pending:
+            if not self._pending[0]: # epoch without test
+                self._pending.popleft()
+                super().increment_epoch()
+                continue
+            try:
+                result = self._results.get(timeout=1.0) if wait \
+                         else self._results.get_nowait()
+            except queue.Empty:
+                if not wait:
+                    return
+                self._check_alive()
+                continue
+            if isinstance(result, str): # exception in background process
+                raise RuntimeError(f'AsyncTester background process failed:\n'
+                                   f'{result}')
+            self._pending.popleft()
+            sums, cnt, steps, epoch_time = result
+            self._metrics.merge_epoch(sums, cnt, steps, epoch_time)
+
+def _test_worker(model:nn.Module, dataset, loader_kwargs:dict,
+                 conf_lossfn:Config, aux_tower:bool, use_amp:bool, device,
+                 snapshot:Dict[str, Tensor], snapshot_free, requests,
+                 results)->None:
+    from . import common
+    common._logger = utils.setup_logging(name='async_tester') # for Amp
+
+    model = model.to(device)
+    model.eval()
+    lossfn = utils.get_lossfn(conf_lossfn).to(device)
+    amp = Amp(use_amp, device)
+    test_dl = DataLoader(dataset, **loader_kwargs)
+
+    while requests.get():
+        try:
+            model.load_state_dict(snapshot)
+            snapshot_free.set() # trainer can write next one while we test
+            results.put(_test_epoch(model, test_dl, lossfn, aux_tower,
+                                    amp, device))
+        except Exception:
+            snapshot_free.set()
+            results.put(traceback.format_exc())
+            return
+
+def _test_epoch(model:nn.Module, test_dl:DataLoader, lossfn:nn.Module,
+                aux_tower:bool, amp:Amp, device)\
+        ->Tuple[Tuple[float, float, float], int, int, float]:
+    start_time = time.time()
+    sums:Optional[Tensor] = None
+    cnt, steps = 0, 0
+    with torch.no_grad():
+        for x, y in test_dl:
+            x, y = x.to(device), y.to(device, non_blocking=True)
+            with amp.autocast():
+                logits = model(x)
+                if aux_tower:
+                    logits = logits[0]
+                loss = lossfn(logits, y)
+            prec1, prec5 = utils.accuracy(logits, y, topk=(1, 5))
+            step_sums = torch.stack([loss.reshape(()), prec1, prec5])\
+                             .double() * x.size(0)
+            sums = step_sums if sums is None else sums + step_sums
+            cnt += x.size(0)
+            steps += 1
+    assert sums is not None, 'test data loader is empty'
+    loss_sum, top1_sum, top5_sum = sums.tolist()
+    return (loss_sum, top1_sum, top5_sum), cnt, steps, time.time()-start_time
@@ -0,0 +1,204 @@
+from typing import Callable, List, Optional
+import copy
+import gc
+import pathlib
+import sys
+import time
+
+import torch
+from torch import nn
+from torch.utils.data import DataLoader, TensorDataset
+
+import yaml
+
+from .config import Config
+from .trainer import Trainer
+from .common import get_logger, expdir_abspath
+from . import dist_utils
+from .data import channels_last_collate
+
+class BatchSizeFinder:
+    """Finds train batch size with best throughput that fits in memory.
+
+    Batch size is doubled from min_batch to max_batch. For each size, new
+    model and trainer are created and trained on random inputs so the probe
+    includes everything the trainer does in a step, for example, the bilevel
+    alpha step in search. Probing stops at the first batch size that runs out
+    of memory or has peak memory above max_memory_gb. Peak memory is
+    allocated memory on CUDA and process max RSS on CPU.
+
+    With torch.distributed, each rank probes on its own without collectives
+    and then ranks agree on results: a batch size is feasible only if it is
+    feasible on all ranks and its throughput is the mean over ranks, so all
+    ranks pick the same batch size.
+
+    Best batch size is the smallest one within tolerance of the highest
+    throughput as bigger batches would also need learning rate retuning.
+    """
+
+    def __init__(self, conf_finder:Config, device)->None:
+        # region conf vars
+        self._min_batch = conf_finder['min_batch']
+        self._max_batch = conf_finder['max_batch']
+        self._warmup_steps = conf_finder['warmup_steps']
+        self._steps = conf_finder['steps']
+        self._max_memory_gb = conf_finder['max_memory_gb']
+        self._tolerance = conf_finder['tolerance']
+        self._img_size = conf_finder['img_size']
+        # endregion
+
+        self.device = torch.device(device)
+        # batch_size, feasible, samples_per_sec, peak_mem_gb for each probe
+        self.probes:List[dict] = []
+
+    def find(self, create_model:Callable[[], nn.Module],
+             create_trainer:Callable[[nn.Module, Config], Trainer],
+             conf_train:Config, channels:int, n_classes:int,
+             channels_last=False)->Optional[int]:
+        """Returns best batch size or None if even min_batch doesn't fit"""
+        logger = get_logger()
+
+        # run one short epoch per fit without validation or checkpoints
+        conf_train = copy.deepcopy(conf_train)
+        conf_train['epochs'] = 1
+        conf_train['logger_freq'] = 0
+        # keep random data curves out of tensorboard series of the real run
+        conf_train['title'] = 'batch_size_finder'
+        conf_train['validation'] = None
+        conf_train['early_stop'] = None # requires validation
+        conf_train['budget'] = None
+
+        self.probes = []
+        # out of memory on one rank must not stall others in collectives
+        with dist_utils.local_only():
+            for batch_size in self._batch_sizes():
+                probe = self._probe(batch_size, create_model, create_trainer,
+                                    conf_train, channels, n_classes,
+                                    channels_last)
+                self.probes.append(probe)
+                logger.info(f'[batch_size_finder] {probe}')
+                if not probe['feasible']:
+                    break
+        self._reduce_probes()
+
+        return self.best()
+
+    def _reduce_probes(self)->None:
+        if not dist_utils.is_distributed():
+            return
+        # ranks may have stopped at different batch sizes
+        n_sizes = len(self._batch_sizes())
+        feasible = [0.0] * n_sizes
+        throughput = [torch.zeros(1, dtype=torch.float64, device=self.device)
+                      for _ in range(n_sizes)]
+        for i, probe in enumerate(self.probes):
+            feasible[i] = float(probe['feasible'])
+            throughput[i] += probe['samples_per_sec']
+        feasible = dist_utils.all_reduce_min(feasible, self.device)
+        throughput = dist_utils.all_reduce_mean(throughput)
+
+        probes = []
+        for i, batch_size in enumerate(self._batch_sizes()):
+            probe = self.probes[i] if i < len(self.probes) else \
+                    {'batch_size': batch_size, 'peak_mem_gb': None}
+            probe['feasible'] = feasible[i] > 0.0
+            probe['samples_per_sec'] = throughput[i].item()
+            probes.append(probe)
+            if not probe['feasible']:
+                break
+        self.probes = probes
+
+    def _batch_sizes(self)->List[int]:
+        sizes, batch_size = [], self._min_batch
+        while batch_size <= self._max_batch:
+            sizes.append(batch_size)
+            batch_size *= 2
+        return sizes
+
+    def best(self)->Optional[int]:
+        feasible = [p for p in self.probes if p['feasible']]
+        if not feasible:
+            return None
+        max_throughput = max(p['samples_per_sec'] for p in feasible)
+        return min(p['batch_size'] for p in feasible
+                   if p['samples_per_sec'] >= (1.0-self._tolerance)*max_throughput)
+
+    def save(self, filename:str)->Optional[str]:
+        save_path = expdir_abspath(filename)
+        if save_path and dist_utils.is_master():
+            if not save_path.endswith('.yaml'):
+                save_path += '.yaml'
+            pathlib.Path(save_path).write_text(yaml.dump(
+                {'best': self.best(), 'probes': self.probes}))
+        return save_path
+
+    def _probe(self, batch_size:int, create_model:Callable[[], nn.Module],
+               create_trainer:Callable[[nn.Module, Config], Trainer],
+               conf_train:Config, channels:int, n_classes:int,
+               channels_last:bool)->dict:
+        probe = {'batch_size': batch_size, 'feasible': False,
+                 'samples_per_sec': 0.0, 'peak_mem_gb': None}
+        model = trainer = None
+        self._reset_peak_memory()
+        try:
+            model = create_model()
+            trainer = create_trainer(model, conf_train)
+            # first fit pays for allocations and kernel selection
+            self._fit(trainer, batch_size, self._warmup_steps, channels,
+                      n_classes, channels_last)
+            elapsed = self._fit(trainer, batch_size, self._steps, channels,
+                                n_classes, channels_last)
+            probe['samples_per_sec'] = batch_size * self._steps / elapsed
+            probe['feasible'] = True
+        except RuntimeError as e: # includes torch.cuda.OutOfMemoryError
+            if 'out of memory' not in str(e) and \
+                    'can\'t allocate memory' not in str(e):
+                raise
+        finally:
+            del model, trainer
+            gc.collect()
+            if self.device.type == 'cuda':
+                torch.cuda.empty_cache()
+
+        probe['peak_mem_gb'] = self._peak_memory_gb()
+        if self._max_memory_gb is not None and \
+                probe['peak_mem_gb'] is not None and \
+                probe['peak_mem_gb'] > self._max_memory_gb:
+            probe['feasible'] = False
+        return probe
+
+    def _fit(self, trainer:Trainer, batch_size:int, steps:int, channels:int,
+             n_classes:int, channels_last:bool)->float:
+        x = torch.randn(batch_size*steps, channels,
+                        self._img_size, self._img_size)
+        y = torch.randint(0, n_classes, (batch_size*steps,))
+        dl = DataLoader(TensorDataset(x, y), batch_size=batch_size,
+                        drop_last=True, collate_fn=channels_last_collate \
+                                        if channels_last else None)
+
+        self._synchronize()
+        start = time.time()
+        # search trainers take alpha batches from val loader
+        trainer.fit(dl, dl)
+        self._synchronize()
+        return time.time() - start
+
+    def _synchronize(self)->None:
+        if self.device.type == 'cuda':
+            torch.cuda.synchronize(self.device)
+
+    def _reset_peak_memory(self)->None:
+        if self.device.type == 'cuda':
+            torch.cuda.reset_peak_memory_stats(self.device)
+        # max RSS on CPU can't be reset, it only grows with batch size
+
+    def _peak_memory_gb(self)->Optional[float]:
+        if self.device.type == 'cuda':
+            return torch.cuda.max_memory_allocated(self.device) / 2**30
+        try:
+            import resource
+        except ImportError: # not available on Windows
+            return None
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # bytes on macOS, KB on Linux
+        return max_rss / (2**30 if sys.platform == 'darwin' else 2**20)
@@ -1,12 +1,17 @@
 from collections import UserDict
-from typing import Callable, Any
+from typing import Callable, Any, Optional
+import copy
+import threading
+import time
 import weakref
 import os
 
 import torch
 
 from .config import Config
-from .common import expdir_abspath
+from .common import expdir_abspath, get_logger
+from .chunk_store import ChunkStore
+from . import utils
 
 _CallbackType = Callable #[['CheckPoint', *kargs: Any, **kwargs: Any], None]
 class CheckPoint(UserDict):
@@ -18,6 +23,16 @@ class CheckPoint(UserDict):
     checkpoint becomes dirty. On call to new() subscribers will be notified so
     they can insert their items in the dictionary.
     Invariant: checkpoint is dirty only between new() and save() calls.
+
+    The file is written to temp file and then renamed so a crash during
+    write leaves the previous checkpoint intact. If async_write is True then
+    commit() copies tensors to CPU and writing happens on background thread,
+    next commit() waits for previous write to finish.
+
+    If incremental is True then tensors are saved as content addressed
+    chunks in a folder next to the checkpoint file, the file only has
+    references to them. Chunks that are already stored are not written
+    again. bytes_written has size of the last write.
     """
     def __init__(self, conf_checkpoint:Config, load_existing:bool) -> None:
         super().__init__()
@@ -25,9 +40,19 @@ class CheckPoint(UserDict):
         # region config vars
         self._filepath = expdir_abspath(conf_checkpoint['filename'])
         self.freq = conf_checkpoint['freq']
+        self.freq_secs = conf_checkpoint['freq_secs']
+        self._async_write = conf_checkpoint['async_write']
+        incremental = conf_checkpoint['incremental']
+        chunk_mb = conf_checkpoint['chunk_mb']
         # endregion
 
         self._callbacks = []
+        self._last_commit_time = time.time()
+        self._writer:Optional[threading.Thread] = None
+        self._write_error:Optional[BaseException] = None
+        self.bytes_written = 0
+        self._store = ChunkStore(self._chunks_dirpath(), int(chunk_mb * 2**20)) \
+                      if incremental and self._filepath else None
 
         if load_existing:
             self.load_existing()
@@ -35,7 +60,9 @@ class CheckPoint(UserDict):
     def load_existing(self)->bool:
         assert self.is_empty()
         if self._filepath and os.path.exists(self._filepath):
-            d = torch.load(self._filepath, map_location=torch.device('cpu'))
+            d = utils.load_lazy(self._filepath)
+            if ChunkStore.is_manifest(d): # saved with incremental=True
+                d = ChunkStore(self._chunks_dirpath(), 0).get(d)
             self.clear()
             self.update(d)
             return True
@@ -54,12 +81,60 @@ class CheckPoint(UserDict):
                 func(self, *kargs, **kvargs)
             # else func is garbegde collected
 
+    def is_due(self, epoch:int, force=False)->bool:
+        """True if checkpoint should be saved after given epoch, every freq
+        epochs or if freq_secs have passed since last commit. force is for
+        last epoch of run that stops early."""
+        return force or epoch % self.freq == 0 or \
+            (self.freq_secs is not None and \
+             time.time() - self._last_commit_time >= self.freq_secs)
+
     def commit(self)->None:
         assert self._filepath and not self.is_empty()
-        torch.save(self.data, self._filepath)
+        self.wait()
+        self._last_commit_time = time.time()
+        if self._async_write:
+            # training may change tensors while background thread writes
+            data = _to_cpu(self.data)
+            # not daemon so process exit waits for write to finish
+            self._writer = threading.Thread(target=self._write, args=(data,),
+                                            name='CheckPointWriter')
+            self._writer.start()
+        else:
+            self._write(self.data)
         # clean up after commit so we don't hold up references
         self.clear()
 
+    def wait(self)->None:
+        """Waits for background write to finish, raises if it failed"""
+        if self._writer is not None:
+            self._writer.join()
+            self._writer = None
+        if self._write_error is not None:
+            e, self._write_error = self._write_error, None
+            raise RuntimeError('checkpoint write failed') from e
+
+    def _write(self, data:dict)->None:
+        tmp_filepath = self._filepath + '.tmp'
+        try:
+            written = 0
+            if self._store is not None:
+                data, written = self._store.put(data)
+            torch.save(data, tmp_filepath)
+            written += os.path.getsize(tmp_filepath)
+            os.replace(tmp_filepath, self._filepath) # atomic
+            if self._store is not None: # chunks of previous checkpoint
+                self._store.collect(data)
+            self.bytes_written = written
+            get_logger().info(f'checkpoint saved, {written/2**20:.2f} MB written')
+        except BaseException as e:
+            if not self._async_write:
+                raise
+            self._write_error = e
+
+    def _chunks_dirpath(self)->str:
+        return self._filepath + '.chunks'
+
     def is_empty(self)->bool:
         return len(self) == 0
 
@@ -67,4 +142,13 @@ class CheckPoint(UserDict):
         obj = getattr(callback, '__self__', None)
         callback_ref = weakref.ref(callback.__func__), \
                        None if obj is None else weakref.ref(obj)
-        self._callbacks.append(callback_ref)
\ No newline at end of file
+        self._callbacks.append(callback_ref)
+def _to_cpu(obj:Any)->Any:
+    """Copy of obj with tensors copied to CPU"""
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, dict):
+        return type(obj)((k, _to_cpu(v)) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_to_cpu(v) for v in obj)
+    return copy.deepcopy(obj)
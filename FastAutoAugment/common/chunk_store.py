@@ -0,0 +1,116 @@
+from typing import Any, List, Set, Tuple
+import hashlib
+import mmap
+import os
+
+import torch
+
+_REF_KEY = '__chunk_ref__' # marks dict that stands for tensor in manifest
+
+class ChunkStore:
+    """Content addressed storage for tensors in checkpoint.
+
+    Each tensor is split into chunks of chunk_bytes which are stored in
+    files named by hash of their content. put() replaces tensors in the state
+    with small dicts referencing their chunks and writes only chunks that are
+    not already stored, so tensors that didn't change since the last
+    checkpoint, or are same as other tensor, cost nothing to save. The
+    returned manifest is saved by the caller as usual.
+    """
+    def __init__(self, dirpath:str, chunk_bytes:int)->None:
+        self._dirpath = dirpath
+        self._chunk_bytes = chunk_bytes
+        self._stored:Set[str] = set()
+        if os.path.isdir(dirpath):
+            self._stored.update(f for f in os.listdir(dirpath)
+                                if not f.endswith('.tmp'))
+
+    @staticmethod
+    def is_manifest(obj:Any)->bool:
+        return isinstance(obj, dict) and obj.get(_REF_KEY, False) == 'manifest'
+
+    def put(self, obj:Any)->Tuple[dict, int]:
+        """Returns manifest for obj and bytes of new chunks written"""
+        os.makedirs(self._dirpath, exist_ok=True)
+        written = [0]
+        data = self._put(obj, written)
+        return {_REF_KEY: 'manifest', 'data': data}, written[0]
+
+    def get(self, manifest:dict)->Any:
+        assert ChunkStore.is_manifest(manifest)
+        return self._get(manifest['data'])
+
+    def collect(self, manifest:dict)->None:
+        """Deletes chunks not referenced by manifest"""
+        referenced = set(ChunkStore._chunks(manifest['data']))
+        for name in self._stored - referenced:
+            try:
+                os.remove(os.path.join(self._dirpath, name))
+            except FileNotFoundError:
+                pass
+        self._stored &= referenced
+
+    def _put(self, obj:Any, written:List[int])->Any:
+        if isinstance(obj, torch.Tensor):
+            t = obj.detach().cpu().contiguous()
+            buf = t.reshape(-1).view(torch.uint8).numpy().data
+            chunks = []
+            for start in range(0, max(len(buf), 1), self._chunk_bytes):
+                chunk = buf[start:start+self._chunk_bytes]
+                name = hashlib.blake2b(chunk, digest_size=20).hexdigest()
+                if name not in self._stored:
+                    self._write_chunk(name, chunk)
+                    written[0] += len(chunk)
+                chunks.append(name)
+            return {_REF_KEY: 'tensor', 'dtype': str(t.dtype).split('.')[-1],
+                    'shape': list(t.shape), 'chunks': chunks}
+        if isinstance(obj, dict):
+            return type(obj)((k, self._put(v, written)) for k, v in obj.items())
+        if isinstance(obj, (list, tuple)):
+            return type(obj)(self._put(v, written) for v in obj)
+        return obj
+
+    def _get(self, obj:Any)->Any:
+        if isinstance(obj, dict):
+            if obj.get(_REF_KEY, False) == 'tensor':
+                if len(obj['chunks']) == 1: # memory map, read on access
+                    data = self._map_chunk(obj['chunks'][0])
+                else:
+                    data = bytearray()
+                    for name in obj['chunks']:
+                        with open(os.path.join(self._dirpath, name), 'rb') as f:
+                            data += f.read()
+                t = torch.frombuffer(data, dtype=torch.uint8) if len(data) \
+                    else torch.empty(0, dtype=torch.uint8)
+                return t.view(getattr(torch, obj['dtype'])).reshape(obj['shape'])
+            return type(obj)((k, self._get(v)) for k, v in obj.items())
+        if isinstance(obj, (list, tuple)):
+            return type(obj)(self._get(v) for v in obj)
+        return obj
+
+    def _map_chunk(self, name:str):
+        with open(os.path.join(self._dirpath, name), 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b''
+            # copy on write so changes to tensor don't go to file
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    def _write_chunk(self, name:str, chunk)->None:
+        # rename so partially written chunk never has valid name
+        filepath = os.path.join(self._dirpath, name)
+        with open(filepath + '.tmp', 'wb') as f:
+            f.write(chunk)
+        os.replace(filepath + '.tmp', filepath)
+        self._stored.add(name)
+
+    @staticmethod
+    def _chunks(obj:Any):
+        if isinstance(obj, dict):
+            if obj.get(_REF_KEY, False) == 'tensor':
+                yield from obj['chunks']
+            else:
+                for v in obj.values():
+                    yield from ChunkStore._chunks(v)
+        elif isinstance(obj, (list, tuple)):
+            for v in obj:
+                yield from ChunkStore._chunks(v)
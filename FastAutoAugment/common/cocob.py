@@ -32,13 +32,16 @@ class CocobBackprop(optim.Optimizer):
         alpha (float, optional): positive number to adjust betting fraction.
             Theoretical convergence gauarantee does not depend on choice of
             alpha (default: 100.0)
+        foreach (bool, optional): update all parameters of a group with
+            multi-tensor ops instead of looping over them, results are same
+            (default: False)
 
     __ https://arxiv.org/pdf/1705.07795.pdf
     """
-    def __init__(self, params, alpha=100.0, eps=1e-8):
+    def __init__(self, params, alpha=100.0, eps=1e-8, foreach=False):
         self.alpha = alpha
         self.eps = eps
-        defaults = dict(alpha=alpha, eps=eps)
+        defaults = dict(alpha=alpha, eps=eps, foreach=foreach)
         super(CocobBackprop, self).__init__(params, defaults)
 
     def step(self, closure=None):
@@ -48,6 +51,9 @@ class CocobBackprop(optim.Optimizer):
             loss = closure()
 
         for group in self.param_groups:
+            if group.get('foreach', False):
+                self._step_foreach(group)
+                continue
             for param in group['params']:
                 if param.grad is None:
                     continue
@@ -113,6 +119,62 @@ class CocobBackprop(optim.Optimizer):
 
         return loss
 
+    @torch.no_grad()
+    def _step_foreach(self, group):
+        """Same updates as the loop in step() done with one multi-tensor op
+        per update for all params in group. Param is updated in place, so
+        initial weight is kept as a copy."""
+        params = [p for p in group['params'] if p.grad is not None]
+        if not params:
+            return
+        grads = [p.grad for p in params]
+
+        for param in params:
+            state = self.state[param]
+            if len(state) == 0:
+                state['initial_weight'] = param.detach().clone()
+                state['reward'] = torch.zeros_like(param)
+                state['bet'] = torch.zeros_like(param)
+                state['neg_grads_sum'] = torch.zeros_like(param)
+                state['grads_abs_sum'] = torch.zeros_like(param)
+                state['max_observed_scale'] = self.eps * torch.ones_like(param)
+        states = [self.state[p] for p in params]
+        initial_weight = [s['initial_weight'] for s in states]
+        reward = [s['reward'] for s in states]
+        bet = [s['bet'] for s in states]
+        neg_grads_sum = [s['neg_grads_sum'] for s in states]
+        grads_abs_sum = [s['grads_abs_sum'] for s in states]
+        max_observed_scale = [s['max_observed_scale'] for s in states]
+
+        abs_grads = torch._foreach_abs(grads)
+        torch._foreach_maximum_(max_observed_scale, abs_grads)
+        torch._foreach_add_(grads_abs_sum, abs_grads)
+        torch._foreach_sub_(neg_grads_sum, grads)
+
+        # reward + bet * -grad, negative reward is not allowed
+        torch._foreach_sub_(reward, torch._foreach_mul(bet, grads))
+        torch._foreach_clamp_min_(reward, 0.0)
+
+        denom = torch._foreach_add(grads_abs_sum, max_observed_scale)
+        torch._foreach_maximum_(denom,
+            torch._foreach_mul(max_observed_scale, self.alpha))
+        torch._foreach_mul_(denom, max_observed_scale)
+        bet_fraction = torch._foreach_div(neg_grads_sum, denom)
+
+        bet = torch._foreach_add(max_observed_scale, reward)
+        torch._foreach_mul_(bet, bet_fraction)
+
+        new_params = torch._foreach_add(initial_weight, bet)
+        if hasattr(torch, '_foreach_copy_'):
+            torch._foreach_copy_(params, new_params)
+        else: # older PyTorch
+            for param, new_param in zip(params, new_params):
+                param.copy_(new_param)
+
+        for state, b, f in zip(states, bet, bet_fraction):
+            state['bet'] = b
+            state['bet_fraction'] = f
+
 
 class CocobOns(optim.Optimizer):
     """Implements Coin-Betting through ONS .
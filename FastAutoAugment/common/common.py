@@ -1,3 +1,4 @@
+import atexit
 import logging
 import numpy as np
 import os
@@ -10,7 +11,9 @@ from torch.utils.tensorboard import SummaryWriter
 
 from .config import Config
 from .stopwatch import StopWatch
+from .async_tb_writer import AsyncSummaryWriter
 from . import utils
+from . import dist_utils
 
 class SummaryWriterDummy:
     def __init__(self, log_dir):
@@ -19,7 +22,14 @@ class SummaryWriterDummy:
     def add_scalar(self, *args, **kwargs):
         pass
 
-SummaryWriterAny = Union[SummaryWriterDummy, SummaryWriter]
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+SummaryWriterAny = Union[SummaryWriterDummy, SummaryWriter,
+                         AsyncSummaryWriter]
 _logger: Optional[logging.Logger] = None
 _tb_writer: SummaryWriterAny = None
 
@@ -77,15 +87,18 @@ def common_init(config_filepath: Optional[str]=None,
     sw = StopWatch()
     StopWatch.set(sw)
 
+    # with torch.distributed only rank 0 writes logs, TensorBoard and configs
+    is_master = _setup_distributed() and is_master
+
     expdir = _setup_dirs()
-    _setup_logger()
+    _setup_logger(is_master)
 
     logger = get_logger()
     logger.info(f'expdir: {expdir}')
 
     _setup_gpus()
 
-    if expdir:
+    if expdir and is_master:
         # copy net config to experiment folder for reference
         with open(os.path.join(expdir, 'full_config.yaml'), 'w') as f:
             yaml.dump(conf, f, default_flow_style=False)
@@ -114,12 +127,17 @@ def _create_tb_writer(is_master=True)-> SummaryWriterAny:
     tbdir = expdir_abspath('tb')
     conf_common = get_conf_common()
 
-    WriterClass = SummaryWriterDummy if not conf_common['enable_tb'] or \
-                                        not is_master or \
-                                        not tbdir \
-        else SummaryWriter
+    if not conf_common['enable_tb'] or not is_master or not tbdir:
+        return SummaryWriterDummy(log_dir=tbdir)
+    if not conf_common['tb_async']:
+        return SummaryWriter(log_dir=tbdir)
 
-    return WriterClass(log_dir=tbdir)
+    # writing happens in background so queued values must be written at exit
+    writer = AsyncSummaryWriter(log_dir=tbdir,
+        max_queue=conf_common['tb_max_queue'],
+        downsample_steps=conf_common['tb_downsample_steps'])
+    atexit.register(writer.close)
+    return writer
 
 def _setup_dirs()->Optional[str]:
     conf_common = get_conf_common()
@@ -145,14 +163,25 @@ def _setup_dirs()->Optional[str]:
 
     return expdir
 
-def _setup_logger():
+def _setup_distributed()->bool:
+    """Returns True if this process is master"""
+    conf_common = get_conf_common()
+    if conf_common['distributed']:
+        if not dist_utils.init(conf_common['dist_backend']):
+            print('common.distributed is True but process was not started '
+                  'by torchrun, running as single process')
+    return dist_utils.is_master()
+
+def _setup_logger(is_master=True):
     experiment_name = get_experiment_name()
 
-    # file where logger would log messages
-    log_filepath = expdir_abspath('logs.log')
+    # file where logger would log messages, other ranks only show warnings
+    log_filepath = expdir_abspath('logs.log') if is_master else None
     global _logger
-    _logger = utils.setup_logging(filepath=log_filepath, name=experiment_name)
-    if not log_filepath:
+    _logger = utils.setup_logging(filepath=log_filepath, name=experiment_name,
+                                  level=logging.INFO if is_master \
+                                        else logging.WARNING)
+    if is_master and not log_filepath:
         _logger.warn(
             'logdir not specified, no logs will be created or any models saved')
 
@@ -160,7 +189,8 @@ def _setup_gpus():
     conf_common = get_conf_common()
     logger = get_logger()
 
-    if conf_common['gpus'] is not None:
+    # with torch.distributed each rank uses GPU of its LOCAL_RANK
+    if conf_common['gpus'] is not None and not dist_utils.is_distributed():
         csv = str(conf_common['gpus'])
         #os.environ['CUDA_VISIBLE_DEVICES'] = str(conf_common['gpus'])
         torch.cuda.set_device(int(csv.split(',')[0]))
@@ -9,6 +9,8 @@ from PIL import Image
 
 from torch.utils.data import \
     SubsetRandomSampler, Sampler, Subset, ConcatDataset, Dataset, random_split
+from torch.utils.data.distributed import DistributedSampler
+from torch.utils.data.dataloader import default_collate
 from torchvision.transforms import transforms
 from sklearn.model_selection import StratifiedShuffleSplit
 
@@ -50,12 +52,14 @@ def get_data(conf_loader:Config)\
     val_ratio = conf_loader['val_ratio']
     val_fold = conf_loader['val_fold']
     horovod = conf_loader['horovod']
+    distributed = conf_loader['distributed']
     load_train = conf_loader['load_train']
     train_batch = conf_loader['train_batch']
     train_workers = conf_loader['train_workers']
     load_test = conf_loader['load_test']
     test_batch = conf_loader['test_batch']
     test_workers = conf_loader['test_workers']
+    channels_last = conf_loader['channels_last']
     # endregion
 
     train_dl, val_dl, test_dl, *_ = get_dataloaders(dataroot, ds_name,
@@ -63,7 +67,8 @@ def get_data(conf_loader:Config)\
         load_test=load_test, test_batch_size=test_batch,
         aug=aug, cutout=cutout,  val_ratio=val_ratio, val_fold=val_fold,
         train_workers=train_workers, test_workers=test_workers, horovod=horovod,
-        max_batches=max_batches)
+        max_batches=max_batches, channels_last=channels_last,
+        distributed=distributed)
 
     assert train_dl is not None
     return train_dl, val_dl, test_dl
@@ -73,9 +78,15 @@ def get_dataloaders(dataroot:str, dataset:str,
     load_test:bool, test_batch_size:int,
     aug, cutout:int, val_ratio:float, val_fold=0,
     train_workers:Optional[int]=None, test_workers:Optional[int]=None,
-    horovod=False, target_lb=-1, max_batches:int=-1) \
+    horovod=False, target_lb=-1, max_batches:int=-1, n_views:int=1,
+    channels_last=False, distributed=False) \
         -> Tuple[Optional[DataLoader], Optional[DataLoader],
                  Optional[DataLoader], Optional[Sampler]]:
+    """If n_views > 1 then each train/val sample is returned as n_views
+    augmented views of the same decoded image stacked in dim 0. If
+    channels_last is True then images are returned in NHWC memory format.
+    If distributed is True then each torch.distributed rank gets its own
+    shard of train, val and test sets."""
 
     logger = get_logger()
 
@@ -91,6 +102,8 @@ def get_dataloaders(dataroot:str, dataset:str,
 
     # get usual random crop/flip transforms
     transform_train, transform_test = get_transforms(dataset, aug, cutout)
+    if n_views > 1:
+        transform_train = MultiViewTransform(transform_train, n_views)
 
     trainset, testset = _get_datasets(dataset, dataroot,
         load_train, load_test, transform_train, transform_test,
@@ -103,26 +116,31 @@ def get_dataloaders(dataroot:str, dataset:str,
     #     logger.info('set_preaug-')
 
     trainloader, validloader, testloader, train_sampler = None, None, None, None
+    collate_fn = channels_last_collate if channels_last else default_collate
 
     if trainset:
         # sample validation set from trainset if cv_ration > 0
         train_sampler, valid_sampler = _get_train_sampler(val_ratio, val_fold,
-            trainset, horovod, target_lb)
+            trainset, horovod, target_lb, distributed=distributed)
         trainloader = torch.utils.data.DataLoader(trainset,
             batch_size=train_batch_size, shuffle=True if train_sampler is None else False,
             num_workers=train_workers, pin_memory=True,
-            sampler=train_sampler, drop_last=True)
-        if train_sampler is not None:
+            sampler=train_sampler, drop_last=True, collate_fn=collate_fn)
+        if val_ratio > 0.0:
             validloader = torch.utils.data.DataLoader(trainset,
                 batch_size=train_batch_size, shuffle=False,
                 num_workers=train_workers, pin_memory=True, #TODO: set n_workers per ratio?
-                sampler=valid_sampler, drop_last=False)
+                sampler=valid_sampler, drop_last=False, collate_fn=collate_fn)
         # else validloader is left as None
     if testset:
+        # shards are padded to same size by repeating few samples so all
+        # ranks run same number of steps
+        test_sampler = DistributedSampler(testset, shuffle=False) \
+                       if distributed else None
         testloader = torch.utils.data.DataLoader(testset,
             batch_size=test_batch_size, shuffle=False,
             num_workers=test_workers, pin_memory=True,
-            sampler=None, drop_last=False
+            sampler=test_sampler, drop_last=False, collate_fn=collate_fn
     )
 
     assert val_ratio > 0.0 or validloader is None
@@ -135,6 +153,16 @@ def get_dataloaders(dataroot:str, dataset:str,
     # we have to return train_sampler because of horovod
     return trainloader, validloader, testloader, train_sampler
 
+def channels_last_collate(batch):
+    """Same as default_collate but images are in channels_last memory
+    format. This runs in loader workers so the training loop doesn't pay for
+    the conversion."""
+    x, y = default_collate(batch)
+    # images may have extra dims such as views, [batch, ..., C, H, W]
+    dims = list(range(x.dim()-3))
+    x = x.permute(*dims, -2, -1, -3).contiguous().permute(*dims, -1, -3, -2)
+    return x, y
+
 def get_transforms(dataset, aug:Union[List, str], cutout:int):
     if 'imagenet' in dataset:
         return _get_imagenet_transforms()
@@ -229,6 +257,17 @@ class Augmentation:
         return img
 
 
+class MultiViewTransform:
+    """Applies random transform n_views times on same image and stacks
+    the results so image is decoded only once for all views"""
+    def __init__(self, transform, n_views:int):
+        self.transform = transform
+        self.n_views = n_views
+
+    def __call__(self, img):
+        return torch.stack([self.transform(img) for _ in range(self.n_views)])
+
+
 class SubsetSampler(Sampler):
     r"""Samples elements from a given list of indices, without replacement.
 
@@ -245,6 +284,24 @@ class SubsetSampler(Sampler):
     def __len__(self):
         return len(self.indices)
 
+class DistributedSubsetSampler(Sampler):
+    """Samples this rank's shard of given indices, shuffled differently
+    each epoch set by set_epoch()"""
+
+    def __init__(self, indices, shuffle=True):
+        self.indices = indices
+        # DistributedSampler only needs len() of the dataset
+        self._sampler = DistributedSampler(indices, shuffle=shuffle)
+
+    def __iter__(self):
+        return (self.indices[i] for i in self._sampler)
+
+    def __len__(self):
+        return len(self._sampler)
+
+    def set_epoch(self, epoch:int)->None:
+        self._sampler.set_epoch(epoch)
+
 def _get_datasets(dataset, dataroot, load_train:bool, load_test:bool,
         transform_train, transform_test, train_max_size:int, test_max_size:int)\
             ->Tuple[DatasetLike, DatasetLike]:
@@ -385,7 +442,7 @@ def _get_datasets(dataset, dataroot, load_train:bool, load_test:bool,
 
 # target_lb allows to filter dataset for a specific class, not used
 def _get_train_sampler(val_ratio:float, val_fold:int, trainset, horovod,
-        target_lb:int=-1)->Tuple[Optional[Sampler], Sampler]:
+        target_lb:int=-1, distributed=False)->Tuple[Optional[Sampler], Sampler]:
     """Splits train set into train, validation sets, stratified rand sampling.
 
     Arguments:
@@ -430,6 +487,9 @@ def _get_train_sampler(val_ratio:float, val_fold:int, trainset, horovod,
             import horovod.torch as hvd
             train_sampler = torch.utils.data.distributed.DistributedSampler(
                     train_sampler, num_replicas=hvd.size(), rank=hvd.rank())
+        elif distributed: # val set is also sharded as darts trains alphas on it
+            train_sampler = DistributedSubsetSampler(train_idx)
+            valid_sampler = DistributedSubsetSampler(valid_idx)
     else:
         logger.info('Validation set is not produced')
 
@@ -440,6 +500,8 @@ def _get_train_sampler(val_ratio:float, val_fold:int, trainset, horovod,
             import horovod.torch as hvd
             train_sampler = torch.utils.data.distributed.DistributedSampler(
                     valid_sampler, num_replicas=hvd.size(), rank=hvd.rank())
+        elif distributed:
+            train_sampler = DistributedSampler(trainset)
         # else train_sampler is None
     return train_sampler, valid_sampler
 
@@ -0,0 +1,112 @@
+from typing import Iterable, List
+import contextlib
+import os
+
+import torch
+from torch import nn, Tensor
+import torch.distributed as dist
+
+def init(backend:str)->bool:
+    """Joins process group from environment set by torchrun, returns False
+    if this process was not started by torchrun"""
+    if 'WORLD_SIZE' not in os.environ:
+        return False
+    if not is_distributed():
+        dist.init_process_group(backend=backend, init_method='env://')
+        if torch.cuda.is_available():
+            torch.cuda.set_device(int(os.environ.get('LOCAL_RANK', 0)))
+    return True
+
+# set while code must run on this rank only, without collectives
+_local_only = False
+
+def is_distributed()->bool:
+    return not _local_only and dist.is_available() and dist.is_initialized()
+
+@contextlib.contextmanager
+def local_only():
+    """Code in this context runs as if process was not distributed, for
+    example, so each rank can probe on its own and one rank failing doesn't
+    leave others waiting in collectives"""
+    global _local_only
+    prev, _local_only = _local_only, True
+    try:
+        yield
+    finally:
+        _local_only = prev
+
+def world_size()->int:
+    return dist.get_world_size() if is_distributed() else 1
+
+def rank()->int:
+    return dist.get_rank() if is_distributed() else 0
+
+def is_master()->bool:
+    return rank() == 0
+
+def any_rank(flag:bool, device)->bool:
+    """True if flag is True on any of the ranks"""
+    if not is_distributed():
+        return flag
+    t = torch.tensor([float(flag)], device=device)
+    dist.all_reduce(t)
+    return bool(t.item() > 0.0)
+
+def all_reduce_min(values:List[float], device)->List[float]:
+    """Minimum of each value over all ranks"""
+    if not is_distributed() or not values:
+        return values
+    t = torch.tensor(values, dtype=torch.float64, device=device)
+    dist.all_reduce(t, op=dist.ReduceOp.MIN)
+    return t.tolist()
+
+def all_reduce_mean(tensors:List[Tensor])->List[Tensor]:
+    """Average of each tensor over all ranks, one all_reduce call is made
+    for all tensors"""
+    if not is_distributed() or not tensors:
+        return tensors
+    flat = torch.cat([t.reshape(-1) for t in tensors])
+    dist.all_reduce(flat)
+    flat /= world_size()
+    return [v.view_as(t) for v, t in
+            zip(flat.split([t.numel() for t in tensors]), tensors)]
+
+def all_reduce_grads(params:Iterable[Tensor])->None:
+    """Averages grads over all ranks. Param that didn't get grad on this
+    rank gets zero grad if any other rank has grad for it."""
+    if not is_distributed():
+        return
+    params = [p for p in params if p.requires_grad]
+    if not params:
+        return
+    # ranks must reduce same set of tensors
+    has_grad = torch.tensor([float(p.grad is not None) for p in params],
+                            device=params[0].device)
+    dist.all_reduce(has_grad)
+    params = [p for p, h in zip(params, has_grad.tolist()) if h > 0.0]
+    for p in params:
+        if p.grad is None:
+            p.grad = torch.zeros_like(p)
+
+    grads = [p.grad for p in params]
+    with torch.no_grad():
+        for g, r in zip(grads, all_reduce_mean(grads)):
+            g.copy_(r)
+
+def broadcast_module(module:nn.Module)->None:
+    """Makes params and buffers same as on rank 0"""
+    if not is_distributed():
+        return
+    with torch.no_grad():
+        for t in module.state_dict().values():
+            dist.broadcast(t, src=0)
+
+def average_buffers(module:nn.Module)->None:
+    """Averages float buffers such as BatchNorm running stats which are
+    updated from local batches on each rank"""
+    if not is_distributed():
+        return
+    buffers = [b for b in module.buffers() if b.is_floating_point()]
+    with torch.no_grad():
+        for b, r in zip(buffers, all_reduce_mean(buffers)):
+            b.copy_(r)
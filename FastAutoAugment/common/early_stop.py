@@ -0,0 +1,87 @@
+from typing import List, Optional, Tuple
+import math
+
+import numpy as np
+
+from .config import Config
+
+class LearningCurveStopper:
+    """Stops training that is unlikely to reach target test accuracy.
+
+    Parametric learning curves (power law, exponential and logarithmic) are
+    fit to top1 of test epochs done so far and extrapolated to the last
+    epoch. Predictions of curves are averaged with weights inversely
+    proportional to their fit error. Final top1 is assumed to be normally
+    distributed with this mean and std from both disagreement between curves
+    and fit error. Training should stop if probability of final top1 being
+    below target is at least confidence. Target is the larger of threshold
+    and best_known, which can be top1 of best run so far.
+    """
+
+    def __init__(self, conf_early_stop:Config, epochs:int)->None:
+        # region conf vars
+        self._min_epochs = conf_early_stop['min_epochs']
+        self._min_points = conf_early_stop['min_points']
+        self._threshold = conf_early_stop['threshold']
+        self._best_known = conf_early_stop['best_known']
+        self._confidence = conf_early_stop['confidence']
+        # endregion
+
+        self.epochs = epochs
+        targets = [t for t in (self._threshold, self._best_known) if t is not None]
+        self.target:Optional[float] = max(targets) if targets else None
+
+    def predict(self, history:List[Tuple[int, float]])->Tuple[float, float]:
+        """Returns mean and std of top1 predicted at the last epoch from
+        (epoch, top1) of test epochs"""
+        x = np.array([e for e, _ in history], dtype=np.float64)
+        y = np.array([t for _, t in history], dtype=np.float64)
+        fits = [_fit_pow(x, y, self.epochs), _fit_exp(x, y, self.epochs),
+                _fit_log(x, y, self.epochs)]
+        preds = np.clip([p for p, _ in fits], 0.0, 1.0)
+        mses = np.array([mse for _, mse in fits]) + 1.0e-8
+        weights = (1.0 / mses) / np.sum(1.0 / mses)
+        mean = float(np.sum(weights * preds))
+        var = np.sum(weights * (preds - mean)**2) + np.sum(weights * mses)
+        return mean, float(math.sqrt(var))
+
+    def evaluate(self, history:List[Tuple[int, float]])->Optional[dict]:
+        """Returns prediction with probability of final top1 being below
+        target and if training should stop, None if not enough history"""
+        if self.target is None or len(history) < self._min_points or \
+                history[-1][0] < self._min_epochs or \
+                history[-1][0] >= self.epochs:
+            return None
+        mean, std = self.predict(history)
+        prob_below = 0.5 * (1.0 + math.erf((self.target - mean) /
+                                           (std * math.sqrt(2.0))))
+        return {'epoch': history[-1][0], 'predicted_top1': mean, 'std': std,
+                'target': self.target, 'prob_below': prob_below,
+                'stop': prob_below >= self._confidence}
+
+def _lstsq(basis:np.ndarray, y:np.ndarray, basis_last:np.ndarray)\
+        ->Tuple[float, float]:
+    coef, *_ = np.linalg.lstsq(basis, y, rcond=None)
+    mse = float(np.mean((basis @ coef - y)**2))
+    return float(basis_last @ coef), mse
+
+def _best_of(fits:List[Tuple[float, float]])->Tuple[float, float]:
+    return min(fits, key=lambda f: f[1])
+
+def _fit_pow(x:np.ndarray, y:np.ndarray, last:int)->Tuple[float, float]:
+    # y = c - a * x^-alpha, linear in c, a for each alpha
+    return _best_of([_lstsq(np.stack([np.ones_like(x), -x**-alpha], axis=1),
+                            y, np.array([1.0, -float(last)**-alpha]))
+                     for alpha in np.linspace(0.1, 2.0, 20)])
+
+def _fit_exp(x:np.ndarray, y:np.ndarray, last:int)->Tuple[float, float]:
+    # y = c - a * exp(-b * x / last), linear in c, a for each b
+    return _best_of([_lstsq(np.stack([np.ones_like(x), -np.exp(-b*x/last)],
+                                     axis=1),
+                            y, np.array([1.0, -math.exp(-b)]))
+                     for b in np.geomspace(0.5, 50.0, 20)])
+
+def _fit_log(x:np.ndarray, y:np.ndarray, last:int)->Tuple[float, float]:
+    # y = a + b * log(x)
+    return _lstsq(np.stack([np.ones_like(x), np.log(x)], axis=1),
+                  y, np.array([1.0, math.log(last)]))
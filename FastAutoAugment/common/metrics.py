@@ -1,22 +1,36 @@
 import time
 import copy
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
 import pathlib
 
 from collections import defaultdict
+import numpy as np
+import torch
 from torch import Tensor
 
 import yaml
 
 from . import utils
+from . import dist_utils
 from .common import get_logger, get_tb_writer, expdir_abspath
 
 class Metrics:
-    """Record top1, top5, loss metrics, track best so far"""
-
-    def __init__(self, title:str, epochs: int, logger_freq:int=10) -> None:
+    """Record top1, top5, loss metrics, track best so far.
+
+    If phase_timing is True then time of each phase of a step such as data
+    loading, forward, backward is recorded by calling phase() at the end of
+    the phase. Per epoch means and percentiles of phase times, samples/sec
+    and fraction of epoch time spent waiting for data are kept in
+    phase_stats. On CUDA, device is synchronized before each phase ends so
+    asynchronous kernels are counted in the phase that launched them, this
+    slows down training.
+    """
+
+    def __init__(self, title:str, epochs: int, logger_freq:int=10,
+                 phase_timing:bool=False) -> None:
         self.logger_freq = logger_freq
         self.title, self.epochs = title, epochs
+        self.phase_timing = phase_timing
 
         self.top1 = utils.AverageMeter()
         self.top5 = utils.AverageMeter()
@@ -37,6 +51,9 @@ class Metrics:
 
         self.step_time.reset()
         self.epoch_time.reset()
+        self.phase_stats:List[dict] = []
+        # [epoch, top1] of each epoch that ran, epochs without test are skipped
+        self.top1_history:List[list] = []
         self._reset_epoch()
 
     def _reset_epoch(self)->None:
@@ -44,6 +61,14 @@ class Metrics:
         self.top5.reset()
         self.loss.reset()
         self.step = 0
+        # sums of loss, top1, top5 on device not yet added to meters
+        self._pending_sums:Optional[Tensor] = None
+        self._pending_cnt = 0
+        self._epoch_samples = 0
+        # phase times of each step, phases of current step
+        self._phase_times:Dict[str, List[float]] = {}
+        self._step_phases:Dict[str, float] = {}
+        self._phase_start_time = time.time()
 
     def pre_run(self, resuming:bool)->None:
         if not resuming:
@@ -65,17 +90,53 @@ class Metrics:
         self._step_end_time = time.time()
         self.step_time.update(self._step_end_time-self._step_start_time)
 
-        # update metrics after optimizer step
+        # update metrics after optimizer step, sums are kept on device
+        # because .item() would wait for device on every step
         batch_size = x.size(0)
         prec1, prec5 = utils.accuracy(logits, y, topk=(1, 5))
-        self.loss.update(loss.item(), batch_size)
-        self.top1.update(prec1.item(), batch_size)
-        self.top5.update(prec5.item(), batch_size)
+        step_sums = torch.stack([loss.detach().reshape(()), prec1, prec5])\
+                         .double() * batch_size
+        self._pending_sums = step_sums if self._pending_sums is None \
+                             else self._pending_sums + step_sums
+        self._pending_cnt += batch_size
+        self._epoch_samples += batch_size
         self.step += 1
         self.global_step += 1
 
         self.report_cur(steps)
 
+        if self.phase_timing:
+            self.phase('metrics')
+            for name, t in self._step_phases.items():
+                self._phase_times.setdefault(name, []).append(t)
+            self._step_phases = {}
+
+    def phase(self, name:str)->None:
+        """Records time since previous phase ended as time of phase name in
+        current step, time of phase that runs several times in step is added"""
+        if not self.phase_timing:
+            return
+        if torch.cuda.is_available() and torch.cuda.is_initialized():
+            torch.cuda.synchronize()
+        now = time.time()
+        self._step_phases[name] = self._step_phases.get(name, 0.0) + \
+                                  now - self._phase_start_time
+        self._phase_start_time = now
+
+    def _flush(self)->None:
+        """Moves pending sums from device to meters. With torch.distributed
+        sums are added over all ranks, ranks flush at same steps."""
+        if self._pending_sums is not None:
+            sums = torch.cat([self._pending_sums,
+                              self._pending_sums.new_tensor([self._pending_cnt])])
+            if dist_utils.is_distributed():
+                torch.distributed.all_reduce(sums)
+            loss_sum, top1_sum, top5_sum, cnt = sums.tolist()
+            self.loss.update_sum(loss_sum, int(cnt))
+            self.top1.update_sum(top1_sum, int(cnt))
+            self.top5.update_sum(top5_sum, int(cnt))
+            self._pending_sums, self._pending_cnt = None, 0
+
     def report_times(self)->None:
         logger = get_logger()
         logger.info(f'[{self.title}]  Times: {self.epoch_time.avg:.1f} s/epoch, '
@@ -86,9 +147,13 @@ class Metrics:
         self.epoch += 1
 
     def report_cur(self, steps: int):
-        if self.logger_freq > 0 and \
-                (self.step % self.logger_freq == 0 or \
-                 self.step == steps):
+        # metrics are only synced from device every logger_freq steps
+        if not (self.step == steps or (self.logger_freq > 0 and \
+                                       self.step % self.logger_freq == 0)):
+            return
+        self._flush()
+
+        if self.logger_freq > 0:
             logger = get_logger()
             logger.info(
                 f"[{self.title}] "
@@ -123,9 +188,68 @@ class Metrics:
             writer.add_scalar(f'{self.title}/lr', lr, self.global_step)
 
     def post_epoch(self):
+        self._flush()
         self._epoch_end_time = time.time()
-        self.epoch_time.update(self._epoch_end_time-self._epoch_start_time)
+        epoch_time = self._epoch_end_time-self._epoch_start_time
+        self.epoch_time.update(epoch_time)
+        if self._phase_times:
+            self._end_phases(epoch_time)
+        self._end_epoch()
+
+    def _end_phases(self, epoch_time:float)->None:
+        # times are of this rank when using torch.distributed
+        stats = {'epoch': self.epoch+1,
+                 'samples_per_sec': self._epoch_samples / epoch_time,
+                 'data_wait_frac': sum(sum(times) for name, times \
+                                       in self._phase_times.items() \
+                                       if name.endswith('data')) / epoch_time,
+                 'phases': {}}
+        for name, times in self._phase_times.items():
+            p50, p90, p99 = np.percentile(times, [50, 90, 99]).tolist()
+            stats['phases'][name] = {'mean': float(np.mean(times)),
+                                     'p50': p50, 'p90': p90, 'p99': p99}
+        self.phase_stats.append(stats)
+        self._phase_times = {}
+        self.report_phases(stats)
+
+    def report_phases(self, stats:dict)->None:
+        if self.logger_freq > 0:
+            logger = get_logger()
+            phases = ', '.join(f"{name} {s['mean']*1000:.1f}"
+                               f"/{s['p90']*1000:.1f}"
+                               for name, s in stats['phases'].items())
+            logger.info(f"[{self.title}] Epoch: {stats['epoch']} "
+                        f"Phase ms (mean/p90): {phases}, "
+                        f"{stats['samples_per_sec']:.1f} samples/s, "
+                        f"data wait {stats['data_wait_frac']:.1%}")
+
+        writer = get_tb_writer()
+        for name, s in stats['phases'].items():
+            writer.add_scalar(f'{self.title}/phase_ms/{name}',
+                              s['mean']*1000, self.global_step)
+        writer.add_scalar(f'{self.title}/samples_per_sec',
+                          stats['samples_per_sec'], self.global_step)
+        writer.add_scalar(f'{self.title}/data_wait_frac',
+                          stats['data_wait_frac'], self.global_step)
+
+    def merge_epoch(self, sums:Tuple[float, float, float], cnt:int, steps:int,
+                    epoch_time:float)->None:
+        """Records epoch that was run elsewhere, for example, in background
+        process, from sums of loss, top1, top5 over its cnt samples"""
+        self._reset_epoch()
+        loss_sum, top1_sum, top5_sum = sums
+        self.loss.update_sum(loss_sum, cnt)
+        self.top1.update_sum(top1_sum, cnt)
+        self.top5.update_sum(top5_sum, cnt)
+        self.step = steps
+        self.global_step += steps
+        self.report_cur(steps)
+        self.epoch_time.update(epoch_time)
+        self._end_epoch()
+
+    def _end_epoch(self)->None:
         self.increment_epoch()
+        self.top1_history.append([self.epoch, self.top1.avg])
 
         if self.best_top1 < self.top1.avg:
             self.best_epoch = self.epoch
@@ -135,6 +259,7 @@ class Metrics:
         return self.epoch == self.best_epoch
 
     def state_dict(self)->dict:
+        self._flush()
         d = utils.state_dict(self)
         assert isinstance(d, dict)
         return d
@@ -147,7 +272,8 @@ class Metrics:
         if save_path:
             if not save_path.endswith('.yaml'):
                 save_path += '.yaml'
-            pathlib.Path(save_path).write_text(yaml.dump(self))
+            if dist_utils.is_master():
+                pathlib.Path(save_path).write_text(yaml.dump(self))
         return save_path
 
 class Accumulator:
@@ -0,0 +1,252 @@
+from typing import Dict, List, Optional, Tuple
+import copy
+
+import torch
+from torch import nn, Tensor
+from torch.func import stack_module_state, functional_call, vmap
+from torch.utils.data import DataLoader
+
+from .metrics import Metrics
+from .trainer import create_tester, optim_steps, run_validation, \
+                     compute_loss, set_drop_path
+from .config import Config
+from . import utils
+from . import dist_utils
+from ..common.common import get_logger
+
+class _ModelGroup:
+    """Models of identical architecture trained together.
+
+    Parameters and buffers of all models are stacked along new first dim
+    and models are run with single vmapped call. Each model's tensors are
+    then made views into the stacked tensors so models remain usable on
+    their own (for testing, saving etc) without any copying back.
+    """
+    def __init__(self, models:List[nn.Module]) -> None:
+        self.models = models
+        if len(models) > 1:
+            self._params, self._buffers = stack_module_state(models)
+            for i, model in enumerate(models):
+                for name, p in model.named_parameters():
+                    p.data = self._params[name].data[i]
+                for name, b in model.named_buffers():
+                    b.data = self._buffers[name][i]
+            # parameter-less copy used only to run the forward code
+            self._base = copy.deepcopy(models[0]).to('meta')
+
+    def parameters(self)->List[Tensor]:
+        if len(self.models) == 1:
+            return list(self.models[0].parameters())
+        return list(self._params.values())
+
+    def modules(self)->List[nn.Module]:
+        return self.models if len(self.models) == 1 \
+                           else self.models + [self._base]
+
+    def forward(self, x:Tensor)->Tuple[Tensor, Optional[Tensor]]:
+        """Returns logits and aux logits, if any, with first dim as model"""
+        if len(self.models) == 1:
+            return _split_logits(self.models[0](x), unsqueeze=True)
+
+        def call_model(params, buffers, x:Tensor):
+            # vmap can't return None so aux logits are dropped if missing
+            logits, aux_logits = _split_logits(
+                functional_call(self._base, (params, buffers), (x,)))
+            return logits if aux_logits is None else (logits, aux_logits)
+
+        out = vmap(call_model, in_dims=(0, 0, None),
+                   randomness='different')(self._params, self._buffers, x)
+        return _split_logits(out)
+
+    def clip_grad(self, grad_clip:float)->None:
+        if len(self.models) == 1:
+            nn.utils.clip_grad_norm_(self.models[0].parameters(), grad_clip)
+            return
+
+        # clip each model by its own grad norm, same as clip_grad_norm_
+        grads = [p.grad for p in self._params.values() if p.grad is not None]
+        k = len(self.models)
+        norms = torch.stack([g.reshape(k, -1).norm(dim=1) for g in grads])\
+                     .norm(dim=0)
+        scale = (grad_clip / (norms + 1.0e-6)).clamp(max=1.0)
+        for g in grads:
+            g.mul_(scale.view(-1, *([1] * (g.dim()-1))))
+
+def _split_logits(out, unsqueeze=False)->Tuple[Tensor, Optional[Tensor]]:
+    logits, aux_logits = (out[0], out[1]) if isinstance(out, tuple) \
+                                          else (out, None)
+    if unsqueeze:
+        logits = logits.unsqueeze(0)
+        if aux_logits is not None:
+            aux_logits = aux_logits.unsqueeze(0)
+    return logits, aux_logits
+
+def _check_conf(conf_train:Config)->None:
+    """Raises NotImplementedError if conf_train uses Trainer features
+    that MultiTrainer doesn't have"""
+    conf_validation = conf_train['validation']
+    conf_early_stop, conf_budget = conf_train['early_stop'], conf_train['budget']
+    unsupported = {
+        'amp': conf_train['amp'],
+        'grad_accum_steps': conf_train['grad_accum_steps'] != 1,
+        'micro_batch': conf_train['micro_batch'],
+        'torch.distributed': dist_utils.is_distributed(),
+        'background validation': conf_validation is not None and \
+                                 conf_validation['background'],
+        'early_stop': conf_early_stop and conf_early_stop['enabled'],
+        'time budget': conf_budget and conf_budget['secs'] is not None,
+    }
+    used = [name for name, is_used in unsupported.items() if is_used]
+    if used:
+        raise NotImplementedError(f'{", ".join(used)} not supported by '
+                                  'MultiTrainer, use Trainer')
+
+def _arch_signature(model:nn.Module)->Tuple:
+    return (type(model),) + tuple((name, tuple(t.shape), t.dtype)
+        for name, t in model.state_dict().items())
+
+class MultiTrainer:
+    """Trains several models in single process from one stream of batches.
+
+    Data loading, decoding and augmentation cost is paid once for all
+    models instead of once per model. Models with identical architecture
+    are stacked and trained with vmap, other models take turns on the same
+    batch. Each model gets its own optimizer state, metrics and tester.
+    Checkpointing and amp are not supported, use Trainer for those.
+    """
+    def __init__(self, conf_train:Config, models:List[nn.Module], device,
+                 aux_tower:bool, stack:bool=True)->None:
+        logger = get_logger()
+
+        _check_conf(conf_train)
+
+        # region config vars
+        conf_lossfn = conf_train['lossfn']
+        self._aux_weight = conf_train['aux_weight']
+        self._grad_clip = conf_train['grad_clip']
+        self._drop_path_prob = conf_train['drop_path_prob']
+        self._logger_freq = conf_train['logger_freq']
+        self._title = conf_train['title']
+        self._epochs = conf_train['epochs']
+        self._conf_optim = conf_train['optimizer']
+        self._conf_sched = conf_train['lr_schedule']
+        conf_validation = conf_train['validation']
+        self._validation_freq = 0 if conf_validation is None else conf_validation['freq']
+        # endregion
+
+        self.models = models
+        self.device = device
+        self._aux_tower = aux_tower
+        self._lossfn = utils.get_lossfn(conf_lossfn).to(device)
+
+        # group models by architecture, group index -> model indices
+        groups:Dict[Tuple, List[int]] = {}
+        for i, model in enumerate(models):
+            key = _arch_signature(model) if stack else (i,)
+            groups.setdefault(key, []).append(i)
+        self._group_indices = list(groups.values())
+        self._groups = [_ModelGroup([models[i] for i in indices])
+                        for indices in self._group_indices]
+        logger.info(f'{len(models)} models are trained in '
+                    f'{len(self._groups)} groups of sizes '
+                    f'{[len(g) for g in self._group_indices]}')
+
+        self._metrics = [Metrics(f'{self._title}_{i}', self._epochs,
+                                 logger_freq=self._logger_freq)
+                         for i in range(len(models))]
+        self._testers = [create_tester(self._model_conf(conf_validation, i),
+                                       model, device, aux_tower=aux_tower,
+                                       epochs=self._epochs, amp=False)
+                         for i, model in enumerate(models)]
+
+    @staticmethod
+    def _model_conf(conf_validation:Optional[Config], i:int)->Optional[Config]:
+        if not conf_validation:
+            return None
+        conf_validation = copy.deepcopy(conf_validation)
+        conf_validation['title'] = f'{conf_validation["title"]}_{i}'
+        return conf_validation
+
+    def fit(self, train_dl:DataLoader, val_dl:Optional[DataLoader])->None:
+        # optimizer per group, stacked params keep per model optimizer state
+        self._optims = [utils.create_optimizer(self._conf_optim,
+                                               group.parameters())
+                        for group in self._groups]
+        self._scheds = [utils.create_lr_scheduler(self._conf_sched,
+                            self._epochs, optim, optim_steps(train_dl, 1))
+                        for optim in self._optims]
+
+        for metrics, tester in zip(self._metrics, self._testers):
+            metrics.pre_run(False)
+            if tester:
+                tester.pre_test(False)
+
+        for epoch in range(self._epochs):
+            set_drop_path((m for g in self._groups for m in g.modules()),
+                          self._drop_path_prob, epoch, self._epochs)
+
+            for indices, optim in zip(self._group_indices, self._optims):
+                for i in indices:
+                    self._metrics[i].pre_epoch(lr=optim.param_groups[0]['lr'])
+            self._train_epoch(train_dl)
+            self._post_epoch(val_dl)
+
+        for metrics, tester in zip(self._metrics, self._testers):
+            if tester:
+                tester.post_test()
+            metrics.post_run()
+
+        # make sure we don't keep references to the graph
+        del self._optims
+        del self._scheds
+
+    def get_metrics(self)->List[Tuple[Metrics, Optional[Metrics]]]:
+        return [(metrics, tester.get_metrics() if tester else None)
+                for metrics, tester in zip(self._metrics, self._testers)]
+
+    def _post_epoch(self, val_dl:Optional[DataLoader])->None:
+        for metrics, tester in zip(self._metrics, self._testers):
+            if val_dl and tester and self._validation_freq > 0:
+                run_validation(tester, val_dl, metrics.epoch, self._epochs,
+                               self._validation_freq)
+            metrics.post_epoch()
+
+    def _train_epoch(self, train_dl:DataLoader)->None:
+        steps = len(train_dl)
+        for group in self._groups:
+            for module in group.modules():
+                module.train()
+        for (sched, on_epoch) in self._scheds:
+            if sched and on_epoch:
+                sched.step()
+
+        for x, y in train_dl:
+            # batch is moved to device once and shared by all models
+            x, y = x.to(self.device), y.to(self.device, non_blocking=True)
+
+            for group, indices, optim, (sched, on_epoch) in zip(self._groups,
+                    self._group_indices, self._optims, self._scheds):
+                for i in indices:
+                    self._metrics[i].pre_step(x, y)
+
+                optim.zero_grad()
+
+                logits, aux_logits = group.forward(x)
+                if not self._aux_tower:
+                    aux_logits = None
+                losses = [compute_loss(self._lossfn, y, logits[j],
+                            self._aux_weight,
+                            aux_logits[j] if aux_logits is not None else None)
+                          for j in range(len(indices))]
+                # models are independent so grads of the sum are per model
+                torch.stack(losses).sum().backward()
+
+                group.clip_grad(self._grad_clip)
+
+                optim.step()
+                if sched and not on_epoch:
+                    sched.step()
+
+                for j, i in enumerate(indices):
+                    self._metrics[i].post_step(x, y, logits[j].detach(),
+                                               losses[j].detach(), steps)
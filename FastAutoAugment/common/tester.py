@@ -11,14 +11,16 @@ from overrides import EnforceOverrides
 from .metrics import Metrics
 from .config import Config
 from . import utils
+from .amp_utils import Amp
 
 class Tester(EnforceOverrides):
     """Evaluate model on given data"""
 
     def __init__(self, conf_eval:Config, model:nn.Module, device,
-                 aux_tower:bool, epochs:int=1)->None:
+                 aux_tower:bool, epochs:int=1, amp:bool=False)->None:
         self._title = conf_eval['title']
         self._logger_freq = conf_eval['logger_freq']
+        self._phase_timing = conf_eval['phase_timing']
         conf_lossfn = conf_eval['lossfn']
 
         self.model = model
@@ -26,6 +28,7 @@ class Tester(EnforceOverrides):
         self._aux_tower = aux_tower
         self._lossfn = utils.get_lossfn(conf_lossfn).to(device)
         self._metrics = self._create_metrics(epochs)
+        self._amp = Amp(amp, device)
 
     def test(self, test_dl: DataLoader)->None:
         # recreate metrics for this run
@@ -40,15 +43,19 @@ class Tester(EnforceOverrides):
         with torch.no_grad():
             for x, y in test_dl:
                 assert not self.model.training # derived class might alter the mode
+                self._metrics.phase('data')
 
                 # enable non-blocking on 2nd part so its ready when we get to it
                 x, y = x.to(self.device), y.to(self.device, non_blocking=True)
+                self._metrics.phase('h2d')
 
                 self.pre_step(x, y, self._metrics)
-                logits = self.model(x)
-                if self._aux_tower:
-                    logits = logits[0]
-                loss = self._lossfn(logits, y)
+                with self._amp.autocast():
+                    logits = self.model(x)
+                    if self._aux_tower:
+                        logits = logits[0]
+                    loss = self._lossfn(logits, y)
+                self._metrics.phase('forward')
                 self.post_step(x, y, logits, loss, steps, self._metrics)
         self._metrics.post_epoch()
 
@@ -77,5 +84,6 @@ class Tester(EnforceOverrides):
         metrics.post_step(x, y, logits, loss, steps)
 
     def _create_metrics(self, epochs:int):
-        return Metrics(self._title, epochs, logger_freq=self._logger_freq)
+        return Metrics(self._title, epochs, logger_freq=self._logger_freq,
+                       phase_timing=self._phase_timing)
 
@@ -1,5 +1,9 @@
-from typing import Callable, Tuple, Optional
+from typing import Callable, Iterable, Tuple, Optional
+import math
+import time
+import warnings
 
+import torch
 from torch import nn, Tensor
 from torch.optim.optimizer import Optimizer
 from torch.optim.lr_scheduler import _LRScheduler
@@ -9,11 +13,14 @@ from overrides import EnforceOverrides
 
 from .metrics import Metrics
 from .tester import Tester
+from .async_tester import AsyncTester
+from .early_stop import LearningCurveStopper
 from .config import Config
 from . import utils
+from . import dist_utils
 from ..common.common import get_logger
 from ..common.check_point import CheckPoint
-from .apex_utils import Amp
+from .amp_utils import Amp
 
 class Trainer(EnforceOverrides):
     def __init__(self, conf_train:Config, model:nn.Module, device,
@@ -22,7 +29,7 @@ class Trainer(EnforceOverrides):
 
         # region config vars
         conf_lossfn = conf_train['lossfn']
-        self._apex = conf_train['apex']
+        amp = conf_train['amp']
         self._aux_tower = aux_tower
         self._aux_weight = conf_train['aux_weight']
         self._grad_clip = conf_train['grad_clip']
@@ -32,37 +39,68 @@ class Trainer(EnforceOverrides):
         self._epochs = conf_train['epochs']
         self._conf_optim = conf_train['optimizer']
         self._conf_sched = conf_train['lr_schedule']
+        self._grad_accum_steps = conf_train['grad_accum_steps']
+        self._micro_batch = conf_train['micro_batch']
+        self._phase_timing = conf_train['phase_timing']
         conf_validation = conf_train['validation']
         self._validation_freq = 0 if conf_validation is None else conf_validation['freq']
+        conf_early_stop = conf_train['early_stop']
+        conf_budget = conf_train['budget']
+        self._budget_secs = conf_budget['secs'] if conf_budget else None
+        self._budget_probe_epochs = conf_budget['probe_epochs'] \
+                                    if conf_budget else 0
         # endregion
 
         self.check_point = check_point
         self.model = model
         self.device = device
         self._lossfn = utils.get_lossfn(conf_lossfn).to(device)
-        self._tester = Tester(conf_validation, model, device,
-                              aux_tower=aux_tower, epochs=self._epochs) \
-                        if conf_validation else None
+        self._tester = create_tester(conf_validation, model, device,
+                                     aux_tower=aux_tower, epochs=self._epochs,
+                                     amp=amp)
         self._metrics = self._create_metrics(self._epochs)
+        self._early_stop = LearningCurveStopper(conf_early_stop, self._epochs) \
+                           if conf_early_stop and conf_early_stop['enabled'] \
+                           else None
+        if self._early_stop is not None and self._tester is None:
+            raise ValueError('early_stop requires validation config')
+        self._stop_training = False
+        # budget time spent by previous runs that were checkpointed and if
+        # epochs were already set from measured epoch time
+        self._budget_spent, self._budget_planned = 0.0, False
         self._metrics.custom['param_byte_size'] = utils.param_size(self.model)
         logger.info("Model param size = %f MB", self._metrics.custom['param_byte_size']/1e6)
 
-        self._amp = Amp(self._apex)
+        self._amp = Amp(amp, device)
+
+        assert self._grad_accum_steps >= 1
+        # position of current batch in its gradient accumulation group
+        self._accum_size, self._accum_first, self._accum_last = 1, True, True
 
     def fit(self, train_dl:DataLoader, val_dl:Optional[DataLoader])->None:
         logger = get_logger()
+        self._fit_start_time = time.time()
+        if self._budget_secs is not None:
+            # schedule must be created for epochs planned before checkpoint
+            self._restore_budget()
+        if self._early_stop is not None:
+            self._restore_early_stop()
+
         # optimizers, schedulers needs to be recreated for each fit call
         # as they have state
-        optim = self.create_optimizer()
-        # apply scheduler before amp
-        self._sched, self._sched_on_epoch = self._create_scheduler(optim, len(train_dl))
-        # before checkpoint restore, convert to amp
-        # TODO: original model is lost after to_amp?
-        self.model, self._optim = self._amp.to_amp(self.model, optim)
+        self._optim = self.create_optimizer()
+        self._optim_steps = optim_steps(train_dl, self._grad_accum_steps)
+        self._sched, self._sched_on_epoch = self._create_scheduler(self._optim,
+                                                            self._optim_steps)
+        self._bn_modules = utils.bn_modules(self.model)
 
         start_epoch = 0
         if self.check_point is not None and 'trainer' in self.check_point:
             start_epoch = self._restore_checkpoint()
+        # epochs done before this fit, start_epoch is one more when resuming
+        self._fit_start_epoch = self._metrics.epoch
+        # all ranks start from rank 0 weights
+        dist_utils.broadcast_module(self.model)
 
         self.pre_fit(train_dl, val_dl, start_epoch>0)
 
@@ -72,14 +110,23 @@ class Trainer(EnforceOverrides):
 
         if self.check_point is not None:
             self.check_point.clear()
-        for epoch in range(start_epoch, self._epochs):
+        self._stop_training = False
+        epoch = start_epoch
+        # with time budget, epochs can change during fit
+        while epoch < self._epochs:
             self._set_drop_path(epoch, self._epochs)
 
             self.pre_epoch(train_dl, val_dl)
             self._train_epoch(train_dl)
             self.post_epoch(train_dl, val_dl)
+            epoch += 1
+            if self._stop_training:
+                logger.info(f'fit stopped early after epoch {epoch}')
+                break
 
         self.post_fit(train_dl, val_dl)
+        if self.check_point is not None:
+            self.check_point.wait() # last checkpoint may be written async
 
         # make sure we don't keep references to the graph
         del self._optim
@@ -115,19 +162,30 @@ class Trainer(EnforceOverrides):
 
     def pre_epoch(self, train_dl:DataLoader, val_dl:Optional[DataLoader])->None:
         self._metrics.pre_epoch(lr=self._optim.param_groups[0]['lr'])
+        # distributed samplers shuffle differently each epoch
+        for dl in (train_dl, val_dl):
+            if dl is not None and hasattr(dl.sampler, 'set_epoch'):
+                dl.sampler.set_epoch(self._metrics.epoch)
 
     def post_epoch(self, train_dl:DataLoader, val_dl:Optional[DataLoader])->None:
+        # BN running stats are from local batches of each rank
+        dist_utils.average_buffers(self.model)
+
+        # epochs may change so do this before last epoch is decided for test
+        if self._budget_secs is not None:
+            self._update_budget(self._metrics.epoch+1)
+
         # first run test before checkpointing
         if val_dl and self._tester and self._validation_freq > 0:
-            if self._metrics.epoch+1 % self._validation_freq == 0 or \
-                    self._metrics.epoch+1 >= self._epochs:
-                self._tester.test_epoch(val_dl)
-            else:
-                self._tester.increment_epoch()
+            run_validation(self._tester, val_dl, self._metrics.epoch,
+                           self._epochs, self._validation_freq)
+            if self._early_stop is not None:
+                self._update_early_stop()
 
         self._metrics.post_epoch()
-        if self.check_point is not None and \
-                self._metrics.epoch % self.check_point.freq == 0:
+        if self.check_point is not None and dist_utils.is_master() and \
+                self.check_point.is_due(self._metrics.epoch,
+                                        force=self._stop_training):
             self.check_point.new()
             self.update_checkpoint(self.check_point)
             self.check_point.commit()
@@ -140,6 +198,106 @@ class Trainer(EnforceOverrides):
         self._metrics.post_step(x, y, logits, loss, steps)
     #########################  hooks #########################
 
+    def _update_early_stop(self)->None:
+        # with background validation, history may lag behind training
+        assert self._early_stop is not None and self._tester is not None
+        test_metrics = self._tester.get_metrics()
+        prediction = self._early_stop.evaluate(test_metrics.top1_history)
+        if prediction is None:
+            return
+        test_metrics.custom['early_stop'] = prediction
+        get_logger().info(f'[{self._title}] early_stop: {prediction}')
+        # all ranks have same test metrics so they stop together
+        self._stop_training = prediction['stop']
+        if self._stop_training:
+            # makes this the last epoch so resumed run doesn't train further
+            self._set_epochs(self._metrics.epoch+1)
+
+    def _restore_early_stop(self)->None:
+        if self.check_point is not None and 'trainer' in self.check_point:
+            # checkpoint may have been saved without early stop
+            stopped_epochs = self.check_point['trainer'].get('early_stop_epochs',
+                                                             None)
+            if stopped_epochs is not None:
+                self._set_epochs(stopped_epochs)
+
+    def _budget_elapsed(self, all_ranks=True)->float:
+        elapsed = self._budget_spent + time.time() - self._fit_start_time
+        if not all_ranks or not dist_utils.is_distributed():
+            return elapsed
+        # ranks must plan same epochs
+        t = torch.tensor([elapsed], dtype=torch.float64, device=self.device)
+        return dist_utils.all_reduce_mean([t])[0].item()
+
+    def _restore_budget(self)->None:
+        budget_state = None
+        if self.check_point is not None and 'trainer' in self.check_point:
+            # checkpoint may have been saved without budget
+            budget_state = self.check_point['trainer'].get('budget', None)
+        if budget_state is None:
+            self._budget_spent, self._budget_planned = 0.0, False
+            return
+        self._budget_spent = budget_state['spent']
+        self._budget_planned = budget_state['planned']
+        self._set_epochs(budget_state['epochs'])
+
+    def _update_budget(self, epochs_done:int)->None:
+        """Sets epochs to fit in time budget from time per epoch measured in
+        first probe epochs, stops if next epoch won't finish in time. First
+        epoch of fit is only used for estimate if it's the only one."""
+        logger = get_logger()
+        elapsed = self._budget_elapsed()
+        epochs_run = epochs_done - self._fit_start_epoch
+        if epochs_run == 1:
+            # includes startup, first test and allocations
+            self._budget_warmup = elapsed
+            epoch_time = elapsed - self._budget_spent
+        else:
+            epoch_time = (elapsed - self._budget_warmup) / (epochs_run - 1)
+        if not self._budget_planned and \
+                epochs_run >= self._budget_probe_epochs:
+            epochs = max(epochs_done, epochs_done + \
+                         int((self._budget_secs - elapsed) / epoch_time))
+            logger.info(f'[{self._title}] time budget {self._budget_secs}s, '
+                        f'{epoch_time:.1f}s/epoch, epochs set to {epochs}')
+            self._set_epochs(epochs)
+            self._replan_scheduler(epochs_done)
+            self._budget_planned = True
+        if epochs_done < self._epochs and \
+                elapsed + epoch_time > self._budget_secs:
+            logger.info(f'[{self._title}] time budget {self._budget_secs}s '
+                        f'will be exceeded in next epoch')
+            # makes this the last epoch for test, checkpoint is forced by
+            # _stop_training so resume doesn't repeat epochs
+            self._set_epochs(epochs_done)
+            self._stop_training = True
+
+    def _set_epochs(self, epochs:int)->None:
+        self._epochs = epochs
+        self._metrics.epochs = epochs
+        if self._tester is not None:
+            self._tester.get_metrics().epochs = epochs
+        if self._early_stop is not None:
+            self._early_stop.epochs = epochs
+
+    def _replan_scheduler(self, epochs_done:int)->None:
+        """Recreates scheduler for new epochs and steps it to where it
+        would be after epochs_done, so LR schedule is stretched or compressed.
+        LR of epochs already done was from the old schedule."""
+        if self._sched is None:
+            return
+        for group in self._optim.param_groups:
+            group['lr'] = group['initial_lr']
+        self._sched, self._sched_on_epoch = self._create_scheduler(self._optim,
+                                                            self._optim_steps)
+        steps = epochs_done if self._sched_on_epoch \
+                else epochs_done * self._optim_steps
+        with warnings.catch_warnings():
+            # step() is called without optimizer.step()
+            warnings.simplefilter('ignore', UserWarning)
+            for _ in range(steps):
+                self._sched.step()
+
     def _restore_checkpoint(self)->int:
         logger = get_logger()
 
@@ -170,11 +328,20 @@ class Trainer(EnforceOverrides):
             'amp': self._amp.state_dict(),
             'tester': self._tester.state_dict() if self._tester is not None else None
         }
+        if self._early_stop is not None:
+            state['early_stop_epochs'] = self._epochs \
+                                         if self._stop_training else None
+        if self._budget_secs is not None:
+            # only master saves checkpoint so don't sync with other ranks
+            state['budget'] = {'spent': self._budget_elapsed(all_ranks=False),
+                               'epochs': self._epochs,
+                               'planned': self._budget_planned}
         self.check_point['trainer'] = state
 
     def _create_metrics(self, epochs:int):
         logger = get_logger()
-        m = Metrics(self._title, epochs,logger_freq=self._logger_freq)
+        m = Metrics(self._title, epochs,logger_freq=self._logger_freq,
+                    phase_timing=self._phase_timing)
         if self.check_point is not None and 'trainer' in self.check_point:
             logger.warn('Metrics loaded from exisitng checkpoint')
             m.load_state_dict(self.check_point['trainer']['metrics'])
@@ -187,54 +354,130 @@ class Trainer(EnforceOverrides):
         #       first epoch is not a waste. But then again, we lose first LR.
         if self._sched and self._sched_on_epoch:
             self._sched.step()
-        for x, y in train_dl:
+        for step, (x, y) in enumerate(train_dl):
             assert self.model.training # derived class might alter the mode
+            self._metrics.phase('data')
 
             # enable non-blocking on 2nd part so its ready when we get to it
             x, y = x.to(self.device), y.to(self.device, non_blocking=True)
+            self._metrics.phase('h2d')
+
+            # optimizer steps once every grad_accum_steps batches, last group
+            # in epoch may have fewer batches
+            group_start = step - step % self._grad_accum_steps
+            self._accum_size = min(self._grad_accum_steps, steps - group_start)
+            self._accum_first = step == group_start
+            self._accum_last = step == group_start + self._accum_size - 1
 
             self.pre_step(x, y)
 
-            self._optim.zero_grad()
+            if self._accum_first:
+                self._optim.zero_grad()
 
-            logits, aux_logits = self.model(x), None
-            if self._aux_tower:
-                assert isinstance(logits, Tuple) and len(logits) >=2
-                logits, aux_logits = logits[0], logits[1]
-            loss = self.compute_loss(self._lossfn, x, y, logits,
-                                    self._aux_weight, aux_logits)
+            logits, loss = self._forward_backward(x, y)
 
-            self._amp.backward(loss, self._optim)
+            if self._accum_last:
+                # grads are averaged over ranks once per optimizer step
+                dist_utils.all_reduce_grads(
+                    p for g in self._optim.param_groups for p in g['params'])
+                if dist_utils.is_distributed():
+                    self._metrics.phase('grad_sync')
 
-            # TODO: original darts clips alphas as well but pt.darts doesn't
-            self._amp.clip_grad(self._grad_clip, self.model, self._optim)
+                # TODO: original darts clips alphas as well but pt.darts doesn't
+                self._amp.clip_grad(self._grad_clip, self.model, self._optim)
+                self._metrics.phase('clip')
 
-            self._optim.step()
-            if self._sched and not self._sched_on_epoch:
-                self._sched.step()
+                self._amp.step(self._optim)
+                if self._sched and not self._sched_on_epoch:
+                    self._sched.step()
+                self._metrics.phase('optim')
 
             self.post_step(x, y, logits, loss, steps)
 
+    def _forward_backward(self, x:Tensor, y:Tensor)->Tuple[Tensor, Tensor]:
+        """Adds grads for batch to the accumulated grads, batch is split
+        into micro batches if needed. Returns logits and loss for the batch."""
+        chunks = utils.micro_batches(x, y, self._micro_batch)
+        batch_logits, batch_loss = [], torch.zeros((), device=x.device)
+        with utils.bn_momentum_split(self._bn_modules,
+                                     self._accum_size * len(chunks)):
+            for xc, yc, frac in chunks:
+                with self._amp.autocast():
+                    logits, aux_logits = self.model(xc), None
+                    if self._aux_tower:
+                        assert isinstance(logits, Tuple) and len(logits) >=2
+                        logits, aux_logits = logits[0], logits[1]
+                    loss = self.compute_loss(self._lossfn, xc, yc, logits,
+                                            self._aux_weight, aux_logits)
+                self._metrics.phase('forward')
+
+                # weights make accumulated grads same as for mean loss over
+                # all samples in the accumulation group
+                self._amp.backward(loss * (frac / self._accum_size))
+                self._metrics.phase('backward')
+
+                batch_logits.append(logits.detach())
+                batch_loss += loss.detach() * frac
+        logits = batch_logits[0] if len(batch_logits) == 1 \
+                 else torch.cat(batch_logits)
+        return logits, batch_loss
+
     def compute_loss(self, lossfn:Callable,
                      x:Tensor, y:Tensor, logits:Tensor,
                      aux_weight:float, aux_logits:Optional[Tensor])->Tensor:
-        loss = lossfn(logits, y)
-        if aux_weight > 0.0 and  aux_logits is not None:
-            loss += aux_weight * lossfn(aux_logits, y)
-        return loss
+        return compute_loss(lossfn, y, logits, aux_weight, aux_logits)
 
     def _set_drop_path(self, epoch:int, epochs:int)->None:
-        if self._drop_path_prob:
-            drop_prob = self._drop_path_prob * epoch / epochs
-            # set value as property in model (it will be used by forward())
-            # this is necessory when using DataParallel(model)
-            # https://github.com/pytorch/pytorch/issues/16885
-            m = self.model
-            if hasattr(self.model, 'module'): # for data parallel model
-                m = self.model.module
+        # set value as property in model (it will be used by forward())
+        # this is necessory when using DataParallel(model)
+        # https://github.com/pytorch/pytorch/issues/16885
+        m = self.model
+        if hasattr(self.model, 'module'): # for data parallel model
+            m = self.model.module
+        set_drop_path([m], self._drop_path_prob, epoch, epochs)
+
+# helpers below are shared with MultiTrainer
+
+def create_tester(conf_validation:Optional[Config], model:nn.Module, device,
+                  aux_tower:bool, epochs:int, amp:bool)->Optional[Tester]:
+    if not conf_validation:
+        return None
+    background_test = conf_validation['background']
+    if background_test and dist_utils.is_distributed():
+        raise NotImplementedError('background validation is not '
+                                  'supported with torch.distributed')
+    tester_type = AsyncTester if background_test else Tester
+    return tester_type(conf_validation, model, device, aux_tower=aux_tower,
+                       epochs=epochs, amp=amp)
+
+def optim_steps(train_dl:DataLoader, grad_accum_steps:int)->int:
+    # per step schedules such as one_cycle count optimizer steps, not batches
+    return math.ceil(len(train_dl) / grad_accum_steps)
+
+def run_validation(tester:Tester, val_dl:DataLoader, epoch:int, epochs:int,
+                   validation_freq:int)->None:
+    """Tests every validation_freq epochs and on last epoch, otherwise only
+    moves tester to next epoch"""
+    if (epoch+1) % validation_freq == 0 or epoch+1 >= epochs:
+        tester.test_epoch(val_dl)
+    else:
+        tester.increment_epoch()
+
+def compute_loss(lossfn:Callable, y:Tensor, logits:Tensor, aux_weight:float,
+                 aux_logits:Optional[Tensor])->Tensor:
+    loss = lossfn(logits, y)
+    if aux_weight > 0.0 and  aux_logits is not None:
+        loss += aux_weight * lossfn(aux_logits, y)
+    return loss
+
+def set_drop_path(modules:Iterable[nn.Module], drop_path_prob:float,
+                  epoch:int, epochs:int)->None:
+    if drop_path_prob:
+        drop_prob = drop_path_prob * epoch / epochs
+        for m in modules:
             if hasattr(m, 'drop_path_prob'):
                 m.drop_path_prob(drop_prob)
             else:
                 raise RuntimeError('Drop path value {} was specified but model'
                                    ' does not have drop_path_prob() method'\
-                                       .format(self._drop_path_prob))
+                                       .format(drop_path_prob))
@@ -5,7 +5,9 @@ import  numpy as np
 import  shutil
 import logging
 import csv
+import zipfile
 from collections import OrderedDict
+from contextlib import contextmanager
 import sys
 
 import  torch
@@ -36,6 +38,12 @@ class AverageMeter:
         self.cnt += n
         self.avg = self.sum / self.cnt
 
+    def update_sum(self, val_sum, n):
+        """Same as update() calls for n values that total val_sum"""
+        self.sum += val_sum
+        self.cnt += n
+        self.avg = self.sum / self.cnt
+
 
 def accuracy(output, target, topk=(1,)):
     """Computes the precision@k for the specified values of k"""
@@ -53,7 +61,7 @@ def accuracy(output, target, topk=(1,)):
 
     res = []
     for k in topk:
-        correct_k = correct[:k].view(-1).float().sum(0)
+        correct_k = correct[:k].reshape(-1).float().sum(0)
         res.append(correct_k.mul_(1.0 / batch_size))
 
     return res
@@ -83,7 +91,7 @@ class Cutout:
 
 def param_size(module:nn.Module):
     """count all parameters excluding auxiliary"""
-    return np.sum(v.numel() for name, v in module.named_parameters() \
+    return sum(v.numel() for name, v in module.named_parameters() \
         if "auxiliary" not in name)
 
 
@@ -108,7 +116,19 @@ def save(model, model_path):
 
 def load(model, model_path):
     #logger.info('load from model: {}'.format(model_path))
-    model.load_state_dict(torch.load(model_path))
+    model.load_state_dict(load_lazy(model_path))
+
+def load_lazy(filepath:str)->Any:
+    """Loads file saved by torch.save with tensors on CPU.
+
+    Tensor storages are memory mapped so they are read from disk only when
+    accessed, for example, when copied in load_state_dict, and opening large
+    checkpoint to restore part of it is fast. Files in legacy format or older
+    PyTorch versions fall back to regular load.
+    """
+    if zipfile.is_zipfile(filepath) and ensure_pytorch_ver('2.1', ''):
+        return torch.load(filepath, map_location='cpu', mmap=True)
+    return torch.load(filepath, map_location='cpu')
 
 def drop_path_(x, drop_prob, training):
     if training and drop_prob > 0.:
@@ -116,13 +136,96 @@ def drop_path_(x, drop_prob, training):
         # Bernoulli returns 1 with pobability p and 0 with 1-p.
         # Below generates tensor of shape (batch,1,1,1) filled with 1s and 0s
         #   as per keep_prob.
-        mask = torch.FloatTensor(x.size(0), 1, 1, 1).bernoulli_(keep_prob) \
-            .to(device=x.device)
+        # mask is created from x so it's on same device and each of the
+        # models stacked by vmap gets its own mask
+        mask = x.new_empty(x.size(0), 1, 1, 1).bernoulli_(keep_prob)
         # scale tensor by 1/p as we will be losing other values
         # for each tensor in batch, zero out values with probability p
         x.div_(keep_prob).mul_(mask)
     return x
 
+def micro_batches(x:torch.Tensor, y:torch.Tensor, micro_batch:Optional[int])\
+        ->List[Tuple[torch.Tensor, torch.Tensor, float]]:
+    """Splits batch into chunks of at most micro_batch samples. Each chunk
+    comes with fraction of batch it has so mean losses of chunks can be
+    weighted to get mean loss of the batch."""
+    if not micro_batch or x.size(0) <= micro_batch:
+        return [(x, y, 1.0)]
+    batch_size = x.size(0)
+    return [(xc, yc, xc.size(0) / batch_size) for xc, yc in \
+            zip(x.split(micro_batch), y.split(micro_batch))]
+
+@contextmanager
+def bn_momentum_split(bn_modules:List[nn.Module], n:int):
+    """BN running stats are updated on every forward. When one batch is
+    split into n forwards, momentum is reduced for the duration so running
+    stats decay by the same amount as for single forward of whole batch."""
+    if n <= 1:
+        yield
+        return
+    saved = [m.momentum for m in bn_modules]
+    for m in bn_modules:
+        if m.momentum is not None: # None means cumulative average
+            m.momentum = 1.0 - (1.0 - m.momentum) ** (1.0 / n)
+    try:
+        yield
+    finally:
+        for m, momentum in zip(bn_modules, saved):
+            m.momentum = momentum
+
+def bn_modules(model:nn.Module)->List[nn.Module]:
+    return [m for m in model.modules()
+            if isinstance(m, nn.modules.batchnorm._BatchNorm)]
+
+class FlatParams:
+    """Params whose data are views into one contiguous buffer.
+
+    Elementwise update of all params, such as w += eps * dw, can then be done
+    as one op on flat instead of looping over params. Tensors with same shapes
+    as params, for example, grads, are concatenated in same layout by cat().
+    Params stay views only as long as their data is not replaced, for example,
+    by moving module to other device. Params in channels_last format keep it,
+    their part of buffer is in NHWC order.
+    """
+    def __init__(self, params:Iterable[nn.Parameter])->None:
+        self.params = list(params)
+        assert self.params, 'no params to flatten'
+        assert len(set(id(p) for p in self.params)) == len(self.params), \
+            'params must be unique'
+        first = self.params[0]
+        assert all(p.dtype==first.dtype and p.device==first.device \
+                   for p in self.params), 'params must have same dtype, device'
+        # contiguous param may also pass channels_last check if it has
+        # dims of size 1, so contiguous is checked first
+        self._nhwc = [not p.is_contiguous() and p.dim()==4 and \
+                      p.is_contiguous(memory_format=torch.channels_last)
+                      for p in self.params]
+        assert all(p.is_contiguous() or nhwc \
+                   for p, nhwc in zip(self.params, self._nhwc)), \
+            'params must be contiguous or channels_last'
+
+        self.flat = torch.empty(sum(p.numel() for p in self.params),
+                                dtype=first.dtype, device=first.device)
+        offset = 0
+        with torch.no_grad():
+            for p, nhwc in zip(self.params, self._nhwc):
+                view = self.flat[offset:offset+p.numel()]
+                if nhwc:
+                    n, c, h, w = p.shape
+                    view = view.view(n, h, w, c).permute(0, 3, 1, 2)
+                else:
+                    view = view.view(p.shape)
+                view.copy_(p)
+                p.data = view
+                offset += p.numel()
+
+    def is_valid(self)->bool:
+        return self.params[0].data_ptr() == self.flat.data_ptr()
+
+    def cat(self, tensors:Iterable[torch.Tensor])->torch.Tensor:
+        return torch.cat([(t.permute(0, 2, 3, 1) if nhwc else t).reshape(-1)
+                          for t, nhwc in zip(tensors, self._nhwc)])
+
 def first_or_default(it:Iterable, default=None):
     for i in it:
         return i
@@ -138,22 +241,29 @@ def deep_update(d:MutableMapping, u:Mapping, map_type:Type[MutableMapping]=dict)
     return d
 
 def create_optimizer(conf_opt:Config, params)->Optimizer:
+    # multi-tensor updates, if None then PyTorch picks for SGD and Adam
+    foreach = conf_opt['foreach']
+    # older PyTorch versions don't have foreach argument
+    foreach_kwargs = {} if foreach is None else {'foreach': foreach}
     if conf_opt['type'] == 'sgd':
         return SGD(
            params,
             lr=conf_opt['lr'],
             momentum=conf_opt['momentum'],
             weight_decay=conf_opt['decay'],
-            nesterov=conf_opt['nesterov']
+            nesterov=conf_opt['nesterov'],
+            **foreach_kwargs
         )
     elif conf_opt['type'] == 'adam':
          return Adam(params,
             lr=conf_opt['lr'],
             betas=conf_opt['betas'],
-            weight_decay=conf_opt['decay'])
+            weight_decay=conf_opt['decay'],
+            **foreach_kwargs)
     elif conf_opt['type'] == 'cocob':
         return CocobBackprop(params,
-            alpha=conf_opt['alpha'])
+            alpha=conf_opt['alpha'],
+            foreach=bool(foreach))
     else:
         raise ValueError('invalid optimizer type=%s' % conf_opt['type'])
 
@@ -1,9 +1,9 @@
-from typing import Mapping, Optional, Union
+from typing import List, Mapping, Optional, Tuple, Union
 import copy
 
 import torch
 from torch.utils.data import DataLoader
-from torch import Tensor, nn, autograd
+from torch import Tensor, nn
 from torch.nn.modules.loss import _Loss
 from torch.optim.optimizer import Optimizer
 from torch.optim.lr_scheduler import _LRScheduler
@@ -13,9 +13,11 @@ from overrides import overrides
 from ..common.config import Config
 from ..nas.arch_trainer import ArchTrainer
 from ..common import utils
+from ..common import dist_utils
 from ..nas.model import Model
 from ..common.check_point import CheckPoint
 from ..common.common import get_logger
+from ..common.amp_utils import Amp
 
 
 class BilevelArchTrainer(ArchTrainer):
@@ -45,7 +47,8 @@ class BilevelArchTrainer(ArchTrainer):
         lossfn = utils.get_lossfn(self._conf_w_lossfn).to(self.device)
 
         self._bilevel_optim = _BilevelOptimizer(self._conf_alpha_optim, w_momentum,
-                                                w_decay, self.model, lossfn)
+                                                w_decay, self.model, lossfn,
+                                                self._micro_batch, self._amp)
         if resuming:
             self._bilevel_optim.load_state_dict(self.check_point['bilelvel_optim'])
 
@@ -81,9 +84,17 @@ class BilevelArchTrainer(ArchTrainer):
 
         x_val, y_val = x_val.to(self.device), y_val.to(
             self.device, non_blocking=True)
-
-        # update alphas
-        self._bilevel_optim.step(x, y, x_val, y_val, super().get_optimizer())
+        self._metrics.phase('alpha_data')
+
+        # update alphas, alpha grads are accumulated over same batches as
+        # w grads so alphas step once per w step
+        if self._accum_first:
+            self._bilevel_optim.zero_grad()
+        self._bilevel_optim.backward(x, y, x_val, y_val, super().get_optimizer(),
+                                     1.0 / self._accum_size)
+        if self._accum_last:
+            self._bilevel_optim.step()
+        self._metrics.phase('alpha')
 
     @overrides
     def update_checkpoint(self, check_point:CheckPoint)->None:
@@ -92,41 +103,67 @@ class BilevelArchTrainer(ArchTrainer):
 
 class _BilevelOptimizer:
     def __init__(self, conf_alpaha_optim:Config, w_momentum: float, w_decay: float,
-                 model: Model, lossfn: _Loss) -> None:
+                 model: Model, lossfn: _Loss, micro_batch:Optional[int],
+                 amp:Amp) -> None:
         logger = get_logger()
         self._w_momentum = w_momentum  # momentum for w
         self._w_weight_decay = w_decay  # weight decay for w
         self._lossfn = lossfn
+        self._micro_batch = micro_batch
+        self._amp = amp
         self._model = model  # main model with respect to w and alpha
 
         # create a copy of model which we will use
         # to compute grads for alphas without disturbing
         # original weights
         self._vmodel = copy.deepcopy(model)
+        # weights and alphas of both models are views into flat buffers so
+        # updates below are one op for all params instead of a loop
+        self._weights = utils.FlatParams(model.weights())
+        self._alphas = utils.FlatParams(model.alphas())
+        self._vweights = utils.FlatParams(self._vmodel.weights())
+        self._valphas = utils.FlatParams(self._vmodel.alphas())
         # this is the optimizer to optimize alphas parameter
-        self._alpha_optim = utils.create_optimizer(conf_alpaha_optim, model.alphas())
+        self._alpha_optim = utils.create_optimizer(conf_alpaha_optim,
+                                                   self._alphas.params)
+        # alpha grads are accumulated here instead of alpha.grad because
+        # w loss backward in trainer also adds grads to alphas
+        self._alpha_grads:Optional[List[Tensor]] = None
+        self._overflow = False # float16 overflow in any of accumulated grads
 
     def state_dict(self)->dict:
+        # vmodel is not saved as its weights and alphas are set from main
+        # model before every use
         return {
-            'alpha_optim': self._alpha_optim.state_dict(),
-            'vmodel': self._vmodel.state_dict()
+            'alpha_optim': self._alpha_optim.state_dict()
         }
 
     def load_state_dict(self, state_dict)->None:
-        self._vmodel.load_state_dict(state_dict['vmodel'])
+        # older checkpoints may also have vmodel which is not needed
         self._alpha_optim.load_state_dict(state_dict['alpha_optim'])
 
-    @staticmethod
-    def _get_loss(model, lossfn, x, y):
-        logits, *_ = model(x) # might also return aux tower logits
-        return lossfn(logits, y)
+    def _get_loss(self, model, x, y):
+        with self._amp.autocast():
+            logits, *_ = model(x) # might also return aux tower logits
+            return self._lossfn(logits, y)
+
+    def _grads(self, model, x, y, params:Tuple[Tensor, ...])->Tuple[Tensor, ...]:
+        """Grads of mean loss over batch wrt params, batch is split into
+        micro batches if needed"""
+        grads = None
+        for xc, yc, frac in utils.micro_batches(x, y, self._micro_batch):
+            loss = self._get_loss(model, xc, yc)
+            g = self._amp.grads(loss * frac, params)
+            grads = g if grads is None else \
+                    tuple(a + b for a, b in zip(grads, g))
+        assert grads is not None
+        return grads
 
     def _update_vmodel(self, x, y, lr: float, w_optim: Optimizer) -> None:
         """ Update vmodel with w' (main model has w) """
 
         # TODO: should this loss be stored for later use?
-        loss = _BilevelOptimizer._get_loss(self._model, self._lossfn, x, y)
-        gradients = autograd.grad(loss, self._model.weights())
+        gradients = self._grads(self._model, x, y, tuple(self._weights.params))
 
         """update weights in vmodel so we leave main model undisturbed
         The main technical difficulty computing w' without affecting alphas is
@@ -136,33 +173,54 @@ class _BilevelOptimizer:
         # TODO: other alternative may be to (1) copy model
         #   (2) set require_grads = False on alphas
         #   (3) loss and step on vmodel (4) set back require_grades = True
+        assert self._weights.is_valid() and self._vweights.is_valid(), \
+            'model params were replaced after bilevel optimizer was created'
         with torch.no_grad():  # no need to track gradient for these operations
-            for w, vw, g in zip(
-                    self._model.weights(), self._vmodel.weights(), gradients):
-                # simulate mometum update on model but put this update in vmodel
-                m = w_optim.state[w].get(
-                    'momentum_buffer', 0.)*self._w_momentum
-                vw.copy_(w - lr * (m + g + self._w_weight_decay*w))
+            w, g = self._weights.flat, self._weights.cat(gradients)
+            # simulate mometum update on model but put this update in vmodel
+            m_bufs = [w_optim.state[p].get('momentum_buffer', None)
+                      for p in self._weights.params]
+            m = 0. if all(b is None for b in m_bufs) else \
+                self._weights.cat(torch.zeros_like(p) if b is None else b
+                    for p, b in zip(self._weights.params, m_bufs)) \
+                * self._w_momentum
+            self._vweights.flat.copy_(w - lr * (m + g + self._w_weight_decay*w))
 
             # synchronize alphas
-            for a, va in zip(self._model.alphas(), self._vmodel.alphas()):
-                va.copy_(a)
+            self._valphas.flat.copy_(self._alphas.flat)
+
+    def zero_grad(self)->None:
+        self._alpha_grads = None
+        self._overflow = False
 
-    def step(self, x_train: Tensor, y_train: Tensor, x_valid: Tensor, y_valid: Tensor,
-             w_optim: Optimizer) -> None:
+    def backward(self, x_train: Tensor, y_train: Tensor, x_valid: Tensor,
+                 y_valid: Tensor, w_optim: Optimizer, grad_scale:float=1.0) -> None:
+        """Accumulates alpha grads for given batches times grad_scale"""
         # TODO: unlike darts paper, we get lr from optimizer insead of scheduler
         lr = w_optim.param_groups[0]['lr']
-        self._alpha_optim.zero_grad()
 
-        # compute the gradient and write it into tensor.grad
+        # compute the gradient using autograd
         # instead of generated by loss.backward()
         self._backward_bilevel(x_train, y_train, x_valid, y_valid,
-                               lr, w_optim)
-
-        # at this point we should have model with updated grades for w and alpha
+                               lr, w_optim, grad_scale)
+
+    def step(self) -> None:
+        overflow = self._overflow or \
+                   not self._amp.grads_finite(self._alpha_grads)
+        # all ranks must skip together, rank with overflow may not have grads
+        device = next(self._model.parameters()).device
+        if dist_utils.any_rank(overflow, device):
+            get_logger().debug('alpha step skipped because of float16 overflow')
+            return
+        # each rank computed alpha grads on its own shard of train, val sets
+        self._alpha_grads = dist_utils.all_reduce_mean(self._alpha_grads)
+        self._alpha_optim.zero_grad()
+        for alpha, g in zip(self._alphas.params, self._alpha_grads):
+            alpha.grad = g
         self._alpha_optim.step()
 
-    def _backward_bilevel(self, x_train, y_train, x_valid, y_valid, lr, w_optim):
+    def _backward_bilevel(self, x_train, y_train, x_valid, y_valid, lr, w_optim,
+                          grad_scale):
         """ Compute unrolled loss and backward its gradients """
 
         # update vmodel with w', but leave alphas as-is
@@ -172,18 +230,21 @@ class _BilevelOptimizer:
         # compute loss on validation set for model with w'
         # wrt alphas. The autograd.grad is used instead of backward()
         # to avoid having to loop through params
-        vloss = _BilevelOptimizer._get_loss(
-            self._vmodel, self._lossfn, x_valid, y_valid)
-
-        v_alphas = tuple(self._vmodel.alphas())
-        v_weights = tuple(self._vmodel.weights())
-        v_grads = autograd.grad(vloss, v_alphas + v_weights)
+        v_alphas = tuple(self._valphas.params)
+        v_weights = tuple(self._vweights.params)
+        v_grads = self._grads(self._vmodel, x_valid, y_valid,
+                              v_alphas + v_weights)
 
         # grad(L(w', a), a), part of Eq. 6
         dalpha = v_grads[:len(v_alphas)]
         # get grades for w' params which we will use it to compute w+ and w-
         dw = v_grads[len(v_alphas):]
 
+        # w+ and w- are applied to main model so they must not be inf or nan
+        if not self._amp.grads_finite(dw):
+            self._overflow = True
+            return
+
         hessian = self._hessian_vector_product(dw, x_train, y_train)
 
         # dalpha we have is from the unrolled model so we need to
@@ -191,10 +252,10 @@ class _BilevelOptimizer:
         # update final gradient = dalpha - xi*hessian
         # TODO: currently alphas lr is same as w lr
         with torch.no_grad():
-            for alpha, da, h in zip(self._model.alphas(), dalpha, hessian):
-                alpha.grad = da - lr*h
-        # now that model has both w and alpha grads,
-        # we can run w_optim.step() to update the param values
+            grads = [(da - lr*h) * grad_scale for da, h in zip(dalpha, hessian)]
+            self._alpha_grads = grads if self._alpha_grads is None else \
+                [a + g for a, g in zip(self._alpha_grads, grads)]
+        # step() will set these as alpha grads
 
     def _hessian_vector_product(self, dw, x, y, epsilon_unit=1e-2):
         """
@@ -211,36 +272,33 @@ class _BilevelOptimizer:
         is a multiplier on RHS of eq 8. So this scalling is essential
         in making sure that finite differences approximation is not way off
         Below, we flatten each w, concate all and then take norm"""
-        # TODO: is cat along dim 0 correct?
-        dw_norm = torch.cat([w.view(-1) for w in dw]).norm()
+        # dw is in same layout as flat weights
+        dw = self._weights.cat(dw)
+        dw_norm = dw.norm()
         epsilon = epsilon_unit / dw_norm
+        w = self._weights.flat
 
         # w+ = w + epsilon * grad(w')
         with torch.no_grad():
-            for p, v in zip(self._model.weights(), dw):
-                p += epsilon * v
+            w += epsilon * dw
 
         # Now that we have model with w+, we need to compute grads wrt alphas
         # This loss needs to be on train set, not validation set
-        loss = _BilevelOptimizer._get_loss(self._model, self._lossfn, x, y)
-        dalpha_plus = autograd.grad(
-            loss, self._model.alphas())  # dalpha{L_trn(w+)}
+        alphas = tuple(self._alphas.params)
+        dalpha_plus = self._grads(self._model, x, y, alphas) # dalpha{L_trn(w+)}
 
         # get model with w- and then compute grads wrt alphas
         # w- = w - eps*dw`
         with torch.no_grad():
-            for p, v in zip(self._model.weights(), dw):
-                # we had already added dw above so sutracting twice gives w-
-                p -= 2. * epsilon * v
+            # we had already added dw above so sutracting twice gives w-
+            w -= 2. * epsilon * dw
 
         # similarly get dalpha_minus
-        loss = _BilevelOptimizer._get_loss(self._model, self._lossfn, x, y)
-        dalpha_minus = autograd.grad(loss, self._model.alphas())
+        dalpha_minus = self._grads(self._model, x, y, alphas)
 
         # reset back params to original values by adding dw
         with torch.no_grad():
-            for p, v in zip(self._model.weights(), dw):
-                p += epsilon * v
+            w += epsilon * dw
 
         # apply eq 8, final difference to compute hessian
         h = [(p - m) / (2. * epsilon)
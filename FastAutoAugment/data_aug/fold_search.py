@@ -0,0 +1,190 @@
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from ..common.config import Config
+from ..common.common import get_logger
+from ..common.augmentations import augment_list
+from .tpe_search import TpeSearch
+from .halving import SuccessiveHalving
+from .trial_store import TrialStore, policy_hash
+from .surrogate import PolicySurrogate
+
+# (trial_id, rung, config, fidelity) of evaluation to run
+Job = Tuple[int, int, dict, float]
+
+class FoldSearch:
+    """TPE search state for one validation fold.
+
+    The search doesn't run anything itself; scheduler asks for jobs using
+    next_job() and reports their outcome using on_result() or on_failure()
+    so searches for many folds can share the same workers. If halving is
+    enabled, trials are evaluated on growing subsets of validation fold and
+    result['fidelity'] indicates the fraction used. If store is given,
+    policies already measured on this fold model are not evaluated again.
+    Trials whose policy is being evaluated at the same fidelity wait for
+    that evaluation and get its result instead of running again.
+    If surrogate is enabled, several TPE suggestions are drawn for each new
+    trial and only the one with best predicted reward is evaluated.
+    """
+    def __init__(self, space:dict, trial_config:dict, num_samples:int,
+                 reward_attr:str, conf_halving:Config, conf_surrogate:Config,
+                 store:Optional[TrialStore], ckpt_hash:str) -> None:
+        # region conf vars
+        halving_enabled = conf_halving['enabled']
+        min_fidelity = conf_halving['min_fidelity'] if halving_enabled else 1.0
+        eta = conf_halving['eta']
+        surrogate_enabled = conf_surrogate['enabled']
+        self._oversample = conf_surrogate['oversample']
+        # endregion
+
+        self.trial_config = trial_config
+        self.val_fold = trial_config['val_fold']
+        self.num_samples, self.reward_attr = num_samples, reward_attr
+        self._store, self._ckpt_hash = store, ckpt_hash
+
+        self._tpe = TpeSearch(space, seed=self.val_fold)
+        self._halving = SuccessiveHalving(min_fidelity, eta)
+        self._configs:Dict[int, dict] = {}
+        self._policy_hashes:Dict[int, str] = {}
+        # (policy hash, fidelity) being evaluated -> (trial_id, rung) waiting
+        self._in_flight:Dict[Tuple[str, float], List[Tuple[int, int]]] = {}
+        # waiting trials whose evaluation failed, to be run again
+        self._retry:List[Tuple[int, int]] = []
+        # trained on rewards at lowest fidelity, same as TPE
+        self._surrogate = PolicySurrogate(trial_config['num_policy'],
+            trial_config['num_op'], len(augment_list(False)),
+            conf_surrogate['min_samples']) if surrogate_enabled else None
+        self._predictions:Dict[int, float] = {}
+
+        # (config, result) for each successful evaluation
+        self.results:List[Tuple[dict, dict]] = []
+        self.submitted, self.failed, self.reused = 0, 0, 0
+        self.best_reward = float('-inf')
+
+        if store is not None:
+            self._resume()
+
+    def _resume(self)->None:
+        # trials measured by previous runs are told to TPE upfront
+        for p_hash, vals, p_results in self._store.fold_trials(self.val_fold,
+                                                               self._ckpt_hash):
+            rungs = [(self._halving.rung_of(r['fidelity']), r)
+                     for r in p_results]
+            rungs = [(rung, r) for rung, r in rungs if rung is not None]
+            if not rungs or rungs[0][0] != 0:
+                continue # TPE needs reward at lowest fidelity
+            # TPE sees rewards at same fidelity for all trials
+            trial_id, config = self._tpe.observe(vals,
+                                                 rungs[0][1][self.reward_attr])
+            config.update(self.trial_config)
+            self._configs[trial_id], self._policy_hashes[trial_id] = \
+                config, p_hash
+            for rung, result in rungs:
+                self._add_result(trial_id, rung, result)
+            self.submitted += 1
+        if self.submitted:
+            get_logger().info(f'fold={self.val_fold} resumed {self.submitted} '
+                              f'trials from {self._store.filepath}')
+
+    def next_job(self)->Optional[Job]:
+        """Returns next evaluation to run or None if there is nothing to run
+        until some of the running evaluations finish"""
+        while True:
+            # next_promotion() marks trial as promoted so only call if used
+            promotion = None if self._retry else self._halving.next_promotion()
+            if self._retry: # their evaluation failed while they waited
+                trial_id, rung = self._retry.pop(0)
+            elif promotion is not None: # promotions go first
+                trial_id, rung = promotion
+            elif self.submitted < self.num_samples:
+                trial_id, config = self._suggest()
+                config.update(self.trial_config)
+                self._configs[trial_id], rung = config, 0
+                self._policy_hashes[trial_id] = policy_hash(config,
+                    self.trial_config['num_policy'],
+                    self.trial_config['num_op'])
+                self.submitted += 1
+            else:
+                return None
+            fidelity = self._halving.fidelities[rung]
+
+            # equivalent policy may have been measured already
+            cached = self._store.get(self._policy_hashes[trial_id],
+                self.val_fold, self._ckpt_hash, fidelity) \
+                    if self._store is not None else None
+            if cached is None:
+                key = (self._policy_hashes[trial_id], fidelity)
+                if key in self._in_flight:
+                    self._in_flight[key].append((trial_id, rung))
+                    continue
+                self._in_flight[key] = []
+                return trial_id, rung, self._configs[trial_id], fidelity
+            self._reuse(trial_id, rung, cached)
+
+    def _reuse(self, trial_id:int, rung:int, result:dict)->None:
+        if rung == 0:
+            self._tpe.report(trial_id, result[self.reward_attr])
+        self._add_result(trial_id, rung, result)
+        self.reused += 1
+
+    def _pop_waiting(self, trial_id:int, rung:int)->List[Tuple[int, int]]:
+        return self._in_flight.pop((self._policy_hashes[trial_id],
+                                    self._halving.fidelities[rung]), [])
+
+    def _suggest(self)->Tuple[int, dict]:
+        if self._surrogate is None or not self._surrogate.ready():
+            return self._tpe.suggest()
+
+        # pre-screen suggestions so only the most promising one is evaluated
+        candidates = [self._tpe.suggest() for _ in range(self._oversample)]
+        predictions = self._surrogate.predict([c for _, c in candidates])
+        best = int(np.argmax(predictions))
+        self._tpe.discard(trial_id for i, (trial_id, _) in enumerate(candidates)
+                          if i != best)
+
+        trial_id, config = candidates[best]
+        self._predictions[trial_id] = float(predictions[best])
+        return trial_id, config
+
+    def on_result(self, trial_id:int, rung:int, result:dict)->None:
+        if self._store is not None:
+            self._store.put(self._policy_hashes[trial_id], self.val_fold,
+                self._ckpt_hash, result['fidelity'],
+                self._tpe.vals(trial_id), result)
+        if rung == 0:
+            self._tpe.report(trial_id, result[self.reward_attr])
+        self._add_result(trial_id, rung, result)
+        for waiting_id, waiting_rung in self._pop_waiting(trial_id, rung):
+            self._reuse(waiting_id, waiting_rung, result)
+
+    def on_failure(self, trial_id:int, rung:int)->None:
+        self._predictions.pop(trial_id, None)
+        if rung == 0:
+            self._tpe.report(trial_id, None)
+        self.failed += 1
+        # failure may be transient so waiting trials get their own run
+        self._retry.extend(self._pop_waiting(trial_id, rung))
+
+    def _add_result(self, trial_id:int, rung:int, result:dict)->None:
+        self._halving.add_result(trial_id, rung, result[self.reward_attr])
+        if rung == 0 and self._surrogate is not None:
+            reward = result[self.reward_attr]
+            self._surrogate.add(self._configs[trial_id], reward)
+            if trial_id in self._predictions:
+                self._surrogate.add_outcome(self._predictions.pop(trial_id),
+                                            reward)
+        self.results.append((self._configs[trial_id], result))
+        if rung == self._halving.top_rung:
+            self.best_reward = max(self.best_reward, result[self.reward_attr])
+
+    def __str__(self)->str:
+        s = f'fold={self.val_fold} submitted={self.submitted} ' \
+            f'done={len(self.results)} reused={self.reused} ' \
+            f'failed={self.failed} ' \
+            f'best {self.reward_attr}={self.best_reward:.4f}'
+        if self._surrogate is not None:
+            # keep surrogate honest by showing how well it ranks actual rewards
+            corr = self._surrogate.correlation()
+            s += ' surrogate_corr=' + ('n/a' if corr is None else f'{corr:.3f}')
+        return s
@@ -0,0 +1,49 @@
+from typing import Dict, List, Optional, Set, Tuple
+
+class SuccessiveHalving:
+    """Asynchronous successive halving (ASHA) of trials.
+
+    Trials are first evaluated at lowest fidelity (rung 0). Whenever a trial
+    is in top 1/eta of results of its rung, it is promoted to be evaluated
+    at next rung with eta times higher fidelity. The last rung always has
+    fidelity 1.0. If min_fidelity >= 1.0 then there is only one rung and
+    nothing is ever promoted.
+    """
+    def __init__(self, min_fidelity:float, eta:int) -> None:
+        assert eta >= 2 and min_fidelity > 0.0
+        self.eta = eta
+
+        self.fidelities = [1.0]
+        while self.fidelities[0] / eta >= min_fidelity - 1.0e-6:
+            self.fidelities.insert(0, self.fidelities[0] / eta)
+
+        self._rewards:List[Dict[int, float]] = [{} for _ in self.fidelities]
+        self._promoted:List[Set[int]] = [set() for _ in self.fidelities]
+
+    @property
+    def top_rung(self)->int:
+        return len(self.fidelities) - 1
+
+    def rung_of(self, fidelity:float)->Optional[int]:
+        for rung, f in enumerate(self.fidelities):
+            if abs(f - fidelity) < 1.0e-6:
+                return rung
+        return None
+
+    def add_result(self, trial_id:int, rung:int, reward:float)->None:
+        self._rewards[rung][trial_id] = reward
+        if rung > 0: # trial must have been promoted to get here
+            self._promoted[rung-1].add(trial_id)
+
+    def next_promotion(self)->Optional[Tuple[int, int]]:
+        """Returns (trial_id, rung) for trial to evaluate next at higher
+        fidelity, higher rungs get priority"""
+        for rung in reversed(range(self.top_rung)):
+            rewards = self._rewards[rung]
+            k = len(rewards) // self.eta
+            top = sorted(rewards, key=lambda t: rewards[t], reverse=True)[:k]
+            for trial_id in top:
+                if trial_id not in self._promoted[rung]:
+                    self._promoted[rung].add(trial_id)
+                    return trial_id, rung + 1
+        return None
@@ -0,0 +1,65 @@
+from typing import Callable, Optional, Tuple
+from collections import OrderedDict
+import os
+
+from torch import nn
+from torch.nn import DataParallel
+
+from ..common.utils import load_lazy
+
+_CacheKey = Tuple[str, float]
+
+class ModelCache:
+    """Per-process LRU cache of models loaded from checkpoints.
+
+    Key is checkpoint path along with its modification time so if checkpoint
+    gets overwritten, model is reloaded. Models are returned in eval mode and
+    must not be modified by callers.
+    """
+    def __init__(self, max_size:int) -> None:
+        assert max_size >= 1
+        self.max_size = max_size
+        self._models:'OrderedDict[_CacheKey, nn.Module]' = OrderedDict()
+
+    def get(self, save_path:str, create_fn:Callable[[], nn.Module])->nn.Module:
+        key = (os.path.abspath(save_path), os.path.getmtime(save_path))
+        model = self._models.get(key, None)
+        if model is not None:
+            self._models.move_to_end(key) # mark as most recently used
+            return model
+
+        # drop any stale entry for same path and then least recently used
+        for k in [k for k in self._models.keys() if k[0]==key[0]]:
+            del self._models[k]
+        while len(self._models) >= self.max_size:
+            self._models.popitem(last=False)
+
+        model = create_fn()
+        ckpt = load_lazy(save_path)
+        state_dict = ckpt['model'] if 'model' in ckpt else ckpt
+        # checkpoint may have been saved with or without DataParallel
+        is_dp = isinstance(model, DataParallel)
+        model.load_state_dict({('module.' if is_dp else '') + \
+                                    (k[len('module.'):] \
+                                     if k.startswith('module.') else k): v
+                               for k, v in state_dict.items()})
+        del ckpt, state_dict
+        model.eval()
+
+        self._models[key] = model
+        return model
+
+    def __len__(self)->int:
+        return len(self._models)
+
+    def clear(self)->None:
+        self._models.clear()
+
+# one cache per worker process
+_model_cache:Optional[ModelCache] = None
+
+def get_model_cache(max_size:int)->ModelCache:
+    global _model_cache
+    if _model_cache is None or _model_cache.max_size != max_size:
+        _model_cache = ModelCache(max_size)
+    return _model_cache
@@ -0,0 +1,79 @@
+"""Light weight progress channel between trainers and the search monitor.
+
+Trainers publish their progress in a tiny json sidecar file next to the model
+checkpoint. The file is written atomically (write to temp file + rename) so
+readers never see partial content. Monitor waits on completion events of the
+trainers and only reads these sidecar files to display progress instead of
+loading full model checkpoints.
+"""
+
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+from collections import OrderedDict
+import json
+import os
+import tempfile
+import time
+
+from tqdm import tqdm
+
+# (pending)->(done, still_pending), must return as soon as any item is done
+# or when timeout expires
+WaitFn = Callable[[List[Any], float], Tuple[List[Any], List[Any]]]
+
+def status_filepath(save_path:str)->str:
+    return save_path + '.status'
+
+def write_status(save_path:Optional[str], epoch:int, epochs:int,
+                 done:bool=False)->None:
+    """Atomically publish training progress for the model at save_path"""
+    if not save_path:
+        return
+    status = {'epoch': epoch, 'epochs': epochs, 'done': done,
+              'time': time.time()}
+    dirname = os.path.dirname(os.path.abspath(save_path))
+    fd, tmp_path = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(status, f)
+        os.replace(tmp_path, status_filepath(save_path))
+    except:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def read_status(save_path:str)->Optional[dict]:
+    try:
+        with open(status_filepath(save_path), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None # not yet published
+
+def clear_status(save_path:Optional[str])->None:
+    if save_path and os.path.exists(status_filepath(save_path)):
+        os.remove(status_filepath(save_path))
+
+def wait_with_progress(reqs:Sequence[Any], save_paths:Dict[str, str],
+                       epochs:int, wait_fn:WaitFn, refresh_secs=10.0)->None:
+    """Blocks until all reqs are done while displaying progress of trainers.
+
+    Arguments:
+        reqs -- handles to pending trainers understood by wait_fn
+        save_paths -- display name to checkpoint path of each trainer
+        epochs -- total epochs each trainer runs
+        wait_fn -- wakes up as soon as any trainer finishes
+        refresh_secs -- max time to wait between progress display refresh
+    """
+    pending = list(reqs)
+    with tqdm(total=epochs) as pbar:
+        while pending:
+            _, pending = wait_fn(pending, refresh_secs)
+
+            epochs_per_model = OrderedDict()
+            for name, save_path in save_paths.items():
+                status = read_status(save_path)
+                if status is not None:
+                    epochs_per_model[name] = epochs if status['done'] \
+                                                    else status['epoch']
+            pbar.set_postfix(epochs_per_model)
+            if len(epochs_per_model) == len(save_paths):
+                pbar.update(max(0, min(epochs_per_model.values())-pbar.n))
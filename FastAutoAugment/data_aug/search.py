@@ -1,67 +1,32 @@
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
+from concurrent.futures import Future, wait, FIRST_COMPLETED
 from hyperopt import hp
-from ray.tune.trial_runner import TrialRunner # will be patched but not used
-import gorilla
-from ray.tune.trial import Trial
-from ray.tune.suggest import HyperOptSearch
-from ray.tune import register_trainable, run_experiments
-import numpy as np
 import copy
 import json
 from collections import OrderedDict
-import ray
 import torch
 import time
 import os
-from tqdm import tqdm
+
+from torch.utils.data import DataLoader
 
 from ..common.aug_policies import remove_deplicates, policy_decoder
-from ..common.data import get_dataloaders
-from ..common.metrics import Accumulator
+from ..common.data import get_dataloaders, SubsetSampler
 from ..networks import get_model, num_class
 from ..common.augmentations import augment_list
 from .train import train_and_eval
+from . import progress
+from .model_cache import get_model_cache
+from .search_backends import SearchBackend, create_backend
+from .shared_data import get_worker_dataset, get_val_loader
+from .fold_search import FoldSearch
+from .trial_store import TrialStore, policy_hash, file_hash
 from ..common.common import get_logger, expdir_abspath
 
 from ..common.config import Config
 from ..common.stopwatch import StopWatch
 
 
-# this method is overriden version of ray.tune.trial_runner.TrialRunner.step using monkey patching
-def _step_w_log(self):
-    logger = get_logger()
-
-    original = gorilla.get_original_attribute(ray.tune.trial_runner.TrialRunner,
-        'step')
-
-    # collect counts by status for all trials
-    cnts = OrderedDict()
-    for status in [Trial.RUNNING, Trial.TERMINATED, Trial.PENDING, Trial.PAUSED,
-            Trial.ERROR]:
-        cnt = len(list(filter(lambda x: x.status == status, self._trials)))
-        cnts[status] = cnt
-
-    # get the best top1 accuracy from all finished trials so far
-    best_top1_acc = 0.
-    for trial in filter(lambda x: x.status == Trial.TERMINATED, self._trials):
-        if not trial.last_result: # TODO: why would this happen?
-            continue
-        best_top1_acc = max(best_top1_acc, trial.last_result['top1_valid'])
-
-    # display best accuracy from all finished trial
-    logger.info('iter', self._iteration, 'top1_acc=%.3f' % best_top1_acc, cnts, end='\r')
-
-    # call original step method
-    return original(self)
-
-# override ray.tune.trial_runner.TrialRunner.step method so we can print best accuracy at each step
-patch = gorilla.Patch(ray.tune.trial_runner.TrialRunner, 'step', _step_w_log,
-    settings=gorilla.Settings(allow_hit=True))
-gorilla.apply(patch)
-
-
-
-@ray.remote(num_gpus=torch.cuda.device_count(), max_calls=1)
 def _train_model(conf, dataroot, augment, val_ratio, val_fold, save_path=None,
         only_eval=False):
     Config.set(conf)
@@ -72,17 +37,28 @@ def _train_model(conf, dataroot, augment, val_ratio, val_fold, save_path=None,
         save_path=save_path, only_eval=only_eval)
     return model_type, val_fold, result
 
+def _futures_wait(pending:list, timeout:float)->Tuple[list, list]:
+    done, not_done = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+    return list(done), list(not_done)
+
+def _wait_with_progress(reqs:List[Future], save_paths:Dict[str, str],
+                        epochs:int)->None:
+    # remove stale progress from any previous run
+    for save_path in save_paths.values():
+        if not os.path.exists(save_path):
+            progress.clear_status(save_path)
+    progress.wait_with_progress(reqs, save_paths, epochs, _futures_wait)
+
 def _get_model_filepath(dataset, model, tag)->Optional[str]:
     filename = '%s_%s_%s.model' % (dataset, model, tag)
     return expdir_abspath(filename)
 
-def _train_no_aug(conf):
+def _train_no_aug(conf, backend:SearchBackend):
     logger, sw = get_logger(), StopWatch.get()
 
     # region conf vars
     conf_data     = conf['dataset']
-    dataroot    = conf['dataroot']
-    redis_ip    = conf['redis']
+    dataroot    = conf_data['dataroot']
     conf_loader = conf['autoaug']['loader']
     conf_model  = conf['autoaug']['model']
     model_type  = conf_model['type']
@@ -90,7 +66,6 @@ def _train_no_aug(conf):
     aug         = conf_loader['aug']
     cutout      = conf_loader['cutout']
     val_ratio   = conf_loader['val_ratio']
-    batch_size  = conf_loader['batch']
     epochs      = conf_loader['epochs']
     val_fold    = conf_loader['val_fold']
     cv_num      = conf_loader['cv_num']
@@ -110,53 +85,36 @@ def _train_no_aug(conf):
     #   but do we really need deepcopy everywhere?
     reqs = [
         # TODO: eliminate need for deep copy as only aug key is changed
-        _train_model.remote(copy.deepcopy(copy.deepcopy(conf)), dataroot,
-            aug, val_ratio, i,save_path=save_paths[i], only_eval=True)
+        backend.submit_train(_train_model, copy.deepcopy(conf), dataroot,
+            aug, val_ratio, i, save_path=save_paths[i], only_eval=True)
         for i in range(cv_num)]
 
-    # we now probe saved models for each fold to check the epoch number
-    # they are on. When every fold crosses an epoch number, we update
-    # the progress.
-    tqdm_epoch = tqdm(range(epochs))
-    is_done = False
-    for epoch in tqdm_epoch:
-        while True:
-            epochs_per_cv = OrderedDict()
-            for cv_idx in range(cv_num):
-                try:
-                    if os.path.exists(save_paths[cv_idx]):
-                        latest_ckpt = torch.load(save_paths[cv_idx])
-                        if 'epoch' not in latest_ckpt:
-                            epochs_per_cv['cv%d' % (cv_idx + 1)] = epochs
-                            continue
-                    else:
-                        continue
-                    epochs_per_cv['cv%d' % (cv_idx+1)] = latest_ckpt['epoch']
-                except Exception as e:
-                    continue
-            tqdm_epoch.set_postfix(epochs_per_cv)
-            if len(epochs_per_cv) == cv_num and min(epochs_per_cv.values()) >= epochs:
-                is_done = True
-            if len(epochs_per_cv) == cv_num and min(epochs_per_cv.values()) >= epoch:
-                break
-            time.sleep(10)
-        if is_done:
-            break
+    # trainers publish progress in tiny sidecar files so we can track
+    # progress without loading model checkpoints
+    _wait_with_progress(reqs, OrderedDict(('cv%d' % (i+1), save_paths[i])
+                                          for i in range(cv_num)), epochs)
 
     logger.info('getting results...')
-    pretrain_results = ray.get(reqs)
+    pretrain_results = [req.result() for req in reqs]
     for r_model, r_cv, r_dict in pretrain_results:
         logger.info('model=%s cv=%d top1_train=%.4f top1_valid=%.4f' %
             (r_model, r_cv+1, r_dict['top1_train'], r_dict['top1_valid']))
     logger.info('processed in %.4f secs' % sw.pause('train_no_aug'))
 
 def search(conf):
+    # trials and trainings run on Ray or local process pool as per config
+    backend = create_backend(conf)
+    try:
+        _search(conf, backend)
+    finally:
+        backend.shutdown()
+
+def _search(conf, backend:SearchBackend):
     logger, sw = get_logger(), StopWatch.get()
 
     # region conf vars
     conf_data     = conf['dataset']
-    dataroot    = conf['dataroot']
-    redis_ip    = conf['redis']
+    dataroot    = conf_data['dataroot']
     conf_loader = conf['autoaug']['loader']
     conf_model  = conf['autoaug']['model']
     model_type  = conf_model['type']
@@ -164,22 +122,20 @@ def search(conf):
     aug         = conf_loader['aug']
     val_ratio   = conf_loader['val_ratio']
     epochs      = conf_loader['epochs']
-    val_fold    = conf_loader['val_fold']
     cv_num      = conf_loader['cv_num']
     num_policy = conf['autoaug']['num_policy']
     num_op = conf['autoaug']['num_op']
     num_search = conf['autoaug']['num_search']
     num_result_per_cv = conf['autoaug']['num_result_per_cv']
-    smoke_test = conf['smoke_test']
-    resume = conf['resume']
+    max_concurrent = conf['autoaug']['max_concurrent']
+    conf_halving = conf['autoaug']['halving']
+    conf_surrogate = conf['autoaug']['surrogate']
+    trial_store_filename = conf['autoaug']['trial_store']
+    smoke_test = conf['common']['smoke_test']
     # endregion
 
-    ray.init(redis_address=redis_ip,
-        # allocate all GPUs on local node if cluster is not specified
-        num_gpus=torch.cuda.device_count() if not redis_ip else None)
-
     # first train with no aug
-    _train_no_aug(conf)
+    _train_no_aug(conf, backend)
 
     # get values from config
     num_samples = 4 if smoke_test else num_search
@@ -203,53 +159,58 @@ def search(conf):
             space['level_%d_%d' % (i, j)] = hp.uniform('level_%d_ %d' %
                 (i, j), 0.0, 1.0)
 
+    # results persist across runs so resumed search skips measured policies
+    store = TrialStore(expdir_abspath(trial_store_filename)) \
+            if trial_store_filename else None
+
     final_policy_set = []
     total_computation = 0
     reward_attr = 'top1_valid'      # top1_valid or minus_loss
     for _ in range(1):  # run multiple times.
+        # each fold has its own TPE state but all folds share workers
+        searches = []
         for val_fold in range(cv_num):
-            name = "search_%s_%s_fold%d_ratio%.1f" % (ds_name,
-                model_type, val_fold, val_ratio)
-            #logger.info(name)
-            register_trainable(name, (lambda augs,
-                rpt: _eval_tta(copy.deepcopy(copied_c), augs, rpt)))
-            algo = HyperOptSearch(space, max_concurrent=4*20,
-                reward_attr=reward_attr)
-
-            exp_config = {
-                name: {
-                    'run': name,
-                    'num_samples': num_samples,
-                    'resources_per_trial': {'gpu': 1},
-                    'stop': {'training_iteration': num_policy},
-                    'config': {
-                        'dataroot': dataroot, 'save_path': save_paths[val_fold],
-                        'val_ratio': val_ratio, 'val_fold': val_fold,
-                        'num_op': num_op, 'num_policy': num_policy
-                    },
-                }
+            trial_config = {
+                'dataroot': dataroot, 'save_path': save_paths[val_fold],
+                'val_ratio': val_ratio, 'val_fold': val_fold,
+                'num_op': num_op, 'num_policy': num_policy
             }
-            results = run_experiments(exp_config, search_alg=algo,
-                scheduler=None, verbose=0, queue_trials=True,
-                resume=resume, raise_on_failed_trial=False)
-
-            results = [x for x in results if x.last_result is not None]
-            results = sorted(results, key=lambda x: x.last_result[reward_attr],
+            # stored results are valid only for same fold model
+            ckpt_hash = file_hash(save_paths[val_fold])
+            searches.append(FoldSearch(space, trial_config, num_samples,
+                reward_attr, conf_halving, conf_surrogate, store, ckpt_hash))
+        _run_fold_searches(copied_c, backend, searches, max_concurrent)
+
+        for fold_search in searches:
+            results = fold_search.results
+
+            # calculate computation usage, including partial evaluations
+            for _, result in results:
+                total_computation += result['elapsed_time']
+
+            # only policies evaluated on full validation fold are ranked
+            results = [r for r in results if r[1]['fidelity'] == 1.0]
+            results = sorted(results, key=lambda x: x[1][reward_attr],
                 reverse=True)
-
-            # calculate computation usage
-            for result in results:
-                total_computation += result.last_result['elapsed_time']
-
-            for result in results[:num_result_per_cv]:
-                final_policy = policy_decoder(result.config, num_policy, num_op)
+            # equivalent policies share results, keep only one of them
+            unique_results, unique_hashes = [], set()
+            for config, result in results:
+                p_hash = policy_hash(config, num_policy, num_op)
+                if p_hash not in unique_hashes:
+                    unique_hashes.add(p_hash)
+                    unique_results.append((config, result))
+
+            for config, result in unique_results[:num_result_per_cv]:
+                final_policy = policy_decoder(config, num_policy, num_op)
                 logger.info('loss=%.12f top1_valid=%.4f %s' %
-                    (result.last_result['minus_loss'],
-                        result.last_result['top1_valid'], final_policy))
+                    (result['minus_loss'], result['top1_valid'], final_policy))
 
                 final_policy = remove_deplicates(final_policy)
                 final_policy_set.extend(final_policy)
 
+    if store is not None:
+        store.close()
+
     logger.info(json.dumps(final_policy_set))
     logger.info('final_policy=%d' % len(final_policy_set))
     logger.info('processed in %.4f secs, gpu hours=%.4f' % (sw.pause('search'), total_computation / 3600.))
@@ -262,41 +223,19 @@ def search(conf):
         % (val_ratio, _)) for _ in range(num_experiments)]
     augment_path = [_get_model_filepath(ds_name, model_type, 'ratio%.1f_augment%d'  \
         % (val_ratio, _)) for _ in range(num_experiments)]
-    reqs = [_train_model.remote(copy.deepcopy(copied_c), dataroot, aug, 0.0, 0, save_path=default_path[_], only_eval=True) \
+    reqs = [backend.submit_train(_train_model, copy.deepcopy(copied_c), dataroot, aug, 0.0, 0, save_path=default_path[_], only_eval=True) \
         for _ in range(num_experiments)] + \
-        [_train_model.remote(copy.deepcopy(copied_c), dataroot, final_policy_set, 0.0, 0, save_path=augment_path[_]) \
+        [backend.submit_train(_train_model, copy.deepcopy(copied_c), dataroot, final_policy_set, 0.0, 0, save_path=augment_path[_]) \
             for _ in range(num_experiments)]
 
-    tqdm_epoch = tqdm(range(epochs))
-    is_done = False
-    for epoch in tqdm_epoch:
-        while True:
-            epochs = OrderedDict()
-            for exp_idx in range(num_experiments):
-                try:
-                    if os.path.exists(default_path[exp_idx]):
-                        latest_ckpt = torch.load(default_path[exp_idx])
-                        epochs['default_exp%d' % (exp_idx + 1)] = latest_ckpt['epoch']
-                except:
-                    pass
-                try:
-                    if os.path.exists(augment_path[exp_idx]):
-                        latest_ckpt = torch.load(augment_path[exp_idx])
-                        epochs['augment_exp%d' % (exp_idx + 1)] = latest_ckpt['epoch']
-                except:
-                    pass
-
-            tqdm_epoch.set_postfix(epochs)
-            if len(epochs) == num_experiments*2 and min(epochs.values()) >= epochs:
-                is_done = True
-            if len(epochs) == num_experiments*2 and min(epochs.values()) >= epoch:
-                break
-            time.sleep(10)
-        if is_done:
-            break
+    status_paths = OrderedDict()
+    for exp_idx in range(num_experiments):
+        status_paths['default_exp%d' % (exp_idx + 1)] = default_path[exp_idx]
+        status_paths['augment_exp%d' % (exp_idx + 1)] = augment_path[exp_idx]
+    _wait_with_progress(reqs, status_paths, epochs)
 
     logger.info('getting results...')
-    final_results = ray.get(reqs)
+    final_results = [req.result() for req in reqs]
 
     for train_mode in ['default', 'augment']:
         avg = 0.
@@ -311,7 +250,58 @@ def search(conf):
     logger.info(sw)
 
 
-def _eval_tta(conf, augment, reporter):
+def _run_fold_searches(conf, backend:SearchBackend,
+        searches:List[FoldSearch], max_concurrent:int)->None:
+    """Interleaves trials of all fold searches on shared workers so workers
+    stay busy until last trial of last fold is done"""
+    logger = get_logger()
+
+    pending:Dict[Future, Tuple[FoldSearch, int, int]] = {}
+    while True:
+        # fill free slots round robin so all folds progress together
+        started = True
+        while started and len(pending) < max_concurrent:
+            started = False
+            for fold_search in searches:
+                if len(pending) >= max_concurrent:
+                    break
+                job = fold_search.next_job()
+                if job is not None:
+                    trial_id, rung, config, fidelity = job
+                    # same workers serve a fold so they keep only its model
+                    pending[backend.submit_trial(_eval_tta, conf, config,
+                        fidelity=fidelity, affinity=fold_search.val_fold)] = \
+                            (fold_search, trial_id, rung)
+                    started = True
+        if not pending:
+            break
+
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            fold_search, trial_id, rung = pending.pop(future)
+            try:
+                result = future.result()
+            except Exception as e:
+                logger.warning(f'fold={fold_search.val_fold} trial {trial_id} '
+                               f'failed at rung {rung}: {e}')
+                fold_search.on_failure(trial_id, rung)
+                continue
+            fold_search.on_result(trial_id, rung, result)
+
+        logger.info(f'running={len(pending)} ' + \
+                    ', '.join(str(fold_search) for fold_search in searches))
+
+def _fidelity_loader(loader:DataLoader, fidelity:float)->DataLoader:
+    # fixed prefix of (already shuffled) validation indices, so subsets are
+    # same for all trials and nested across fidelities
+    indices = list(loader.sampler.indices)
+    indices = indices[:max(1, int(round(len(indices) * fidelity)))]
+    return DataLoader(loader.dataset, batch_size=loader.batch_size,
+        sampler=SubsetSampler(indices), num_workers=loader.num_workers,
+        pin_memory=loader.pin_memory, drop_last=False,
+        collate_fn=loader.collate_fn)
+
+def _eval_tta(conf, augment, fidelity:float=1.0)->dict:
     Config.set(conf)
 
     # region conf vars
@@ -320,75 +310,73 @@ def _eval_tta(conf, augment, reporter):
     conf_model  = conf['autoaug']['model']
     ds_name     = conf_data['name']
     cutout   = conf_loader['cutout']
-    batch_size   = conf_loader['batch_size']
-    n_workers     = conf_loader['n_workers']
+    batch_size   = conf_loader['train_batch']
+    n_workers     = conf_loader['train_workers']
+    model_cache_size = conf['autoaug']['model_cache_size']
+    device = torch.device(conf['common']['device'])
+    channels_last = conf_loader['channels_last']
     # endregion
 
     val_ratio, val_fold, save_path = \
         augment['val_ratio'], augment['val_fold'], augment['save_path']
+    num_policy = augment['num_policy']
 
     # setup - provided augmentation rules
-    aug = policy_decoder(augment, augment['num_policy'], augment['num_op'])
-
-    # eval
-    model = get_model(conf_model, num_class(ds_name))
-    ckpt = torch.load(save_path)
-    if 'model' in ckpt:
-        model.load_state_dict(ckpt['model'])
+    aug = policy_decoder(augment, num_policy, augment['num_op'])
+
+    # eval, fold model is loaded only once per worker process
+    model = get_model_cache(model_cache_size).get(save_path,
+        lambda: get_model(conf_model, num_class(ds_name),
+                          channels_last=channels_last))
+    assert not model.training
+
+    # each image is decoded once and num_policy augmented views of it are
+    # stacked so all policies are evaluated in single forward pass,
+    # batch size is divided by views to keep same memory footprint
+    view_batch_size = max(1, batch_size // num_policy)
+    shared_dataset = get_worker_dataset()
+    if shared_dataset is not None: # local backend keeps decoded images for us
+        validloader = get_val_loader(shared_dataset, ds_name, aug, cutout,
+            val_ratio, val_fold, view_batch_size, n_views=num_policy,
+            channels_last=channels_last)
     else:
-        model.load_state_dict(ckpt)
-    model.eval()
-
-    loaders = []
-    for _ in range(augment['num_policy']):
-        tl, validloader, tl2, _ = get_dataloaders(augment['dataroot'], ds_name,
-            , aug, cutout,
-            load_train=True, load_test=True,
-            val_ratio=val_ratio, val_fold=val_fold, n_workers=n_workers)
-        loaders.append(iter(validloader))
-        del tl, tl2 # TODO: why exclude validloader?
+        _, validloader, _, _ = get_dataloaders(augment['dataroot'], ds_name,
+            load_train=True, train_batch_size=view_batch_size,
+            load_test=False, test_batch_size=batch_size,
+            aug=aug, cutout=cutout, val_ratio=val_ratio, val_fold=val_fold,
+            train_workers=n_workers, n_views=num_policy,
+            channels_last=channels_last)
+    if fidelity < 1.0:
+        validloader = _fidelity_loader(validloader, fidelity)
 
     start_t = time.time()
-    metrics = Accumulator()
     loss_fn = torch.nn.CrossEntropyLoss(reduction='none')
-    try:
-        while True:
-            losses = []
-            corrects = []
-            for loader in loaders:
-                data, label = next(loader)
-                data, label = data.cuda(), label.cuda()
-
-                pred = model(data)
-
-                loss = loss_fn(pred, label)
-                losses.append(loss.detach().cpu().numpy())
-
-                _, pred = pred.topk(1, 1, True, True)
-                pred = pred.t()
-                correct = pred.eq(label.view(1, -1).expand_as(pred)) \
-                    .detach().cpu().numpy()
-                corrects.append(correct)
-                del loss, correct, pred, data, label
-
-            losses = np.concatenate(losses)
-            losses_min = np.min(losses, axis=0).squeeze()
-
-            corrects = np.concatenate(corrects)
-            corrects_max = np.max(corrects, axis=0).squeeze()
-            metrics.add_dict({
-                'minus_loss': -1 * np.sum(losses_min),
-                'correct': np.sum(corrects_max),
-                'cnt': len(corrects_max)
-            })
-            del corrects, corrects_max
-    except StopIteration:
-        pass
-
-    del model
-    metrics = metrics / 'cnt'
+    # keep sums on device so we don't sync with host on every batch
+    minus_loss_sum = torch.zeros(1, device=device)
+    correct_sum = torch.zeros(1, dtype=torch.long, device=device)
+    cnt = 0
+    with torch.no_grad():
+        for data, label in validloader:
+            # data: [batch, views, C, H, W] -> [batch*views, C, H, W]
+            batch, views = data.size(0), data.size(1)
+            data = data.view(batch*views, *data.shape[2:]) \
+                .to(device, non_blocking=True)
+            label = label.to(device, non_blocking=True)
+
+            pred = model(data)
+
+            # for each image, keep best loss and correctness across views
+            loss = loss_fn(pred, label.repeat_interleave(views)) \
+                .view(batch, views)
+            correct = pred.argmax(dim=1).view(batch, views) == label.view(-1, 1)
+            minus_loss_sum -= loss.min(dim=1)[0].sum()
+            correct_sum += correct.any(dim=1).sum()
+            cnt += batch
+
+            del loss, correct, pred, data, label
+
+    minus_loss = minus_loss_sum.item() / cnt
+    top1_valid = correct_sum.item() / cnt
     gpu_secs = (time.time() - start_t) * torch.cuda.device_count()
-    reporter(minus_loss=metrics['minus_loss'], top1_valid=metrics['correct'],
-        elapsed_time=gpu_secs, done=True)
-    return metrics['correct']
-
+    return {'minus_loss': minus_loss, 'top1_valid': top1_valid,
+            'elapsed_time': gpu_secs, 'fidelity': fidelity}
@@ -0,0 +1,219 @@
+from typing import Callable, Dict, List, Optional, Tuple
+from abc import ABC, abstractmethod
+from concurrent.futures import Future, ProcessPoolExecutor
+import os
+import threading
+
+import torch
+
+from ..common.config import Config
+from ..common.common import get_logger
+from .shared_data import SharedImageDataset, init_worker
+
+class SearchBackend(ABC):
+    """Runs training and policy evaluation jobs, returns futures for them"""
+
+    @abstractmethod
+    def submit_train(self, fn:Callable, *args, **kwargs)->Future:
+        pass
+
+    @abstractmethod
+    def submit_trial(self, fn:Callable, *args, affinity:Optional[int]=None,
+                     **kwargs)->Future:
+        """Trials with same affinity are run on same worker(s) so per
+        process caches such as fold models stay small and warm"""
+        pass
+
+    def shutdown(self)->None:
+        pass
+
+class _AffinityRouter:
+    """Assigns fixed subset of workers to each affinity group and picks least
+    busy worker from the subset"""
+
+    def __init__(self, num_workers:int, num_groups:int)->None:
+        assert num_workers >= 1 and num_groups >= 1
+        self.num_groups = num_groups
+        self._busy = [0] * num_workers
+        self._lock = threading.Lock()
+
+    def workers(self, affinity:Optional[int])->List[int]:
+        num_workers = len(self._busy)
+        if affinity is None:
+            return list(range(num_workers))
+        group = affinity % self.num_groups
+        if num_workers <= self.num_groups: # worker serves multiple groups
+            return [group % num_workers]
+        return [w for w in range(num_workers) if w % self.num_groups == group]
+
+    def acquire(self, affinity:Optional[int])->int:
+        with self._lock:
+            worker = min(self.workers(affinity), key=lambda w: self._busy[w])
+            self._busy[worker] += 1
+            return worker
+
+    def release(self, worker:int)->None:
+        with self._lock:
+            self._busy[worker] -= 1
+
+class _TrialWorker:
+    """Ray actor, its process lives across trials so per process caches
+    stay warm"""
+    def run(self, fn:Callable, *args, **kwargs):
+        return fn(*args, **kwargs)
+
+class RayBackend(SearchBackend):
+    """Runs training as Ray tasks and trials on Ray actors on local node or
+    Ray cluster"""
+
+    def __init__(self, redis_ip:Optional[str], max_concurrent:int,
+                 num_groups:int)->None:
+        import ray # ray is optional dependency
+        self._ray = ray
+        ray.init(redis_address=redis_ip,
+            # allocate all GPUs on local node if cluster is not specified
+            num_gpus=torch.cuda.device_count() if not redis_ip else None)
+
+        # training gets all GPUs and fresh process, trials get one GPU each
+        # and run on long lived actors so per process caches stay warm
+        self._train_fn:Dict[Callable, Callable] = {}
+        self._max_concurrent, self._num_groups = max_concurrent, num_groups
+        self._workers:List = []
+        self._router:Optional[_AffinityRouter] = None
+        # single thread waits on all outstanding tasks to resolve futures
+        self._pending:Dict = {} # object ref -> future
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._waiter = threading.Thread(target=self._wait_loop, daemon=True,
+                                        name='RayBackendWaiter')
+        self._waiter.start()
+
+    def submit_train(self, fn:Callable, *args, **kwargs)->Future:
+        # actors hold GPUs that training needs
+        self._stop_workers()
+        if fn not in self._train_fn:
+            self._train_fn[fn] = self._ray.remote(
+                num_gpus=torch.cuda.device_count(), max_calls=1)(fn)
+        return self._submit(self._train_fn[fn], *args, **kwargs)
+
+    def submit_trial(self, fn:Callable, *args, affinity:Optional[int]=None,
+                     **kwargs)->Future:
+        if self._router is None:
+            self._start_workers()
+        router = self._router
+        worker = router.acquire(affinity)
+        future = self._submit(self._workers[worker].run, fn, *args, **kwargs)
+        future.add_done_callback(lambda _: router.release(worker))
+        return future
+
+    def _start_workers(self)->None:
+        resources = self._ray.cluster_resources()
+        num_gpus = int(resources.get('GPU', 0))
+        # one actor per trial slot, extra actors would never get resources
+        num_slots = num_gpus or int(resources.get('CPU', 1))
+        num_workers = max(1, min(self._max_concurrent, num_slots))
+        worker_cls = self._ray.remote(num_gpus=1 if num_gpus else 0)(
+            _TrialWorker)
+        self._workers = [worker_cls.remote() for _ in range(num_workers)]
+        self._router = _AffinityRouter(num_workers, self._num_groups)
+
+    def _stop_workers(self)->None:
+        for worker in self._workers:
+            self._ray.kill(worker)
+        self._workers, self._router = [], None
+
+    def _submit(self, remote_fn, *args, **kwargs)->Future:
+        future:Future = Future()
+        with self._cond:
+            self._pending[remote_fn.remote(*args, **kwargs)] = future
+            self._cond.notify()
+        return future
+
+    def _wait_loop(self)->None:
+        while True:
+            with self._cond:
+                while not self._pending and not self._stopping:
+                    self._cond.wait()
+                if self._stopping:
+                    return
+                obj_refs = list(self._pending.keys())
+            # timeout so tasks submitted meanwhile are also waited on
+            ready, _ = self._ray.wait(obj_refs, num_returns=1, timeout=1.0)
+            for obj_ref in ready:
+                with self._cond:
+                    future = self._pending.pop(obj_ref)
+                try:
+                    future.set_result(self._ray.get(obj_ref))
+                except Exception as e:
+                    future.set_exception(e)
+
+    def shutdown(self)->None:
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        self._waiter.join()
+        for future in self._pending.values():
+            future.cancel()
+        self._pending.clear()
+        self._stop_workers()
+
+class LocalBackend(SearchBackend):
+    """Runs jobs in local process pool, suitable for single many-core box.
+
+    Decoded train set is kept in shared memory so trials in worker processes
+    don't need to read and decode images.
+    """
+
+    def __init__(self, dataroot:str, ds_name:str,
+                 max_workers:Optional[int], num_groups:int)->None:
+        logger = get_logger()
+
+        self._dataset = SharedImageDataset.create(dataroot, ds_name)
+        logger.info(f'{len(self._dataset)} decoded images of {ds_name} '
+                    f'placed in shared memory {self._dataset.shm_name}')
+
+        # single process pools so trials can be routed to specific process
+        max_workers = max_workers or os.cpu_count()
+        self._trial_pools = [ProcessPoolExecutor(max_workers=1,
+                                initializer=init_worker,
+                                initargs=(self._dataset,))
+                             for _ in range(max_workers)]
+        self._router = _AffinityRouter(max_workers, num_groups)
+        # training uses its own data loaders and all cores
+        self._train_pool = ProcessPoolExecutor(max_workers=1)
+
+    def submit_train(self, fn:Callable, *args, **kwargs)->Future:
+        return self._train_pool.submit(fn, *args, **kwargs)
+
+    def submit_trial(self, fn:Callable, *args, affinity:Optional[int]=None,
+                     **kwargs)->Future:
+        worker = self._router.acquire(affinity)
+        future = self._trial_pools[worker].submit(fn, *args, **kwargs)
+        future.add_done_callback(lambda _: self._router.release(worker))
+        return future
+
+    def shutdown(self)->None:
+        for trial_pool in self._trial_pools:
+            trial_pool.shutdown()
+        self._train_pool.shutdown()
+        self._dataset.close(unlink=True)
+
+def create_backend(conf:Config)->SearchBackend:
+    # region conf vars
+    conf_autoaug = conf['autoaug']
+    backend = conf_autoaug['search_backend']
+    max_concurrent = conf_autoaug['max_concurrent']
+    local_workers = conf_autoaug['local_workers']
+    redis_ip = conf['common']['redis']
+    cv_num = conf_autoaug['loader']['cv_num']
+    dataroot = conf['dataset']['dataroot']
+    ds_name = conf['dataset']['name']
+    # endregion
+
+    # trials of each fold are routed to same workers
+    if backend == 'ray':
+        return RayBackend(redis_ip, max_concurrent, cv_num)
+    elif backend == 'local':
+        return LocalBackend(dataroot, ds_name, local_workers, cv_num)
+    else:
+        raise ValueError(f'invalid search_backend={backend}')
@@ -0,0 +1,108 @@
+from typing import List, Optional, Tuple
+from multiprocessing import shared_memory
+import copy
+
+import numpy as np
+from PIL import Image
+
+from torch.utils.data import Dataset, DataLoader
+from torch.utils.data.dataloader import default_collate
+
+from ..common.data import get_transforms, MultiViewTransform, \
+    channels_last_collate, _get_datasets, _get_train_sampler
+
+class SharedImageDataset(Dataset):
+    """Decoded uint8 images kept in shared memory.
+
+    The owner process decodes the dataset once using create(). Instances are
+    cheap to pickle (only the shared memory name is sent) so they can be
+    handed to worker processes which then attach to the same memory.
+    """
+
+    def __init__(self, shm_name:str, shape:Tuple[int, ...], targets:List[int],
+                 transform=None)->None:
+        self.shm_name, self.shape = shm_name, shape
+        self.targets = targets
+        self.transform = transform
+        self._shm:Optional[shared_memory.SharedMemory] = None
+        self._images:Optional[np.ndarray] = None
+
+    @staticmethod
+    def create(dataroot:str, ds_name:str)->'SharedImageDataset':
+        trainset, _ = _get_datasets(ds_name, dataroot,
+            load_train=True, load_test=False,
+            transform_train=None, transform_test=None,
+            train_max_size=0, test_max_size=0)
+
+        first = np.asarray(trainset[0][0], dtype=np.uint8)
+        shape = (len(trainset),) + first.shape
+        shm = shared_memory.SharedMemory(create=True,
+                                         size=int(np.prod(shape)))
+        images = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+        for i in range(len(trainset)):
+            images[i] = np.asarray(trainset[i][0], dtype=np.uint8)
+
+        ds = SharedImageDataset(shm.name, shape, list(trainset.targets))
+        ds._shm, ds._images = shm, images
+        return ds
+
+    def with_transform(self, transform)->'SharedImageDataset':
+        ds = copy.copy(self) # shares attached memory
+        ds.transform = transform
+        return ds
+
+    def _attach(self)->np.ndarray:
+        if self._images is None:
+            self._shm = shared_memory.SharedMemory(name=self.shm_name)
+            self._images = np.ndarray(self.shape, dtype=np.uint8,
+                                      buffer=self._shm.buf)
+        return self._images
+
+    def __len__(self)->int:
+        return self.shape[0]
+
+    def __getitem__(self, i):
+        img = Image.fromarray(self._attach()[i])
+        if self.transform is not None:
+            img = self.transform(img)
+        return img, self.targets[i]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_shm'], state['_images'] = None, None
+        return state
+
+    def close(self, unlink=False)->None:
+        self._images = None
+        if self._shm is not None:
+            self._shm.close()
+            if unlink:
+                self._shm.unlink()
+            self._shm = None
+
+# dataset shared by the process that owns the worker
+_worker_dataset:Optional[SharedImageDataset] = None
+
+def init_worker(dataset:Optional[SharedImageDataset])->None:
+    global _worker_dataset
+    _worker_dataset = dataset
+
+def get_worker_dataset()->Optional[SharedImageDataset]:
+    return _worker_dataset
+
+def get_val_loader(dataset:SharedImageDataset, ds_name:str, aug, cutout:int,
+                   val_ratio:float, val_fold:int, batch_size:int,
+                   n_views:int=1, channels_last=False)->DataLoader:
+    # NOTE: same as get_dataloaders, train transforms are applied to val set
+    transform, _ = get_transforms(ds_name, aug, cutout)
+    if n_views > 1:
+        transform = MultiViewTransform(transform, n_views)
+    dataset._attach() # so all copies share one attachment
+    dataset = dataset.with_transform(transform)
+    _, valid_sampler = _get_train_sampler(val_ratio, val_fold, dataset,
+                                          horovod=False)
+    # we are already in worker process so no more workers for loading
+    return DataLoader(dataset, batch_size=batch_size, sampler=valid_sampler,
+                      num_workers=0, drop_last=False,
+                      collate_fn=channels_last_collate if channels_last \
+                                 else default_collate)
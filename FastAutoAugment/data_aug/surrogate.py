@@ -0,0 +1,68 @@
+from typing import List, Optional
+
+import numpy as np
+from sklearn.ensemble import GradientBoostingRegressor
+
+class PolicySurrogate:
+    """Regressor that predicts reward of policy from its search config.
+
+    Config is encoded as one-hot op choice plus prob and level for each op.
+    Model is refit lazily when new rewards have been added. Predictions
+    made for trials that are later measured are kept so correlation with
+    actual rewards can be reported.
+    """
+    def __init__(self, num_policy:int, num_op:int, num_ops_available:int,
+                 min_samples:int) -> None:
+        self.num_policy, self.num_op = num_policy, num_op
+        self.num_ops_available = num_ops_available
+        self.min_samples = min_samples
+
+        self._x:List[np.ndarray] = []
+        self._y:List[float] = []
+        self._model:Optional[GradientBoostingRegressor] = None
+        self._fit_count = 0 # number of samples used in last fit
+
+        self._predicted:List[float] = []
+        self._actual:List[float] = []
+
+    def encode(self, config:dict)->np.ndarray:
+        features = []
+        for i in range(self.num_policy):
+            for j in range(self.num_op):
+                one_hot = np.zeros(self.num_ops_available)
+                one_hot[config['policy_%d_%d' % (i, j)]] = 1.0
+                features.append(one_hot)
+                features.append([config['prob_%d_%d' % (i, j)],
+                                 config['level_%d_%d' % (i, j)]])
+        return np.concatenate(features)
+
+    def add(self, config:dict, reward:float)->None:
+        self._x.append(self.encode(config))
+        self._y.append(reward)
+
+    def ready(self)->bool:
+        return len(self._y) >= self.min_samples
+
+    def predict(self, configs:List[dict])->np.ndarray:
+        assert self.ready()
+        if self._fit_count != len(self._y):
+            self._model = GradientBoostingRegressor(n_estimators=100,
+                max_depth=3, subsample=0.8, random_state=0)
+            self._model.fit(np.stack(self._x), np.array(self._y))
+            self._fit_count = len(self._y)
+        return self._model.predict(np.stack([self.encode(c)
+                                             for c in configs]))
+
+    def add_outcome(self, predicted:float, actual:float)->None:
+        self._predicted.append(predicted)
+        self._actual.append(actual)
+
+    def correlation(self)->Optional[float]:
+        """Spearman rank correlation between predicted and actual rewards"""
+        if len(self._actual) < 3:
+            return None
+        pred_ranks = np.argsort(np.argsort(self._predicted))
+        actual_ranks = np.argsort(np.argsort(self._actual))
+        if pred_ranks.std() == 0 or actual_ranks.std() == 0:
+            return None
+        return float(np.corrcoef(pred_ranks, actual_ranks)[0, 1])
@@ -0,0 +1,93 @@
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import copy
+
+import numpy as np
+from hyperopt import tpe, Trials, Domain, space_eval, STATUS_OK, STATUS_FAIL, \
+    JOB_STATE_DONE, JOB_STATE_ERROR
+
+class TpeSearch:
+    """In-process ask/tell interface over hyperopt's TPE.
+
+    Call suggest() to get new config to evaluate and report() its reward once
+    evaluation is done. Any number of suggestions may be pending at a time.
+    """
+    def __init__(self, space:dict, seed:int=0) -> None:
+        self._space = space
+        self._domain = Domain(lambda config: 0.0, space)
+        self._trials = Trials()
+        # trial docs by id, these are docs held by self._trials so updates
+        # to them are seen by TPE
+        self._docs:Dict[int, Dict] = {}
+        self._rng = np.random.RandomState(seed)
+
+    def suggest(self)->Tuple[int, dict]:
+        trial_id = self._trials.new_trial_ids(1)[0]
+        self._trials.refresh()
+        docs = tpe.suggest([trial_id], self._domain, self._trials,
+                           self._rng.randint(2**31-1))
+        self._insert(docs)
+
+        return trial_id, self._config(self.vals(trial_id))
+
+    def _insert(self, docs:List[Dict])->None:
+        # inserted docs are copies so we get them back after refresh
+        self._trials.insert_trial_docs(docs)
+        self._trials.refresh()
+        self._docs.update((doc['tid'], doc)
+                          for doc in self._trials.trials[-len(docs):])
+
+    def vals(self, trial_id:int)->Dict[str, Any]:
+        """Raw hyperopt values for the trial as plain python types"""
+        misc = self._trial_doc(trial_id)['misc']
+        return {k: v[0].item() if isinstance(v[0], np.generic) else v[0]
+                for k, v in misc['vals'].items() if len(v)}
+
+    def observe(self, vals:Dict[str, Any], reward:Optional[float])\
+            ->Tuple[int, dict]:
+        """Adds trial evaluated elsewhere, for example in previous run"""
+        trial_id = self._trials.new_trial_ids(1)[0]
+        misc = {'tid': trial_id, 'cmd': self._domain.cmd,
+                'workdir': self._domain.workdir,
+                'idxs': {k: ([trial_id] if k in vals else [])
+                         for k in self._domain.params},
+                'vals': {k: ([vals[k]] if k in vals else [])
+                         for k in self._domain.params}}
+        docs = self._trials.new_trial_docs([trial_id], [None], [{}], [misc])
+        self._insert(docs)
+        self.report(trial_id, reward)
+        return trial_id, self._config(vals)
+
+    def _config(self, vals:Dict[str, Any])->dict:
+        return space_eval(self._space, copy.deepcopy(vals))
+
+    def report(self, trial_id:int, reward:Optional[float])->None:
+        """Report reward (higher is better), None indicates failed trial"""
+        doc = self._trial_doc(trial_id)
+        if reward is None:
+            doc['state'] = JOB_STATE_ERROR
+            doc['result'] = {'status': STATUS_FAIL}
+        else:
+            doc['state'] = JOB_STATE_DONE
+            doc['result'] = {'loss': -reward, 'status': STATUS_OK}
+        self._trials.refresh()
+
+    def discard(self, trial_ids:Iterable[int])->None:
+        """Forget suggestions that won't be evaluated"""
+        for trial_id in trial_ids:
+            del self._docs[trial_id]
+        # Trials has no public way to remove single doc so kept docs are
+        # reinserted, trial ids already used are not given out again
+        kept = list(self._docs.values())
+        self._trials.delete_all()
+        self._docs.clear()
+        if kept:
+            self._insert(kept)
+
+    def _trial_doc(self, trial_id:int)->Dict:
+        doc = self._docs.get(trial_id, None)
+        if doc is None:
+            raise KeyError(f'trial_id {trial_id} was never suggested')
+        return doc
+
+    def __len__(self)->int:
+        return len(self._docs)
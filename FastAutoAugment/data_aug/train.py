@@ -1,3 +1,4 @@
+from typing import Optional
 import itertools
 import math
 import os
@@ -13,7 +14,9 @@ from ..common.common import get_logger, get_tb_writer
 from ..common.data import get_dataloaders
 from ..common.metrics import Accumulator
 from ..networks import get_model, num_class
-from ..common.utils import accuracy, create_lr_scheduler, create_optimizer
+from ..common.utils import accuracy, create_lr_scheduler, create_optimizer, \
+    micro_batches, bn_momentum_split, bn_modules, load_lazy
+from . import progress
 
 
 # TODO: remove scheduler parameter?
@@ -31,6 +34,8 @@ def run_epoch(conf, logger, model:nn.Module, loader, loss_fn, optimizer,
     epochs      = conf_loader['epochs']
     conf_opt    = conf['autoaug']['optimizer']
     grad_clip   = conf_opt['clip']
+    logger_freq = conf['autoaug']['logger_freq']
+    micro_batch = conf['autoaug']['micro_batch']
     # endregion
 
     tqdm_disable = bool(os.environ.get('TASK_NAME', ''))  #TODO: remove?
@@ -38,22 +43,39 @@ def run_epoch(conf, logger, model:nn.Module, loader, loss_fn, optimizer,
         loader = tqdm(loader, disable=tqdm_disable)
         loader.set_description('[%s %04d/%04d]' % (split_type, epoch, epochs))
 
-    metrics = Accumulator()
+    # sums of loss, top1, top5 are kept on device and synced only every
+    # logger_freq steps because .item() waits for device, if logger_freq is 0
+    # then only at the end of epoch
+    sums = None
     cnt = 0
     total_steps = len(loader)
     steps = 0
+    bns = bn_modules(model)
+    # model is on CPU if there is no GPU, e.g. with local search backend
+    device = next(model.parameters()).device
     for data, label in loader:
         steps += 1
-        data, label = data.cuda(), label.cuda()
+        data, label = data.to(device), label.to(device)
 
         if optimizer:
             optimizer.zero_grad()
 
-        preds = model(data)
-        loss = loss_fn(preds, label)
+        # large batches are split so they fit in device memory, grads are
+        # accumulated over micro batches before the optimizer step
+        chunks = micro_batches(data, label, micro_batch)
+        chunk_preds, loss = [], torch.zeros((), device=data.device)
+        with bn_momentum_split(bns, len(chunks)):
+            for data_c, label_c, frac in chunks:
+                preds_c = model(data_c)
+                loss_c = loss_fn(preds_c, label_c)
+                if optimizer:
+                    (loss_c * frac).backward()
+                chunk_preds.append(preds_c.detach())
+                loss += loss_c.detach() * frac
+        preds = chunk_preds[0] if len(chunks) == 1 else torch.cat(chunk_preds)
+        del chunk_preds, preds_c, loss_c
 
         if optimizer:
-            loss.backward()
             if getattr(optimizer, "synchronize", None):
                 optimizer.synchronize()     # for horovod
             # grad clipping defaults to 5 (same as Darts)
@@ -63,14 +85,13 @@ def run_epoch(conf, logger, model:nn.Module, loader, loss_fn, optimizer,
             optimizer.step()
 
         top1, top5 = accuracy(preds, label, (1, 5))
-        metrics.add_dict({
-            'loss': loss.item() * len(data),
-            'top1': top1.item() * len(data),
-            'top5': top5.item() * len(data),
-        })
+        step_sums = torch.stack([loss.detach(), top1, top5]).double() \
+                    * len(data)
+        sums = step_sums if sums is None else sums + step_sums
         cnt += len(data)
-        if verbose:
-            postfix = metrics / cnt
+        if verbose and (steps == total_steps or \
+                        (logger_freq > 0 and steps % logger_freq == 0)):
+            postfix = _sums_to_metrics(sums) / cnt
             if optimizer:
                 if 'lr' in optimizer.param_groups[0]:
                     postfix['lr'] = optimizer.param_groups[0]['lr']
@@ -83,6 +104,7 @@ def run_epoch(conf, logger, model:nn.Module, loader, loss_fn, optimizer,
 
         del preds, loss, top1, top5, data, label
 
+    metrics = _sums_to_metrics(sums)
     if tqdm_disable:
         if optimizer:
             logger.info('[%s %03d/%03d] %s lr=%.6f', split_type, epoch,
@@ -100,6 +122,12 @@ def run_epoch(conf, logger, model:nn.Module, loader, loss_fn, optimizer,
             writer.add_scalar('{}/{}'.format(key, split_type), value, epoch)
     return metrics
 
+def _sums_to_metrics(sums:Optional[torch.Tensor])->Accumulator:
+    metrics = Accumulator()
+    if sums is not None:
+        metrics.add_dict(dict(zip(['loss', 'top1', 'top5'], sums.tolist())))
+    return metrics
+
 # NOTE that 'eval' is overloaded in this code base. 'eval' here means 
 # taking a trained model and running it on val or test sets. In NAS 'eval'
 # often means taking a found model and training it fully (often termed 'final training').
@@ -120,13 +148,16 @@ def train_and_eval(conf, val_ratio, val_fold, save_path, only_eval,
     ds_name         = conf_data['name']
     aug             = conf_loader['aug']
     cutout          = conf_loader['cutout']
-    batch_size      = conf_loader['batch']
+    train_batch     = conf_loader['train_batch']
+    train_workers   = conf_loader['train_workers']
+    test_batch      = conf_loader['test_batch']
+    test_workers    = conf_loader['test_workers']
     max_batches     = conf_data['max_batches']
     epochs          = conf_loader['epochs']
     conf_model      = conf['autoaug']['model']
     conf_opt        = conf['autoaug']['optimizer']
     conf_lr_sched   = conf['autoaug']['lr_schedule']
-    n_workers       = conf_loader['n_workers']
+    channels_last   = conf_loader['channels_last']
     # endregion
 
 
@@ -142,14 +173,16 @@ def train_and_eval(conf, val_ratio, val_fold, save_path, only_eval,
         reporter = lambda **kwargs: 0
 
     # get dataloaders with transformations and splits applied
-    train_dl, valid_dl, test_dl, trainsampler = get_dataloaders(ds_name,
-        batch_size, dataroot, aug, cutout,
-        load_train=True, load_test=True, val_ratio=val_ratio, val_fold=val_fold,
-        horovod=horovod, n_workers=n_workers, max_batches=max_batches)
+    train_dl, valid_dl, test_dl, trainsampler = get_dataloaders(dataroot,
+        ds_name, load_train=True, train_batch_size=train_batch,
+        load_test=True, test_batch_size=test_batch, aug=aug, cutout=cutout,
+        val_ratio=val_ratio, val_fold=val_fold, train_workers=train_workers,
+        test_workers=test_workers, horovod=horovod, max_batches=max_batches,
+        channels_last=channels_last)
 
     # create a model & an optimizer
     model = get_model(conf_model, num_class(ds_name),
-        data_parallel=(not horovod))
+        data_parallel=(not horovod), channels_last=channels_last)
 
     # select loss function and optimizer
     lossfn = nn.CrossEntropyLoss()
@@ -176,7 +209,7 @@ def train_and_eval(conf, val_ratio, val_fold, save_path, only_eval,
     # if model available from previous checkpount then load it
     if save_path and os.path.exists(save_path):
         logger.info('%s checkpoint found. loading...' % save_path)
-        data = torch.load(save_path)
+        data = load_lazy(save_path)
 
         # when checkpointing we do add 'model' key so other cases are special cases
         if 'model' in data or 'state_dict' in data:
@@ -229,8 +262,13 @@ def train_and_eval(conf, val_ratio, val_fold, save_path, only_eval,
             result['%s_%s' % (key, setname)] = rs[setname][key]
 
         result['epoch'] = 0
+        if is_master:
+            progress.write_status(save_path, epochs, epochs, done=True)
         return result
 
+    if is_master:
+        progress.write_status(save_path, epoch_start-1, epochs)
+
     # train loop
     best_top1, best_valid_loss = 0, 10.0e10
     max_epoch = epochs
@@ -292,6 +330,11 @@ def train_and_eval(conf, val_ratio, val_fold, save_path, only_eval,
                         'model': model.state_dict()
                     }, save_path)
 
+        # publish progress every epoch so monitors don't need to load model
+        if is_master:
+            progress.write_status(save_path, epoch, max_epoch,
+                                  done=(epoch == max_epoch))
+
     del model
 
     result['top1_test'] = best_top1
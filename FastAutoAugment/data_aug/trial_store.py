@@ -0,0 +1,79 @@
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import hashlib
+import json
+import sqlite3
+import time
+
+from ..common.aug_policies import remove_deplicates, policy_decoder
+
+def policy_hash(config:dict, num_policy:int, num_op:int)->str:
+    """Hash of decoded policy so configs that decode to same policy after
+    removing duplicate sub-policies get same hash regardless of their order"""
+    policies = remove_deplicates(policy_decoder(config, num_policy, num_op))
+    canonical = sorted([[name, round(prob, 6), round(level, 6)]
+                        for name, prob, level in ops] for ops in policies)
+    return hashlib.sha1(json.dumps(canonical).encode()).hexdigest()
+
+def file_hash(filepath:str)->str:
+    sha = hashlib.sha1()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+class TrialStore:
+    """SQLite store of policy evaluation results.
+
+    Results are keyed by policy hash, validation fold, hash of the fold model
+    checkpoint and fidelity so they remain valid across runs for as long as
+    the checkpoint doesn't change. Only the search driver process writes to
+    the store.
+    """
+    def __init__(self, filepath:str) -> None:
+        self.filepath = filepath
+        self._conn = sqlite3.connect(filepath)
+        with self._conn:
+            self._conn.execute('''CREATE TABLE IF NOT EXISTS trials (
+                policy_hash TEXT NOT NULL,
+                val_fold INTEGER NOT NULL,
+                ckpt_hash TEXT NOT NULL,
+                fidelity REAL NOT NULL,
+                vals TEXT NOT NULL,
+                result TEXT NOT NULL,
+                created REAL NOT NULL,
+                PRIMARY KEY (policy_hash, val_fold, ckpt_hash, fidelity))''')
+
+    def get(self, policy_hash:str, val_fold:int, ckpt_hash:str,
+            fidelity:float)->Optional[dict]:
+        row = self._conn.execute('''SELECT result FROM trials
+            WHERE policy_hash=? AND val_fold=? AND ckpt_hash=?
+                AND fidelity=?''',
+            (policy_hash, val_fold, ckpt_hash, round(fidelity, 6))).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def put(self, policy_hash:str, val_fold:int, ckpt_hash:str,
+            fidelity:float, vals:Dict[str, Any], result:dict)->None:
+        with self._conn:
+            self._conn.execute('''INSERT OR REPLACE INTO trials
+                VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                (policy_hash, val_fold, ckpt_hash, round(fidelity, 6),
+                 json.dumps(vals), json.dumps(result), time.time()))
+
+    def fold_trials(self, val_fold:int, ckpt_hash:str)\
+            ->Iterator[Tuple[str, Dict[str, Any], List[dict]]]:
+        """Yields (policy_hash, vals, results) for every policy measured on
+        the fold, results are in order of increasing fidelity"""
+        rows = self._conn.execute('''SELECT policy_hash, vals, result
+            FROM trials WHERE val_fold=? AND ckpt_hash=?
+            ORDER BY created, policy_hash, fidelity''',
+            (val_fold, ckpt_hash)).fetchall()
+        policies:Dict[str, Tuple[Dict[str, Any], List[dict]]] = {}
+        for p_hash, vals, result in rows:
+            if p_hash not in policies:
+                policies[p_hash] = (json.loads(vals), [])
+            policies[p_hash][1].append(json.loads(result))
+        for p_hash, (vals, results) in policies.items():
+            yield p_hash, vals, sorted(results, key=lambda r: r['fidelity'])
+
+    def close(self)->None:
+        self._conn.close()
@@ -11,6 +11,7 @@ from overrides import overrides, EnforceOverrides
 
 from ..common.config import Config
 from ..common import common
+from ..common import dist_utils
 from ..nas.model import Model
 from ..nas.model_desc import ModelDesc
 from ..common.trainer import Trainer
@@ -42,7 +43,7 @@ class ArchTrainer(Trainer, EnforceOverrides):
         self._draw_model()
 
     def _draw_model(self) -> None:
-        if not self._plotsdir:
+        if not self._plotsdir or not dist_utils.is_master():
             return
         train_metrics, val_metrics = self.get_metrics()
         if (val_metrics and val_metrics.is_best()) or \
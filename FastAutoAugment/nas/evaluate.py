@@ -1,8 +1,10 @@
 from typing import Optional
+import os
 
 import torch
 
 from ..common.trainer import Trainer
+from ..common.multi_trainer import MultiTrainer
 from ..common.config import Config
 from ..common.common import get_logger
 from ..common import data
@@ -22,6 +24,9 @@ def eval_arch(conf_eval:Config, micro_builder:Optional[MicroBuilder]):
     conf_train = conf_eval['trainer']
     final_desc_filename = conf_eval['final_desc_filename']
     full_desc_filename = conf_eval['full_desc_filename']
+    num_models = conf_eval['num_models']
+    channels_last = conf_eval['channels_last']
+    conf_finder = conf_eval['batch_size_finder']
     # endregion
 
     # load model desc file to get template model
@@ -31,12 +36,26 @@ def eval_arch(conf_eval:Config, micro_builder:Optional[MicroBuilder]):
 
     if micro_builder:
         micro_builder.register_ops()
+
+    if num_models > 1:
+        _eval_arch_multi(conf_eval, template_model_desc, device)
+        return
+
     model, checkpoint = nas_utils.model_and_checkpoint(
                                 conf_checkpoint, resume, full_desc_filename,
                                 conf_model_desc, device,
                                 aux_tower=True,
                                 affine=True, droppath=True,
-                                template_model_desc=template_model_desc)
+                                template_model_desc=template_model_desc,
+                                channels_last=channels_last)
+
+    # batch size can't change when resuming as lr schedule depends on it
+    if checkpoint is None or checkpoint.is_empty():
+        nas_utils.tune_batch_size(conf_finder, conf_loader, conf_train,
+            model.desc, device, droppath=True, affine=True,
+            create_trainer=lambda m, c: Trainer(c, m, device, None,
+                                                aux_tower=True),
+            channels_last=channels_last, filename='eval_batch_size')
 
     # get data
     train_dl, _, test_dl = data.get_data(conf_loader)
@@ -59,9 +78,44 @@ def eval_arch(conf_eval:Config, micro_builder:Optional[MicroBuilder]):
     else:
         logger.info("Model is not saved because file path config not set")
 
+def _eval_arch_multi(conf_eval:Config, template_model_desc:ModelDesc,
+                     device)->None:
+    """Trains num_models differently initialized copies of the arch from one
+    data stream, checkpointing is not used in this mode"""
+    logger = get_logger()
 
+    # region conf vars
+    conf_loader       = conf_eval['loader']
+    save_filename    = conf_eval['save_filename']
+    conf_model_desc   = conf_eval['model_desc']
+    conf_train = conf_eval['trainer']
+    full_desc_filename = conf_eval['full_desc_filename']
+    num_models = conf_eval['num_models']
+    channels_last = conf_eval['channels_last']
+    # endregion
 
+    model_desc = nas_utils.create_macro_desc(conf_model_desc, aux_tower=True,
+        template_model_desc=template_model_desc)
+    model_desc.save(full_desc_filename)
+    models = [nas_utils.model_from_desc(model_desc, device,
+                                        droppath=True, affine=True,
+                                        channels_last=channels_last)
+              for _ in range(num_models)]
 
+    # get data
+    train_dl, _, test_dl = data.get_data(conf_loader)
+    assert train_dl is not None and test_dl is not None
 
+    trainer = MultiTrainer(conf_train, models, device, aux_tower=True)
+    trainer.fit(train_dl, test_dl)
 
-
+    # save metrics and models
+    save_name, save_ext = os.path.splitext(save_filename)
+    for i, (model, (train_metrics, test_metrics)) in \
+            enumerate(zip(models, trainer.get_metrics())):
+        train_metrics.save(f'eval_train_metrics_{i}')
+        if test_metrics:
+            test_metrics.save(f'eval_test_metrics_{i}')
+        save_path = model.save(f'{save_name}_{i}{save_ext}')
+        if save_path:
+            logger.info(f"Model {i} saved in {save_path}")
@@ -14,6 +14,7 @@ from .operations import Op, DropPath_
 from .model_desc import ModelDesc, AuxTowerDesc, CellDesc
 from ..common.common import get_logger, expdir_abspath
 from ..common import utils
+from ..common import dist_utils
 
 class Model(nn.Module):
     def __init__(self, model_desc:ModelDesc, droppath:bool, affine:bool):
@@ -150,7 +151,7 @@ class Model(nn.Module):
 
     def save(self, filename:str)->Optional[str]:
         save_path = expdir_abspath(filename)
-        if save_path:
+        if save_path and dist_utils.is_master():
             utils.save(self, save_path)
         return save_path
 
@@ -7,6 +7,7 @@ import torch
 import yaml
 
 from ..common.common import expdir_abspath
+from ..common import dist_utils, utils
 
 
 """
@@ -150,7 +151,7 @@ class ModelDesc:
 
     def save(self, filename:str)->Optional[str]:
         yaml_filepath = expdir_abspath(filename)
-        if yaml_filepath:
+        if yaml_filepath and dist_utils.is_master():
             if not yaml_filepath.endswith('.yaml'):
                 yaml_filepath += '.yaml'
 
@@ -182,7 +183,8 @@ class ModelDesc:
         # look for pth file that should have pytorch parameters state_dict
         pt_filepath = ModelDesc._pt_filepath(yaml_filepath)
         if os.path.exists(pt_filepath):
-            state_dict = torch.load(pt_filepath, map_location=torch.device('cpu'))
+            # only tensors of ops that are used get read from disk
+            state_dict = utils.load_lazy(pt_filepath)
             model_desc.load_state_dict(state_dict)
         # else no need to restore weights
         return model_desc
@@ -1,5 +1,6 @@
-from typing import Tuple, Optional
+from typing import Callable, Tuple, Optional
 
+import torch
 from torch.utils.data.dataloader import DataLoader
 
 from .model_desc import ModelDesc
@@ -9,6 +10,8 @@ from ..common.config import Config
 from .model import Model
 from ..common.common import get_logger
 from ..common.check_point import CheckPoint
+from ..common.trainer import Trainer
+from ..common.batch_size_finder import BatchSizeFinder
 
 def build_micro(model_desc, micro_builder: MicroBuilder, search_iteration:int)->None:
     if micro_builder:
@@ -35,7 +38,7 @@ def create_checkpoint(conf_checkpoint:Config, resume:bool)->Optional[CheckPoint]
 def model_and_checkpoint(conf_checkpoint:Config, resume:bool,
         full_desc_filename:str, conf_model_desc: Config,
         device, aux_tower:bool, affine:bool, droppath:bool,
-        template_model_desc:ModelDesc) \
+        template_model_desc:ModelDesc, channels_last:bool=False) \
                      ->Tuple[Model, Optional[CheckPoint]]:
     logger = get_logger()
     checkpoint = create_checkpoint(conf_checkpoint, resume)
@@ -49,16 +52,50 @@ def model_and_checkpoint(conf_checkpoint:Config, resume:bool,
         model_desc = ModelDesc.load(full_desc_filename)
 
     model = model_from_desc(model_desc, device,
-                            droppath=droppath, affine=affine)
+                            droppath=droppath, affine=affine,
+                            channels_last=channels_last)
 
     return model, checkpoint
 
-def model_from_desc(model_desc, device, droppath:bool, affine:bool)->Model:
+def model_from_desc(model_desc, device, droppath:bool, affine:bool,
+                    channels_last:bool=False)->Model:
+    """If channels_last is True then conv weights are in NHWC format, inputs
+    should be in same format, see loader channels_last setting"""
     model = Model(model_desc, droppath=droppath, affine=affine)
     # TODO: enable DataParallel
     # if data_parallel:
     #     model = nn.DataParallel(model).to(device)
     # else:
-    model = model.to(device)
+    if channels_last:
+        model = model.to(device, memory_format=torch.channels_last)
+    else:
+        model = model.to(device)
     return model
 
+
+def tune_batch_size(conf_finder:Config, conf_loader:Config, conf_train:Config,
+                    model_desc:ModelDesc, device, droppath:bool, affine:bool,
+                    create_trainer:Callable[[Model, Config], Trainer],
+                    channels_last:bool, filename:str)->None:
+    """If batch size finder is enabled, sets train_batch in conf_loader to
+    batch size with best throughput for model_desc and trainer"""
+    logger = get_logger()
+
+    if not conf_finder['enabled']:
+        return
+
+    conf_dataset = conf_loader['dataset']
+    finder = BatchSizeFinder(conf_finder, device)
+    batch_size = finder.find(
+        lambda: model_from_desc(model_desc, device, droppath=droppath,
+                                affine=affine, channels_last=channels_last),
+        create_trainer, conf_train, conf_dataset['channels'],
+        conf_dataset['n_classes'], channels_last=channels_last)
+    finder.save(filename)
+    if batch_size is None:
+        raise RuntimeError(f'batch size {conf_finder["min_batch"]} does not fit '
+                           'in memory, reduce batch_size_finder.min_batch')
+
+    logger.info(f'train_batch changed from {conf_loader["train_batch"]} '
+                f'to {batch_size} by batch size finder')
+    conf_loader['train_batch'] = batch_size
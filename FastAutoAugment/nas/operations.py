@@ -7,6 +7,7 @@ from overrides import overrides, EnforceOverrides
 
 import torch
 from torch import nn, Tensor, strided
+import torch.nn.functional as F
 
 from ..common import utils
 from .model_desc import OpDesc, ConvMacroParams
@@ -314,15 +315,19 @@ class FactorizedReduce(Op):
 
     @overrides
     def forward(self, x):
-        x = self.relu(x)
-
         # x: torch.Size([32, 32, 32, 32])
         # conv1: [b, c_out//2, d//2, d//2]
         # conv2: []
         # out: torch.Size([32, 32, 16, 16])
 
-        # concate two half channels to produce same number of channels as before but with output as only half the width
-        out = torch.cat([self.conv_1(x), self.conv_2(x[:, :, 1:, 1:])], dim=1)
+        # conv_1 sees even pixels and conv_2 odd pixels, their outputs are
+        # concatenated by channels. Both are done by one grouped 1x1 conv on
+        # subsampled pixels so the only copy is of half the input, no
+        # strided slice is passed to conv and output keeps memory format
+        # of x (e.g. channels_last) without hidden copies.
+        x = self.relu(torch.cat([x[:, :, ::2, ::2], x[:, :, 1::2, 1::2]], dim=1))
+        weight = torch.cat([self.conv_1.weight, self.conv_2.weight])
+        out = F.conv2d(x, weight, groups=2)
         out = self.bn(out)
         return out
 
@@ -26,6 +26,8 @@ def search_arch(conf_search:Config, micro_builder:MicroBuilder,
     full_desc_filename = conf_search['full_desc_filename']
     iterations = conf_search['iterations']
     conf_pretrain = conf_search['pretrain']
+    channels_last = conf_search['channels_last']
+    conf_finder = conf_search['batch_size_finder']
     # endregion
 
     device = torch.device(conf_search['device'])
@@ -48,15 +50,24 @@ def search_arch(conf_search:Config, micro_builder:MicroBuilder,
     assert iterations
     for search_iteration in range(start_iteration, iterations):
         search_model_desc = _pretrained_model_desc(conf_pretrain, device,
-                                                   search_model_desc)
+                                                   search_model_desc,
+                                                   channels_last)
 
         nas_utils.build_micro(search_model_desc, micro_builder, search_iteration)
 
         # save model desc to enable checkpointing
         search_model_desc.save(full_desc_filename)
 
+        # model may grow each iteration so batch size is tuned again
+        nas_utils.tune_batch_size(conf_finder, conf_loader, conf_train,
+            search_model_desc, device, droppath=False, affine=False,
+            create_trainer=lambda m, c: trainer_class(c, m, device, None),
+            channels_last=channels_last,
+            filename=f'search_batch_size_{search_iteration}')
+
         model = nas_utils.model_from_desc(search_model_desc, device,
-                                         droppath=False, affine=False)
+                                         droppath=False, affine=False,
+                                         channels_last=channels_last)
 
         # get data
         train_dl, val_dl, _ = data.get_data(conf_loader)
@@ -82,7 +93,8 @@ def search_arch(conf_search:Config, micro_builder:MicroBuilder,
         logger.info("Best architecture is not saved because file path config not set")
 
 def _pretrained_model_desc(conf_pretrain:Config, device,
-                           search_model_desc:ModelDesc)->ModelDesc:
+                           search_model_desc:ModelDesc,
+                           channels_last:bool)->ModelDesc:
     # region conf vars
     conf_trainer = conf_pretrain['trainer']
     conf_loader = conf_pretrain['loader']
@@ -94,7 +106,8 @@ def _pretrained_model_desc(conf_pretrain:Config, device,
         return search_model_desc
     elif search_model_desc.all_full():
         model = nas_utils.model_from_desc(search_model_desc, device,
-                                        droppath=False, affine=True)
+                                        droppath=False, affine=True,
+                                        channels_last=channels_last)
 
         # get data
         train_dl, _, test_dl = data.get_data(conf_loader)
@@ -11,7 +11,9 @@ from .wideresnet import WideResNet
 from .shakeshake.shake_resnext import ShakeResNeXt
 
 
-def get_model(conf, num_class=10, data_parallel=True):
+def get_model(conf, num_class=10, data_parallel=True, channels_last=False):
+    """If channels_last is True then conv weights are in NHWC format, inputs
+    should be in same format, see loader channels_last setting"""
     name = conf['type']
 
     if name == 'resnet50':
@@ -40,9 +42,14 @@ def get_model(conf, num_class=10, data_parallel=True):
     else:
         raise NameError('no model named, %s' % name)
 
+    if channels_last:
+        model = model.to(memory_format=torch.channels_last)
+
     if data_parallel:
-        model = model.cuda()
-        model = DataParallel(model)
+        if torch.cuda.is_available():
+            model = model.cuda()
+            model = DataParallel(model)
+        # else keep model on CPU, e.g. for local search backend
     else:
         import horovod.torch as hvd
         device = torch.device('cuda', hvd.local_rank())
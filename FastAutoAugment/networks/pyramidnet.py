@@ -50,10 +50,10 @@ class BasicBlock(nn.Module):
         shortcut_channel = shortcut.size()[1]
 
         if residual_channel != shortcut_channel:
-            padding = torch.autograd.Variable(
-                torch.cuda.FloatTensor(batch_size, residual_channel - shortcut_channel, featuremap_size[0],
-                                       featuremap_size[1]).fill_(0))
-            out += torch.cat((shortcut, padding), dim=1)
+            # zero pad channels, unlike cat with new zeros tensor this keeps
+            # device and memory format (e.g. channels_last) of shortcut
+            out += nn.functional.pad(shortcut,
+                (0, 0, 0, 0, 0, residual_channel - shortcut_channel))
         else:
             out += shortcut
 
@@ -107,10 +107,10 @@ class Bottleneck(nn.Module):
         shortcut_channel = shortcut.size()[1]
 
         if residual_channel != shortcut_channel:
-            padding = torch.autograd.Variable(
-                torch.cuda.FloatTensor(batch_size, residual_channel - shortcut_channel, featuremap_size[0],
-                                       featuremap_size[1]).fill_(0))
-            out += torch.cat((shortcut, padding), dim=1)
+            # zero pad channels, unlike cat with new zeros tensor this keeps
+            # device and memory format (e.g. channels_last) of shortcut
+            out += nn.functional.pad(shortcut,
+                (0, 0, 0, 0, 0, residual_channel - shortcut_channel))
         else:
             out += shortcut
 
@@ -0,0 +1,51 @@
+import time
+import logging
+
+import torch
+from torch import nn
+
+from FastAutoAugment.common import common, utils
+from FastAutoAugment.common.amp_utils import Amp
+from FastAutoAugment.networks.wideresnet import WideResNet
+
+"""Training throughput of float32 vs bfloat16 autocast on CPU using the same
+Amp calls as Trainer. Speedup depends on whether CPU has native bfloat16
+support (AVX512-BF16 or AMX), without it bfloat16 can be slower.
+"""
+
+common._logger = utils.setup_logging(level=logging.WARNING)
+
+steps, batch = 10, 32
+device = torch.device('cpu')
+x = torch.randn(batch, 3, 32, 32, device=device)
+y = torch.randint(0, 10, (batch,), device=device)
+
+def train(use_amp:bool)->float:
+    torch.manual_seed(0)
+    model = WideResNet(16, 2, 0.0, 10).to(device)
+    optim = torch.optim.SGD(model.parameters(), lr=0.01, momentum=0.9)
+    amp = Amp(use_amp, device)
+    lossfn = nn.CrossEntropyLoss()
+    for step in range(steps+2):
+        if step == 2: # first steps are warm up
+            start = time.time()
+        optim.zero_grad()
+        with amp.autocast():
+            loss = lossfn(model(x), y)
+        amp.backward(loss)
+        amp.clip_grad(5.0, model, optim)
+        amp.step(optim)
+    return steps * batch / (time.time() - start)
+
+print(f'threads: {torch.get_num_threads()}')
+fp32 = train(False)
+bf16 = train(True)
+print(f'float32: {fp32:.1f} samples/s')
+print(f'bfloat16 autocast: {bf16:.1f} samples/s ({bf16/fp32:.2f}x)')
+
+"""
+1 vCPU with AMX-BF16, WideResNet-16-2, batch 32:
+threads: 1
+float32: 75.2 samples/s
+bfloat16 autocast: 188.5 samples/s (2.51x)
+"""
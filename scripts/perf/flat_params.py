@@ -0,0 +1,80 @@
+import copy
+import logging
+import time
+
+import torch
+
+from FastAutoAugment.common import common, utils
+from FastAutoAugment.common.config import Config
+from FastAutoAugment.nas import nas_utils
+from FastAutoAugment.darts.darts_micro_builder import DartsMicroBuilder
+
+"""Time of the elementwise weight updates done by bilevel optimizer in each
+step, looping over params from Model.weights() vs one op on flat buffer of
+utils.FlatParams. Model is the default search model from darts_cifar.yaml.
+"""
+
+common._logger = utils.setup_logging(level=logging.WARNING)
+
+reps = 20
+device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+conf = Config(config_filepath='confs/darts_cifar.yaml', use_args=False)
+conf_search = conf['nas']['search']
+model_desc = nas_utils.create_macro_desc(conf_search['model_desc'],
+    aux_tower=False, template_model_desc=None)
+nas_utils.build_micro(model_desc, DartsMicroBuilder(), 0)
+model = nas_utils.model_from_desc(model_desc, device, droppath=False,
+                                  affine=False)
+vmodel = copy.deepcopy(model)
+dw = [torch.randn_like(p) for p in model.weights()]
+
+def timed(f)->float:
+    f()
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    start = time.time()
+    for _ in range(reps):
+        f()
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    return (time.time() - start) / reps * 1000
+
+@torch.no_grad()
+def loop_step():
+    # as in _update_vmodel and _hessian_vector_product before
+    for w, vw, g in zip(model.weights(), vmodel.weights(), dw):
+        vw.copy_(w - 0.025 * (g + 3.0e-4*w))
+    for a, va in zip(model.alphas(), vmodel.alphas()):
+        va.copy_(a)
+    epsilon = 0.01 / torch.cat([v.view(-1) for v in dw]).norm()
+    for p, v in zip(model.weights(), dw):
+        p += epsilon * v
+    for p, v in zip(model.weights(), dw):
+        p -= 2. * epsilon * v
+    for p, v in zip(model.weights(), dw):
+        p += epsilon * v
+print(f'loop: {timed(loop_step):.1f}ms')
+
+weights, alphas = utils.FlatParams(model.weights()), \
+                  utils.FlatParams(model.alphas())
+vweights, valphas = utils.FlatParams(vmodel.weights()), \
+                    utils.FlatParams(vmodel.alphas())
+print(f'{len(weights.params)} weights, {len(alphas.params)} alphas')
+
+@torch.no_grad()
+def flat_step():
+    w, g = weights.flat, weights.cat(dw)
+    vweights.flat.copy_(w - 0.025 * (g + 3.0e-4*w))
+    valphas.flat.copy_(alphas.flat)
+    epsilon = 0.01 / g.norm()
+    w += epsilon * g
+    w -= 2. * epsilon * g
+    w += epsilon * g
+print(f'flat: {timed(flat_step):.1f}ms')
+
+"""
+CPU, 1376 weights, 28 alphas:
+loop: 128.3ms
+flat: 13.4ms
+"""
@@ -0,0 +1,53 @@
+import time
+
+import torch
+
+from FastAutoAugment.common import utils
+
+"""Optimizer step time with per parameter loop vs multi-tensor foreach
+updates for many small tensors as in DARTS search model where each edge has
+several primitives.
+"""
+
+n_params, steps = 2000, 20
+device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+def step_time(conf_opt:dict)->float:
+    torch.manual_seed(0)
+    params = [torch.randn(16, 1, 3, 3, device=device, requires_grad=True)
+              for _ in range(n_params)]
+    for p in params:
+        p.grad = torch.randn_like(p)
+    optim = utils.create_optimizer(conf_opt, params)
+    optim.step() # creates state
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    start = time.time()
+    for _ in range(steps):
+        optim.step()
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    return (time.time() - start) / steps
+
+confs = {
+    'sgd': {'type': 'sgd', 'lr': 0.025, 'momentum': 0.9, 'decay': 3.0e-4,
+            'nesterov': False},
+    'adam': {'type': 'adam', 'lr': 3.0e-4, 'betas': [0.5, 0.999],
+             'decay': 1.0e-3},
+    'cocob': {'type': 'cocob', 'alpha': 100.0},
+}
+for name, conf_opt in confs.items():
+    times = [step_time(dict(conf_opt, foreach=foreach))*1000
+             for foreach in [False, True]]
+    print(f'{name}: loop {times[0]:.1f}ms, foreach {times[1]:.1f}ms')
+
+"""
+CPU, 2000 tensors of 16x1x3x3:
+sgd: loop 32.4ms, foreach 20.0ms
+adam: loop 84.1ms, foreach 54.5ms
+cocob: loop 119.7ms, foreach 87.2ms
+
+On CPU foreach ops still launch a kernel per tensor so gain is only from
+less Python overhead. With 16x16x3x3 tensors foreach was same or slower on
+CPU. On CUDA foreach ops use fused kernels for many tensors.
+"""
@@ -0,0 +1,36 @@
+import os
+import tempfile
+import time
+
+import torch
+
+from FastAutoAugment.common import utils
+
+"""Time to open a large checkpoint and restore one tensor from it with
+torch.load vs memory mapped utils.load_lazy. Page cache is warm so disk
+reads are not included, cold cache difference is bigger.
+"""
+
+n_tensors, tensor_mb = 64, 8
+
+with tempfile.TemporaryDirectory() as tmpdir:
+    filepath = os.path.join(tmpdir, 'checkpoint.pth')
+    torch.save({f't{i}': torch.randn(tensor_mb*2**18)
+                for i in range(n_tensors)}, filepath)
+    target = torch.empty(tensor_mb*2**18)
+
+    for name, load in [('torch.load', lambda f: torch.load(f, map_location='cpu')),
+                       ('load_lazy', utils.load_lazy)]:
+        load(filepath) # warm up
+        start = time.time()
+        d = load(filepath)
+        target.copy_(d['t0'])
+        print(f'{name}: {(time.time()-start)*1000:.1f}ms '
+              f'for {n_tensors*tensor_mb}MB file')
+        del d
+
+"""
+CPU:
+torch.load: 150.8ms for 512MB file
+load_lazy: 6.2ms for 512MB file
+"""
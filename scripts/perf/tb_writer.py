@@ -0,0 +1,57 @@
+import tempfile
+import time
+
+import torch
+from torch import nn
+from torch.utils.tensorboard import SummaryWriter
+
+from FastAutoAugment.common.common import SummaryWriterDummy
+from FastAutoAugment.common.async_tb_writer import AsyncSummaryWriter
+
+"""Measures training loop overhead of writing step scalars to TensorBoard.
+Each step writes loss, top1, top5 same as Metrics.report_cur.
+"""
+
+steps = 2000
+device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+model = nn.Sequential(nn.Linear(256, 256), nn.ReLU(), nn.Linear(256, 10))\
+          .to(device)
+optim = torch.optim.SGD(model.parameters(), lr=0.01)
+x = torch.randn(64, 256, device=device)
+y = torch.randint(0, 10, (64,), device=device)
+
+def train(writer)->float:
+    start = time.time()
+    for step in range(steps):
+        optim.zero_grad()
+        loss = nn.functional.cross_entropy(model(x), y)
+        loss.backward()
+        optim.step()
+        writer.add_scalar('train/loss', loss.item(), step)
+        writer.add_scalar('train/top1', 0.5, step)
+        writer.add_scalar('train/top5', 0.9, step)
+    loop_time = time.time() - start
+    writer.close() # not part of training loop
+    return loop_time
+
+train(SummaryWriterDummy(None)) # warm up
+with tempfile.TemporaryDirectory() as tbdir:
+    base = train(SummaryWriterDummy(tbdir))
+    for name, writer in [
+            ('SummaryWriter', SummaryWriter(tbdir+'/sync')),
+            ('AsyncSummaryWriter', AsyncSummaryWriter(tbdir+'/async')),
+            ('AsyncSummaryWriter/10', AsyncSummaryWriter(tbdir+'/async10',
+                                                        downsample_steps=10))]:
+        t = train(writer)
+        print(f'{name:>24}: {t:.3f}s, overhead {(t-base)/steps*1e6:.1f}us/step')
+    print(f'{"no writer":>24}: {base:.3f}s')
+
+"""
+CPU only machine, small model so per-step overhead is exaggerated,
+numbers vary by +-100us between runs:
+           SummaryWriter: 2.142s, overhead 337.6us/step
+      AsyncSummaryWriter: 1.641s, overhead 87.3us/step
+   AsyncSummaryWriter/10: 1.482s, overhead 7.4us/step
+               no writer: 1.467s
+"""
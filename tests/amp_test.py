@@ -0,0 +1,67 @@
+import logging
+
+import pytest
+import torch
+from torch import nn
+
+from FastAutoAugment.common import common, utils
+from FastAutoAugment.common.amp_utils import Amp
+
+def _amp(loss_scaling:bool)->Amp:
+    common._logger = utils.setup_logging(level=logging.WARNING)
+    amp = Amp(True, 'cpu')
+    if loss_scaling: # only used on CUDA, CPU scaler behaves same
+        amp._scaler = torch.amp.GradScaler('cpu', init_scale=2.0**10)
+    return amp
+
+def test_bf16_autocast():
+    linear = nn.Linear(4, 2)
+    with _amp(False).autocast():
+        assert linear(torch.randn(3, 4)).dtype == torch.bfloat16
+    with Amp(False, 'cpu').autocast():
+        assert linear(torch.randn(3, 4)).dtype == torch.float32
+
+def _step(amp:Amp, linear:nn.Linear, optim, overflow:bool)->None:
+    optim.zero_grad()
+    amp.backward(linear(torch.randn(3, 4)).sum())
+    if overflow:
+        linear.weight.grad[0, 0] = float('inf')
+    amp.step(optim)
+
+def test_skip_non_finite():
+    amp, linear = _amp(True), nn.Linear(4, 2)
+    optim = torch.optim.SGD(linear.parameters(), lr=0.1)
+    weight, scale = linear.weight.detach().clone(), amp._scaler.get_scale()
+
+    _step(amp, linear, optim, overflow=True)
+    assert torch.equal(linear.weight, weight)
+    assert amp._scaler.get_scale() == scale / 2
+
+    _step(amp, linear, optim, overflow=False)
+    assert not torch.equal(linear.weight, weight)
+
+def test_grads_finite():
+    amp, linear = _amp(True), nn.Linear(4, 2)
+    grads = amp.grads(linear(torch.randn(3, 4)).sum(), linear.parameters())
+    assert amp.grads_finite(grads)
+    assert not amp.grads_finite(grads + (torch.tensor([float('nan')]),))
+    # without loss scaling there is no overflow to detect
+    assert _amp(False).grads_finite([torch.tensor([float('inf')])])
+
+def test_state_dict_round_trip():
+    amp, linear = _amp(True), nn.Linear(4, 2)
+    optim = torch.optim.SGD(linear.parameters(), lr=0.1)
+    for overflow in [True, False, True]:
+        _step(amp, linear, optim, overflow)
+    state_dict = amp.state_dict()
+
+    loaded = _amp(True)
+    loaded.load_state_dict(state_dict)
+    assert loaded.state_dict() == state_dict
+    assert loaded._scaler.get_scale() == 2.0**10 / 4
+
+    with pytest.raises(RuntimeError):
+        _amp(True).load_state_dict(None)
+    # scale is ignored when loss scaling is not used
+    assert _amp(False).state_dict() is None
+    _amp(False).load_state_dict(state_dict)
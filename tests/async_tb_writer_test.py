@@ -0,0 +1,79 @@
+import tempfile
+import threading
+
+import torch
+
+from FastAutoAugment.common.async_tb_writer import AsyncSummaryWriter
+
+class _Recorder:
+    """Stands in for SummaryWriter, can block to simulate slow writes"""
+    def __init__(self)->None:
+        self.scalars, self.flushed, self.closed = [], False, False
+        self.entered, self.release = threading.Event(), threading.Event()
+        self.release.set()
+
+    def add_scalar(self, tag, value, step, walltime)->None:
+        self.entered.set()
+        self.release.wait()
+        self.scalars.append((tag, value, step))
+
+    def flush(self)->None:
+        self.flushed = True
+
+    def close(self)->None:
+        self.closed = True
+
+def _writer(log_dir:str, **kwargs):
+    # flush_secs is large so writes happen only when tests ask for them
+    writer = AsyncSummaryWriter(log_dir, flush_secs=100.0, **kwargs)
+    writer._writer.close()
+    writer._writer = recorder = _Recorder()
+    return writer, recorder
+
+def test_full_queue_blocks():
+    with tempfile.TemporaryDirectory() as log_dir:
+        writer, recorder = _writer(log_dir, max_queue=2)
+        recorder.release.clear()
+        writer.add_scalar('a', 0.0)
+        writer._wakeup.set()
+        assert recorder.entered.wait(5.0) # writer thread is stuck on 'a'
+        writer.add_scalar('b', 1.0)
+        writer.add_scalar('c', 2.0)
+
+        blocked = threading.Thread(target=writer.add_scalar, args=('d', 3.0))
+        blocked.start()
+        blocked.join(0.2)
+        assert blocked.is_alive() # waits for room in queue
+
+        recorder.release.set()
+        blocked.join(5.0)
+        assert not blocked.is_alive()
+        writer.close()
+        assert [s[0] for s in recorder.scalars] == ['a', 'b', 'c', 'd']
+
+def test_downsample_averages():
+    with tempfile.TemporaryDirectory() as log_dir:
+        writer, recorder = _writer(log_dir, downsample_steps=4)
+        for step in range(10):
+            writer.add_scalar('x', torch.tensor(float(step)), step)
+        writer.add_scalar('y', 7.0) # no step so written as is
+        writer.flush()
+        # last window is partial so it stays open
+        assert recorder.scalars == [('x', 1.5, 3), ('x', 5.5, 7),
+                                    ('y', 7.0, None)]
+        writer.close()
+        assert recorder.scalars[-1] == ('x', 8.5, 9)
+
+def test_flush_and_close_drain():
+    with tempfile.TemporaryDirectory() as log_dir:
+        writer, recorder = _writer(log_dir, downsample_steps=2)
+        for step in range(100):
+            writer.add_scalar('x', 1.0, step)
+        writer.flush()
+        assert len(recorder.scalars) == 49 and recorder.flushed
+        writer.add_scalar('x', 1.0, 100)
+        writer.close()
+        # open windows for steps 98-99 and 100 are written on close
+        assert len(recorder.scalars) == 51 and recorder.closed
+        assert not writer._thread.is_alive()
+        writer.close() # second close does nothing
@@ -0,0 +1,53 @@
+import logging
+
+import pytest
+import torch
+from torch import nn
+from torch.utils.data import DataLoader, TensorDataset
+
+from FastAutoAugment.common import common, utils
+from FastAutoAugment.common.config import Config
+from FastAutoAugment.common.common import SummaryWriterDummy
+from FastAutoAugment.common.tester import Tester
+from FastAutoAugment.common.async_tester import AsyncTester
+
+def _run(tester_type)->Tester:
+    common._logger = utils.setup_logging(level=logging.WARNING)
+    common._tb_writer = SummaryWriterDummy(None)
+    conf = Config(config_filepath='confs/darts_cifar.yaml', use_args=False)
+    conf_validation = conf['nas']['eval']['trainer']['validation']
+    torch.manual_seed(0)
+    model = nn.Linear(4, 10)
+    dl = DataLoader(TensorDataset(torch.randn(20, 4),
+                                  torch.randint(0, 10, (20,))), batch_size=6)
+    tester = tester_type(conf_validation, model, torch.device('cpu'),
+                         aux_tower=False, epochs=4)
+    # starting background process uses global RNG
+    gen = torch.Generator().manual_seed(0)
+    tester.pre_test(False)
+    for epoch in range(4):
+        if epoch == 2: # epoch without test
+            tester.increment_epoch()
+        else:
+            tester.test_epoch(dl)
+        with torch.no_grad(): # training changes weights between tests
+            model.weight.add_(0.1 * torch.randn(model.weight.shape,
+                                                generator=gen))
+    tester.state_dict()
+    tester.post_test()
+    return tester
+
+def test_same_as_tester():
+    metrics = _run(Tester).get_metrics()
+    async_metrics = _run(AsyncTester).get_metrics()
+
+    assert async_metrics.epoch == metrics.epoch
+    assert async_metrics.best_epoch == metrics.best_epoch
+    assert async_metrics.best_top1 == pytest.approx(metrics.best_top1)
+    assert [e for e, _ in async_metrics.top1_history] == \
+           [e for e, _ in metrics.top1_history]
+    assert [t for _, t in async_metrics.top1_history] == \
+           pytest.approx([t for _, t in metrics.top1_history])
+    for name in ['top1', 'top5', 'loss']:
+        assert getattr(async_metrics, name).avg == \
+               pytest.approx(getattr(metrics, name).avg)
@@ -0,0 +1,110 @@
+import logging
+import os
+import socket
+
+import torch
+from torch import nn
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+from FastAutoAugment.common import common, utils, dist_utils
+from FastAutoAugment.common.config import Config
+from FastAutoAugment.common.common import SummaryWriterDummy
+from FastAutoAugment.common.trainer import Trainer
+from FastAutoAugment.common.batch_size_finder import BatchSizeFinder
+
+def _finder()->BatchSizeFinder:
+    common._logger = utils.setup_logging(level=logging.WARNING)
+    common._tb_writer = SummaryWriterDummy(None)
+    return BatchSizeFinder({'min_batch': 2, 'max_batch': 4, 'warmup_steps': 1,
+                            'steps': 1, 'max_memory_gb': None,
+                            'tolerance': 0.05, 'img_size': 2}, 'cpu')
+
+def _conf_train()->Config:
+    conf = Config(config_filepath='confs/darts_cifar.yaml', use_args=False)
+    conf_train = conf['nas']['eval']['trainer']
+    conf_train['drop_path_prob'] = 0.0 # model has no drop path
+    conf_train['aux_weight'] = 0.0
+    return conf_train
+
+def _create_model()->nn.Module:
+    return nn.Sequential(nn.Flatten(), nn.Linear(12, 10))
+
+def _create_trainer(model:nn.Module, conf_train:Config)->Trainer:
+    return Trainer(conf_train, model, torch.device('cpu'), None, aux_tower=False)
+
+def test_find_with_early_stop_and_budget():
+    conf_train = _conf_train()
+    conf_train['early_stop']['enabled'] = True
+    conf_train['budget']['secs'] = 1.0e-6
+    trainers = []
+    def create_trainer(model:nn.Module, conf_train:Config)->Trainer:
+        trainers.append(_create_trainer(model, conf_train))
+        return trainers[-1]
+
+    finder = _finder()
+    assert finder.find(_create_model, create_trainer, conf_train,
+                       channels=3, n_classes=10) in (2, 4)
+    assert [p['batch_size'] for p in finder.probes] == [2, 4]
+    # probes train for the one epoch regardless of settings of the real run
+    assert all(t._early_stop is None and t._budget_secs is None
+               for t in trainers)
+
+def test_best_within_tolerance():
+    finder = _finder()
+    finder.probes = [
+        {'batch_size': 2, 'feasible': True, 'samples_per_sec': 50.0},
+        {'batch_size': 4, 'feasible': True, 'samples_per_sec': 96.0},
+        {'batch_size': 8, 'feasible': True, 'samples_per_sec': 100.0},
+        {'batch_size': 16, 'feasible': False, 'samples_per_sec': 0.0}]
+    assert finder.best() == 4
+    finder.probes = finder.probes[-1:]
+    assert finder.best() is None
+
+class _OomTrainer:
+    def fit(self, train_dl, val_dl)->None:
+        if train_dl.batch_size >= 4:
+            raise RuntimeError('CUDA out of memory. Tried to allocate 2.00 GiB')
+
+def test_out_of_memory_is_infeasible():
+    titles = []
+    def create_trainer(model:nn.Module, conf_train:Config):
+        titles.append(conf_train['title'])
+        return _OomTrainer()
+
+    finder = _finder()
+    finder._max_batch = 8
+    assert finder.find(_create_model, create_trainer, _conf_train(),
+                       channels=3, n_classes=10) == 2
+    # probing stops at first batch size out of memory
+    assert [(p['batch_size'], p['feasible']) for p in finder.probes] == \
+           [(2, True), (4, False)]
+    assert titles == ['batch_size_finder'] * 2
+
+def _dist_find(rank:int, world_size:int, port:int, results)->None:
+    os.environ.update({'MASTER_ADDR': '127.0.0.1', 'MASTER_PORT': str(port)})
+    dist.init_process_group('gloo', rank=rank, world_size=world_size)
+    try:
+        class RankOomTrainer:
+            def fit(self, train_dl, val_dl)->None:
+                assert not dist_utils.is_distributed() # probes are local
+                if rank == 1 and train_dl.batch_size >= 4:
+                    raise RuntimeError('CUDA out of memory.')
+
+        finder = _finder()
+        finder._max_batch = 8
+        best = finder.find(_create_model, lambda m, c: RankOomTrainer(),
+                           _conf_train(), channels=3, n_classes=10)
+        results[rank] = (best, [(p['batch_size'], p['feasible'])
+                                for p in finder.probes])
+    finally:
+        dist.destroy_process_group()
+
+def test_distributed_ranks_agree():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    results = mp.Manager().dict()
+    mp.spawn(_dist_find, args=(2, port, results), nprocs=2)
+    # batch size 4 fits only on rank 0 but neither rank uses it
+    assert results[0] == results[1] == (2, [(2, True), (4, False)])
@@ -0,0 +1,133 @@
+import copy
+import logging
+
+import pytest
+import torch
+from torch import autograd, nn
+
+from FastAutoAugment.common import common, utils
+from FastAutoAugment.common.amp_utils import Amp
+from FastAutoAugment.darts.bilevel_arch_trainer import _BilevelOptimizer
+
+_W_MOMENTUM, _W_DECAY, _LR = 0.9, 3.0e-4, 0.025
+
+class _Net(nn.Module):
+    """Smallest model with weights and alphas like search model"""
+    def __init__(self)->None:
+        super().__init__()
+        self.conv = nn.Conv2d(3, 4, 3)
+        self.linear = nn.Linear(4, 10)
+        self.alpha = nn.Parameter(torch.randn(2) * 1e-3)
+
+    def weights(self):
+        return [p for n, p in self.named_parameters() if n != 'alpha']
+
+    def alphas(self):
+        return [self.alpha]
+
+    def forward(self, x):
+        h = self.conv(x)
+        a = torch.softmax(self.alpha, dim=0)
+        h = a[0] * torch.relu(h) + a[1] * torch.tanh(h)
+        return self.linear(h.mean((2, 3))),
+
+def _w_optim(model:_Net)->torch.optim.SGD:
+    # one step so weights have momentum buffers
+    optim = torch.optim.SGD(model.weights(), lr=_LR, momentum=_W_MOMENTUM)
+    for p in model.weights():
+        p.grad = torch.ones_like(p)
+    optim.step()
+    return optim
+
+def _loss(model, x, y):
+    return nn.functional.cross_entropy(model(x)[0], y)
+
+# per tensor loops as bilevel optimizer had them before FlatParams
+def _loop_vmodel(model, vmodel, x, y, w_optim):
+    gradients = autograd.grad(_loss(model, x, y), model.weights())
+    with torch.no_grad():
+        for w, vw, g in zip(model.weights(), vmodel.weights(), gradients):
+            m = w_optim.state[w].get('momentum_buffer', 0.)*_W_MOMENTUM
+            vw.copy_(w - _LR * (m + g + _W_DECAY*w))
+        for a, va in zip(model.alphas(), vmodel.alphas()):
+            va.copy_(a)
+
+def _loop_hessian(model, dw, x, y):
+    epsilon = 1e-2 / torch.cat([v.reshape(-1) for v in dw]).norm()
+    with torch.no_grad():
+        for p, v in zip(model.weights(), dw):
+            p += epsilon * v
+    dalpha_plus = autograd.grad(_loss(model, x, y), model.alphas())
+    with torch.no_grad():
+        for p, v in zip(model.weights(), dw):
+            p -= 2. * epsilon * v
+    dalpha_minus = autograd.grad(_loss(model, x, y), model.alphas())
+    with torch.no_grad():
+        for p, v in zip(model.weights(), dw):
+            p += epsilon * v
+    return [(p - m) / (2. * epsilon)
+            for p, m in zip(dalpha_plus, dalpha_minus)]
+
+def _bilevel_optim(model:_Net, amp:Amp)->_BilevelOptimizer:
+    conf_alpha_optim = {'type': 'adam', 'lr': 3.0e-4, 'decay': 1.0e-3,
+                        'betas': [0.5, 0.999], 'foreach': None}
+    return _BilevelOptimizer(conf_alpha_optim, _W_MOMENTUM, _W_DECAY,
+        model, nn.CrossEntropyLoss(), None, amp)
+
+def _assert_close(tensors, expected):
+    for t, e in zip(tensors, expected):
+        assert torch.allclose(t, e, rtol=1e-5, atol=1e-6)
+
+@pytest.mark.parametrize('channels_last', [False, True])
+def test_flat_matches_loop(channels_last):
+    common._logger = utils.setup_logging(level=logging.WARNING)
+    torch.manual_seed(0)
+    model = _Net()
+    if channels_last:
+        model = model.to(memory_format=torch.channels_last)
+    ref_model = copy.deepcopy(model)
+    x, y = torch.randn(8, 3, 6, 6), torch.randint(0, 10, (8,))
+    dw = [torch.randn_like(p) for p in model.weights()]
+
+    bilevel_optim = _bilevel_optim(model, Amp(False, 'cpu'))
+    w_optim, ref_w_optim = _w_optim(model), _w_optim(ref_model)
+
+    bilevel_optim._update_vmodel(x, y, _LR, w_optim)
+    ref_vmodel = copy.deepcopy(ref_model)
+    _loop_vmodel(ref_model, ref_vmodel, x, y, ref_w_optim)
+    _assert_close(bilevel_optim._vmodel.parameters(), ref_vmodel.parameters())
+
+    hessian = bilevel_optim._hessian_vector_product(dw, x, y)
+    _assert_close(hessian, _loop_hessian(ref_model, dw, x, y))
+    # weights are back to w after w+ and w-
+    _assert_close(model.parameters(), ref_model.parameters())
+    assert model.conv.weight.is_contiguous(
+        memory_format=torch.channels_last if channels_last \
+                      else torch.contiguous_format)
+
+def test_step_skips_overflow():
+    common._logger = utils.setup_logging(level=logging.WARNING)
+    model = _Net()
+    amp = Amp(True, 'cpu')
+    # loss scaling is only used on CUDA, CPU scaler behaves same
+    amp._scaler = torch.amp.GradScaler('cpu')
+    bilevel_optim = _bilevel_optim(model, amp)
+    alpha = model.alpha.detach().clone()
+
+    # non-finite alpha grads
+    bilevel_optim.zero_grad()
+    bilevel_optim._alpha_grads = [torch.full_like(alpha, float('inf'))]
+    bilevel_optim.step()
+    assert torch.equal(model.alpha, alpha)
+
+    # overflow in dw of any accumulated batch
+    bilevel_optim.zero_grad()
+    bilevel_optim._alpha_grads = [torch.ones_like(alpha)]
+    bilevel_optim._overflow = True
+    bilevel_optim.step()
+    assert torch.equal(model.alpha, alpha)
+
+    bilevel_optim.zero_grad()
+    bilevel_optim._alpha_grads = [torch.ones_like(alpha)]
+    bilevel_optim.step()
+    assert not torch.equal(model.alpha, alpha)
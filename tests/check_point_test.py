@@ -0,0 +1,81 @@
+import logging
+import os
+import tempfile
+
+import torch
+
+from FastAutoAugment.common import common, utils
+from FastAutoAugment.common.config import Config
+from FastAutoAugment.common.check_point import CheckPoint
+
+def _check_point(expdir:str, async_write:bool,
+                 incremental:bool=False)->CheckPoint:
+    conf = Config()
+    conf['common'] = {'expdir': expdir}
+    Config.set(conf)
+    common._logger = utils.setup_logging(level=logging.WARNING)
+    return CheckPoint({'filename': 'checkpoint.pth', 'freq': 2,
+                       'freq_secs': None, 'async_write': async_write,
+                       'incremental': incremental, 'chunk_mb': 0.001},
+                      load_existing=False)
+
+def test_async_commit():
+    with tempfile.TemporaryDirectory() as expdir:
+        cp = _check_point(expdir, async_write=True)
+        t = torch.zeros(3)
+        cp['trainer'] = {'model': {'w': t}, 'epoch': 1}
+        cp.commit()
+        t += 1.0 # training continues while checkpoint is written
+        cp.wait()
+        assert cp.is_empty()
+
+        cp2 = _check_point(expdir, async_write=False)
+        assert cp2.load_existing()
+        assert torch.equal(cp2['trainer']['model']['w'], torch.zeros(3))
+        assert cp2['trainer']['epoch'] == 1
+        assert os.listdir(expdir) == ['checkpoint.pth'] # temp file renamed
+
+def test_is_due():
+    with tempfile.TemporaryDirectory() as expdir:
+        cp = _check_point(expdir, async_write=False)
+        assert cp.is_due(2) and not cp.is_due(3)
+        cp.freq_secs = 0.0
+        assert cp.is_due(3)
+
+def test_incremental_commit():
+    with tempfile.TemporaryDirectory() as expdir:
+        cp = _check_point(expdir, async_write=False, incremental=True)
+        w, b = torch.randn(1024), torch.arange(3, dtype=torch.bfloat16)
+        cp['trainer'] = {'w': w, 'b': b, 'b2': b.clone(), 'epoch': 1}
+        cp.commit()
+        first = cp.bytes_written
+
+        w[:10] += 1.0 # only first of 4 chunks of w changes
+        cp['trainer'] = {'w': w, 'b': b, 'b2': b.clone(), 'epoch': 2}
+        cp.commit()
+        assert cp.bytes_written < first - 3000
+
+        cp2 = _check_point(expdir, async_write=False)
+        assert cp2.load_existing()
+        assert torch.equal(cp2['trainer']['w'], w)
+        assert torch.equal(cp2['trainer']['b2'], b)
+        assert cp2['trainer']['b'].dtype == torch.bfloat16
+        assert cp2['trainer']['epoch'] == 2
+        # chunks only used by first checkpoint are deleted
+        assert len(os.listdir(os.path.join(expdir, 'checkpoint.pth.chunks'))) == 5
+
+def test_lazy_load_is_copy_on_write():
+    with tempfile.TemporaryDirectory() as expdir:
+        for incremental in [False, True]:
+            cp = _check_point(expdir, async_write=False, incremental=incremental)
+            cp['trainer'] = {'w': torch.zeros(3)}
+            cp.commit()
+
+            cp2 = _check_point(expdir, async_write=False)
+            assert cp2.load_existing()
+            cp2['trainer']['w'] += 1.0 # memory mapped tensor is writable
+            cp2.clear()
+
+            cp3 = _check_point(expdir, async_write=False)
+            assert cp3.load_existing()
+            assert torch.equal(cp3['trainer']['w'], torch.zeros(3))
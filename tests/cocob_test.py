@@ -0,0 +1,23 @@
+import torch
+
+from FastAutoAugment.common.cocob import CocobBackprop
+
+def _train(foreach:bool):
+    torch.manual_seed(0)
+    params = [torch.randn(s, requires_grad=True) for s in [(3, 4), (5,), (2, 2, 3)]]
+    optim = CocobBackprop(params, alpha=100.0, foreach=foreach)
+    for step in range(5):
+        optim.zero_grad()
+        loss = sum((p**2).sum() * (step+1) for p in params[:-1]) \
+               if step % 2 else sum((p.sin()).sum() for p in params)
+        loss.backward() # last param sometimes doesn't get grad
+        optim.step()
+    return params, optim
+
+def test_foreach_matches_loop():
+    params, optim = _train(foreach=False)
+    params_fe, optim_fe = _train(foreach=True)
+    for p, p_fe in zip(params, params_fe):
+        assert torch.equal(p, p_fe)
+        for k, v in optim.state[p].items():
+            assert torch.equal(v, optim_fe.state[p_fe][k]), k
@@ -0,0 +1,73 @@
+import logging
+import os
+import tempfile
+
+import numpy as np
+import pytest
+import torch
+from torch import nn
+from PIL import Image
+from torch.utils.data import DataLoader, Dataset, TensorDataset
+
+from FastAutoAugment.common import common, utils, data
+from FastAutoAugment.common.config import Config
+from FastAutoAugment.common.common import SummaryWriterDummy
+from FastAutoAugment.data_aug.search import _train_model
+from FastAutoAugment.data_aug.train import run_epoch
+
+class _TinyDataset(Dataset):
+    def __init__(self, n:int, transform)->None:
+        rng = np.random.RandomState(0)
+        self.images = [Image.fromarray(rng.randint(0, 256, (32, 32, 3),
+                                                   dtype=np.uint8))
+                       for _ in range(n)]
+        self.targets = [i % 10 for i in range(n)]
+        self.transform = transform
+
+    def __len__(self):
+        return len(self.images)
+
+    def __getitem__(self, i):
+        return self.transform(self.images[i]), self.targets[i]
+
+def _tiny_datasets(dataset, dataroot, load_train, load_test,
+                   transform_train, transform_test, train_max_size,
+                   test_max_size):
+    return _TinyDataset(20, transform_train), _TinyDataset(10, transform_test)
+
+def _conf(expdir:str, channels_last=False)->Config:
+    common._logger = utils.setup_logging(level=logging.WARNING)
+    common._tb_writer = SummaryWriterDummy(None)
+    conf = Config(config_filepath='confs/darts_cifar.yaml', use_args=False)
+    conf['common']['expdir'] = expdir
+    conf['common']['checkpoint']['freq'] = 1
+    conf['autoaug']['model'] = {'type': 'wresnet40_2'}
+    conf_loader = conf['autoaug']['loader']
+    conf_loader['epochs'] = 1
+    conf_loader['train_batch'], conf_loader['test_batch'] = 4, 8
+    conf_loader['train_workers'] = conf_loader['test_workers'] = 0
+    conf_loader['channels_last'] = channels_last
+    return conf
+
+@pytest.mark.parametrize('channels_last', [False, True])
+def test_train_model(monkeypatch, channels_last):
+    monkeypatch.setattr(data, '_get_datasets', _tiny_datasets)
+    with tempfile.TemporaryDirectory() as expdir:
+        conf = _conf(expdir, channels_last)
+        save_path = os.path.join(expdir, 'fold0.model')
+        model_type, val_fold, result = _train_model(conf, '', '',
+            val_ratio=0.5, val_fold=0, save_path=save_path)
+        assert model_type == 'wresnet40_2' and val_fold == 0
+        assert result['epoch'] == 1 and 'top1_valid' in result
+        assert os.path.exists(save_path)
+
+def test_run_epoch_without_logging():
+    with tempfile.TemporaryDirectory() as expdir:
+        conf = _conf(expdir)
+        conf['autoaug']['logger_freq'] = 0 # metrics only at end of epoch
+        dl = DataLoader(TensorDataset(torch.randn(10, 4),
+                                      torch.randint(0, 10, (10,))),
+                        batch_size=4)
+        metrics = run_epoch(conf, common.get_logger(), nn.Linear(4, 10), dl,
+                            nn.CrossEntropyLoss(), None, 'test', verbose=1)
+        assert 0.0 <= metrics['top1'] <= 1.0
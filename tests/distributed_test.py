@@ -0,0 +1,62 @@
+import logging
+import os
+import socket
+
+import torch
+from torch import nn
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch.utils.data import DataLoader, TensorDataset
+
+from FastAutoAugment.common import common, utils, dist_utils
+from FastAutoAugment.common.config import Config
+from FastAutoAugment.common.common import SummaryWriterDummy
+from FastAutoAugment.common.trainer import Trainer
+
+def _dist_fit(rank:int, world_size:int, port:int, results)->None:
+    os.environ.update({'MASTER_ADDR': '127.0.0.1', 'MASTER_PORT': str(port)})
+    dist.init_process_group('gloo', rank=rank, world_size=world_size)
+    try:
+        common._logger = utils.setup_logging(level=logging.WARNING)
+        common._tb_writer = SummaryWriterDummy(None)
+        conf = Config(config_filepath='confs/darts_cifar.yaml', use_args=False)
+        conf_train = conf['nas']['eval']['trainer']
+        conf_train['epochs'] = 2
+        conf_train['drop_path_prob'] = 0.0 # model has no drop path
+        conf_train['aux_weight'] = 0.0
+        conf_train['validation'] = None
+
+        # each rank starts with own weights and has own shard of data
+        torch.manual_seed(rank)
+        model = nn.Sequential(nn.Linear(4, 8), nn.BatchNorm1d(8),
+                              nn.Linear(8, 10))
+        dl = DataLoader(TensorDataset(torch.randn(12, 4),
+                                      torch.randint(0, 10, (12,))),
+                        batch_size=4)
+        trainer = Trainer(conf_train, model, torch.device('cpu'), None,
+                          aux_tower=False)
+        trainer.fit(dl, None)
+        results[rank] = {k: v.clone() for k, v in model.state_dict().items()}
+        results[('mean', rank)] = dist_utils.all_reduce_mean(
+            [torch.full((2, 3), float(rank)), torch.full((4,), 2.0*rank)])
+    finally:
+        dist.destroy_process_group()
+
+def test_ranks_stay_in_sync():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    results = mp.Manager().dict()
+    mp.spawn(_dist_fit, args=(2, port, results), nprocs=2)
+    assert results[0].keys() == results[1].keys()
+    for name, t in results[0].items():
+        assert torch.equal(t, results[1][name]), name
+    for rank in range(2):
+        means = results[('mean', rank)]
+        assert torch.equal(means[0], torch.full((2, 3), 0.5))
+        assert torch.equal(means[1], torch.full((4,), 1.0))
+
+def test_all_reduce_mean_local():
+    # without process group tensors are returned as is
+    tensors = [torch.randn(2, 3), torch.randn(4)]
+    assert dist_utils.all_reduce_mean(tensors) is tensors
@@ -0,0 +1,74 @@
+import logging
+import tempfile
+
+import torch
+from torch import nn
+from torch.utils.data import DataLoader, TensorDataset
+
+from FastAutoAugment.common import common, utils
+from FastAutoAugment.common.config import Config
+from FastAutoAugment.common.common import SummaryWriterDummy
+from FastAutoAugment.common.check_point import CheckPoint
+from FastAutoAugment.common.trainer import Trainer
+from FastAutoAugment.common.early_stop import LearningCurveStopper
+
+def _stopper(threshold, best_known=None)->LearningCurveStopper:
+    return LearningCurveStopper({'min_epochs': 10, 'min_points': 5,
+                                 'threshold': threshold,
+                                 'best_known': best_known,
+                                 'confidence': 0.95}, epochs=100)
+
+def _curve(epochs:int):
+    # power law with top1 0.75 at epoch 100
+    return [[e, 0.8 - 0.5 * e**-0.5] for e in range(1, epochs+1)]
+
+def test_predict_power_law():
+    mean, std = _stopper(0.9).predict(_curve(30))
+    assert abs(mean - 0.75) < 0.01 and std < 0.01
+
+def test_stop():
+    history = _curve(30)
+    # not enough history yet
+    assert _stopper(0.9).evaluate(history[:5]) is None
+    assert _stopper(0.9).evaluate(history)['stop']
+    assert _stopper(0.5, best_known=0.9).evaluate(history)['stop']
+    prediction = _stopper(0.7).evaluate(history)
+    assert not prediction['stop'] and prediction['prob_below'] < 0.05
+    # no target, never stops
+    assert _stopper(None).evaluate(history) is None
+
+def _trainer(expdir:str, load_existing:bool)->Trainer:
+    conf = Config(config_filepath='confs/darts_cifar.yaml', use_args=False)
+    conf['common']['expdir'] = expdir
+    Config.set(conf)
+    common._logger = utils.setup_logging(level=logging.WARNING)
+    common._tb_writer = SummaryWriterDummy(None)
+    conf_train = conf['nas']['eval']['trainer']
+    conf_train['drop_path_prob'] = 0.0 # model has no drop path
+    conf_train['aux_weight'] = 0.0
+    conf_train['early_stop']['enabled'] = True
+    conf_train['validation']['freq'] = 1
+    check_point = CheckPoint({'filename': 'checkpoint.pth', 'freq': 10,
+                              'freq_secs': None, 'async_write': False,
+                              'incremental': False, 'chunk_mb': 1},
+                             load_existing=load_existing)
+    trainer = Trainer(conf_train, nn.Linear(4, 10), torch.device('cpu'),
+                      check_point, aux_tower=False)
+    # stop once there are 3 test epochs
+    trainer._early_stop.evaluate = lambda history: \
+        {'stop': True} if len(history) >= 3 else None
+    return trainer
+
+def test_stop_is_kept_on_resume():
+    dl = DataLoader(TensorDataset(torch.randn(4, 4),
+                                  torch.randint(0, 10, (4,))), batch_size=2)
+    with tempfile.TemporaryDirectory() as expdir:
+        trainer = _trainer(expdir, load_existing=False)
+        trainer.fit(dl, dl)
+        assert trainer.get_metrics()[0].epoch == 3
+
+        # checkpoint is saved at stop and resumed run doesn't train further
+        resumed = _trainer(expdir, load_existing=True)
+        assert resumed.check_point['trainer']['early_stop_epochs'] == 3
+        resumed.fit(dl, dl)
+        assert resumed.get_metrics()[0].epoch == 3
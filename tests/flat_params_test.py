@@ -0,0 +1,22 @@
+import torch
+from torch import nn
+
+from FastAutoAugment.common.utils import FlatParams
+
+def test_channels_last_kept():
+    conv = nn.Conv2d(3, 4, 3).to(memory_format=torch.channels_last)
+    linear = nn.Linear(4, 2)
+    params = list(conv.parameters()) + list(linear.parameters())
+    before = [p.detach().clone() for p in params]
+    flat = FlatParams(params)
+
+    assert flat.is_valid()
+    assert conv.weight.is_contiguous(memory_format=torch.channels_last)
+    assert all(torch.equal(p, b) for p, b in zip(params, before))
+    # cat gives same layout as flat buffer whatever format tensors have
+    assert torch.equal(flat.cat(before), flat.flat)
+    assert torch.equal(flat.cat(p.contiguous() for p in params), flat.flat)
+
+    # update of flat buffer is seen by params
+    flat.flat.mul_(2.0)
+    assert all(torch.equal(p, 2.0*b) for p, b in zip(params, before))
@@ -0,0 +1,36 @@
+from hyperopt import hp
+
+from FastAutoAugment.data_aug.fold_search import FoldSearch
+
+def _search(num_samples:int)->FoldSearch:
+    # every suggestion decodes to the same policy
+    space = {'policy_0_0': hp.choice('policy_0_0', [0]),
+             'prob_0_0': hp.choice('prob_0_0', [0.5]),
+             'level_0_0': hp.choice('level_0_0', [0.5])}
+    trial_config = {'val_fold': 0, 'num_policy': 1, 'num_op': 1}
+    return FoldSearch(space, trial_config, num_samples, 'top1_valid',
+                      {'enabled': False, 'eta': 3},
+                      {'enabled': False, 'oversample': 1, 'min_samples': 1},
+                      store=None, ckpt_hash='')
+
+def _result():
+    return {'top1_valid': 0.5, 'fidelity': 1.0, 'elapsed_time': 1.0}
+
+def test_in_flight_duplicates_wait():
+    search = _search(3)
+    trial_id, rung, _, _ = search.next_job()
+    # other suggestions wait for the running evaluation
+    assert search.next_job() is None
+    search.on_result(trial_id, rung, _result())
+    assert len(search.results) == 3 and search.reused == 2
+    assert search.next_job() is None
+
+def test_waiting_run_after_failure():
+    search = _search(3)
+    trial_id, rung, _, _ = search.next_job()
+    assert search.next_job() is None
+    search.on_failure(trial_id, rung)
+    retry_id, retry_rung, _, _ = search.next_job()
+    assert retry_id != trial_id and search.next_job() is None
+    search.on_result(retry_id, retry_rung, _result())
+    assert len(search.results) == 2 and search.failed == 1
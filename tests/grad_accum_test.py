@@ -0,0 +1,71 @@
+import copy
+import logging
+
+import torch
+from torch import nn
+from torch.utils.data import DataLoader, TensorDataset
+
+from FastAutoAugment.common import common, utils
+from FastAutoAugment.common.config import Config
+from FastAutoAugment.common.common import SummaryWriterDummy
+from FastAutoAugment.common.trainer import Trainer
+
+def _fit(model:nn.Module, dl:DataLoader, grad_accum_steps:int,
+         micro_batch:int)->list:
+    """Trains for 1 epoch without changing weights, returns grads at each
+    optimizer step"""
+    common._logger = utils.setup_logging(level=logging.WARNING)
+    common._tb_writer = SummaryWriterDummy(None)
+    conf = Config(config_filepath='confs/darts_cifar.yaml', use_args=False)
+    conf_train = conf['nas']['eval']['trainer']
+    conf_train['epochs'] = 1
+    conf_train['drop_path_prob'] = 0.0 # model has no drop path
+    conf_train['aux_weight'] = 0.0
+    conf_train['grad_clip'] = 0.0
+    conf_train['validation'] = None
+    conf_train['grad_accum_steps'] = grad_accum_steps
+    conf_train['micro_batch'] = micro_batch
+    trainer = Trainer(conf_train, model, torch.device('cpu'), None,
+                      aux_tower=False)
+    step_grads = []
+    trainer._amp.step = lambda optim: step_grads.append(
+        [p.grad.clone() for p in model.parameters()])
+    trainer.fit(dl, None)
+    return step_grads
+
+def test_grads_match_full_batch():
+    torch.manual_seed(0)
+    x, y = torch.randn(20, 4), torch.randint(0, 10, (20,))
+    model = nn.Linear(4, 10)
+    ref_model = copy.deepcopy(model)
+    # 5 batches of 4 in groups of 2, last group has single batch
+    step_grads = _fit(model, DataLoader(TensorDataset(x, y), batch_size=4),
+                      grad_accum_steps=2, micro_batch=3)
+
+    assert len(step_grads) == 3
+    for grads, (start, end) in zip(step_grads, [(0, 8), (8, 16), (16, 20)]):
+        ref_model.zero_grad()
+        nn.functional.cross_entropy(ref_model(x[start:end]),
+                                    y[start:end]).backward()
+        for g, p in zip(grads, ref_model.parameters()):
+            assert torch.allclose(g, p.grad, atol=1e-6)
+
+def test_bn_stats_match_full_batch():
+    torch.manual_seed(0)
+    # all micro batches are same so their stats equal stats of whole group
+    chunk = torch.randn(16, 4)
+    x, y = chunk.repeat(4, 1), torch.randint(0, 10, (64,))
+    model = nn.Sequential(nn.Linear(4, 10), nn.BatchNorm1d(10))
+    ref_model = copy.deepcopy(model)
+    # 2 batches of 32 in one group, 4 forwards of 16
+    _fit(model, DataLoader(TensorDataset(x, y), batch_size=32),
+         grad_accum_steps=2, micro_batch=16)
+    ref_model.train()
+    ref_model(x)
+
+    bn, ref_bn = model[1], ref_model[1]
+    assert bn.momentum == ref_bn.momentum # restored after split
+    assert torch.allclose(bn.running_mean, ref_bn.running_mean, atol=1e-6)
+    # unbiased batch var is 16/15 of biased var for micro batch vs 64/63 for
+    # whole batch, so these are only close
+    assert torch.allclose(bn.running_var, ref_bn.running_var, rtol=1e-2)
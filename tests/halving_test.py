@@ -0,0 +1,20 @@
+from FastAutoAugment.data_aug.halving import SuccessiveHalving
+
+def test_rungs():
+    assert SuccessiveHalving(1.0, 3).fidelities == [1.0]
+    fidelities = SuccessiveHalving(0.11, 3).fidelities
+    assert len(fidelities) == 3 and fidelities[-1] == 1.0
+
+def test_promotion():
+    sh = SuccessiveHalving(0.3, 3)
+    for trial_id in range(6):
+        sh.add_result(trial_id, 0, float(trial_id))
+
+    # top 1/3 of rung 0 are promoted, best first, only once
+    assert sh.next_promotion() == (5, 1)
+    assert sh.next_promotion() == (4, 1)
+    assert sh.next_promotion() is None
+
+    # nothing is promoted beyond top rung
+    sh.add_result(5, 1, 1.0)
+    assert sh.next_promotion() is None
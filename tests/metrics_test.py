@@ -0,0 +1,33 @@
+import logging
+import time
+
+import torch
+
+from FastAutoAugment.common import common, utils
+from FastAutoAugment.common.common import SummaryWriterDummy
+from FastAutoAugment.common.metrics import Metrics
+
+def test_phase_stats():
+    common._logger = utils.setup_logging(level=logging.WARNING)
+    common._tb_writer = SummaryWriterDummy(None)
+
+    m = Metrics('test', epochs=1, logger_freq=0, phase_timing=True)
+    m.pre_run(False)
+    m.pre_epoch()
+    x, y = torch.zeros(4, 3), torch.zeros(4, dtype=torch.long)
+    for _ in range(3):
+        time.sleep(0.01)
+        m.phase('data')
+        m.pre_step(x, y)
+        m.phase('forward')
+        m.phase('forward') # repeated phase is added up
+        m.post_step(x, y, torch.randn(4, 5), torch.tensor(1.0), steps=3)
+    m.post_epoch()
+
+    stats = m.phase_stats[0]
+    assert stats['epoch'] == 1
+    assert set(stats['phases'].keys()) == {'data', 'forward', 'metrics'}
+    assert stats['phases']['data']['p50'] >= 0.01
+    assert 0.0 < stats['data_wait_frac'] <= 1.0
+    assert stats['samples_per_sec'] > 0.0
+    assert not m._phase_times # step times are not kept after epoch
@@ -0,0 +1,96 @@
+import copy
+import logging
+
+import pytest
+import torch
+from torch import nn
+from torch.utils.data import DataLoader, TensorDataset
+
+from FastAutoAugment.common import common, utils
+from FastAutoAugment.common.config import Config
+from FastAutoAugment.common.common import SummaryWriterDummy
+from FastAutoAugment.common.multi_trainer import MultiTrainer, _ModelGroup
+
+def _model()->nn.Module:
+    return nn.Sequential(nn.Conv2d(3, 4, 3), nn.BatchNorm2d(4), nn.ReLU(),
+                         nn.Flatten(), nn.Linear(4*2*2, 10))
+
+def _models(k:int):
+    torch.manual_seed(0)
+    models = [_model() for _ in range(k)]
+    # separately run references, copied before stacking makes views
+    return models, copy.deepcopy(models)
+
+def test_stacked_matches_separate():
+    models, refs = _models(3)
+    group = _ModelGroup(models)
+    for m in group.modules() + refs:
+        m.train()
+    x, y = torch.randn(8, 3, 4, 4), torch.randint(0, 10, (8,))
+    lossfn = nn.CrossEntropyLoss()
+
+    logits, aux_logits = group.forward(x)
+    assert aux_logits is None and logits.shape == (3, 8, 10)
+    torch.stack([lossfn(l, y) for l in logits]).sum().backward()
+
+    for i, (model, ref) in enumerate(zip(models, refs)):
+        ref_logits = ref(x)
+        lossfn(ref_logits, y).backward()
+        assert torch.allclose(logits[i], ref_logits, atol=1.0e-6)
+        for (name, p), ref_p in zip(model.named_parameters(),
+                                    ref.parameters()):
+            assert torch.allclose(group._params[name].grad[i], ref_p.grad,
+                                  atol=1.0e-6)
+        # buffers of model are views into updated stacked buffers
+        for b, ref_b in zip(model.buffers(), ref.buffers()):
+            assert torch.allclose(b, ref_b, atol=1.0e-6)
+        assert model[1].running_mean.abs().sum() > 0.0
+
+def test_clip_grad_matches_clip_grad_norm():
+    models, refs = _models(3)
+    group = _ModelGroup(models)
+    for i, p in enumerate(group.parameters()):
+        p.grad = torch.randn_like(p) * (i+1)
+    # last model has small grads which are not clipped
+    for p in group.parameters():
+        p.grad[-1] *= 1.0e-3
+    for i, ref in enumerate(refs):
+        for name, p in ref.named_parameters():
+            p.grad = group._params[name].grad[i].clone()
+
+    group.clip_grad(1.0)
+    for i, ref in enumerate(refs):
+        nn.utils.clip_grad_norm_(ref.parameters(), 1.0)
+        for name, p in ref.named_parameters():
+            assert torch.allclose(group._params[name].grad[i], p.grad,
+                                  atol=1.0e-6)
+
+def _conf_train()->Config:
+    common._logger = utils.setup_logging(level=logging.WARNING)
+    common._tb_writer = SummaryWriterDummy(None)
+    conf = Config(config_filepath='confs/darts_cifar.yaml', use_args=False)
+    conf_train = conf['nas']['eval']['trainer']
+    conf_train['epochs'] = 2
+    conf_train['logger_freq'] = 0
+    conf_train['drop_path_prob'] = 0.0 # model has no drop path
+    conf_train['aux_weight'] = 0.0
+    conf_train['validation']['logger_freq'] = 0
+    return conf_train
+
+def test_fit():
+    models, _ = _models(2)
+    trainer = MultiTrainer(_conf_train(), models, torch.device('cpu'),
+                           aux_tower=False)
+    ds = TensorDataset(torch.randn(16, 3, 4, 4), torch.randint(0, 10, (16,)))
+    dl = DataLoader(ds, batch_size=8)
+    trainer.fit(dl, dl)
+    for metrics, test_metrics in trainer.get_metrics():
+        assert metrics.epoch == 2 and test_metrics.epoch == 2
+
+def test_unsupported_conf():
+    conf_train = _conf_train()
+    conf_train['amp'] = True
+    conf_train['early_stop']['enabled'] = True
+    with pytest.raises(NotImplementedError, match='amp, early_stop'):
+        MultiTrainer(conf_train, [_model()], torch.device('cpu'),
+                     aux_tower=False)
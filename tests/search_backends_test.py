@@ -0,0 +1,57 @@
+import logging
+import os
+
+import numpy as np
+from PIL import Image
+
+from FastAutoAugment.common import common, utils
+from FastAutoAugment.data_aug import shared_data
+from FastAutoAugment.data_aug.search_backends import LocalBackend, \
+    _AffinityRouter
+
+class _TinyDataset:
+    def __init__(self, n:int)->None:
+        self.images = [Image.fromarray(np.zeros((4, 4, 3), dtype=np.uint8))
+                       for _ in range(n)]
+        self.targets = [0] * n
+
+    def __len__(self):
+        return len(self.images)
+
+    def __getitem__(self, i):
+        return self.images[i], self.targets[i]
+
+def _tiny_datasets(dataset, dataroot, load_train, load_test,
+                   transform_train, transform_test, train_max_size,
+                   test_max_size):
+    return _TinyDataset(4), None
+
+def test_router_groups():
+    router = _AffinityRouter(num_workers=6, num_groups=3)
+    assert router.workers(1) == [1, 4]
+    assert router.workers(4) == [1, 4]
+    assert router.workers(None) == list(range(6))
+    # least busy worker of group is picked
+    assert [router.acquire(1) for _ in range(3)] == [1, 4, 1]
+    router.release(1)
+    router.release(1)
+    assert router.acquire(1) == 1
+
+def test_router_fewer_workers():
+    # each group still has single worker
+    router = _AffinityRouter(num_workers=2, num_groups=5)
+    assert [router.workers(g) for g in range(5)] == [[0], [1], [0], [1], [0]]
+
+def test_local_affinity(monkeypatch):
+    common._logger = utils.setup_logging(level=logging.WARNING)
+    monkeypatch.setattr(shared_data, '_get_datasets', _tiny_datasets)
+    backend = LocalBackend('', 'cifar10', max_workers=4, num_groups=2)
+    try:
+        pids = {g: set(backend.submit_trial(os.getpid, affinity=g).result()
+                       for _ in range(6))
+                for g in range(2)}
+    finally:
+        backend.shutdown()
+    # each fold stays on its own workers
+    assert pids[0] and pids[1] and not pids[0] & pids[1]
+    assert all(len(p) <= 2 for p in pids.values())
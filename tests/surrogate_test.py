@@ -0,0 +1,63 @@
+import numpy as np
+from hyperopt import hp
+
+from FastAutoAugment.data_aug.fold_search import FoldSearch
+from FastAutoAugment.data_aug.surrogate import PolicySurrogate
+
+def _config(policy:int, prob:float, level:float)->dict:
+    return {'policy_0_0': policy, 'prob_0_0': prob, 'level_0_0': level}
+
+def _reward(config:dict)->float:
+    # best policies use op 1 with high prob
+    return config['prob_0_0'] + (0.5 if config['policy_0_0'] == 1 else 0.0)
+
+def test_ranks_candidates():
+    rng = np.random.RandomState(0)
+    surrogate = PolicySurrogate(1, 1, 3, min_samples=20)
+    for _ in range(40):
+        config = _config(rng.randint(3), rng.uniform(), rng.uniform())
+        surrogate.add(config, _reward(config))
+    assert surrogate.ready()
+
+    candidates = [_config(0, 0.1, 0.5), _config(2, 0.5, 0.5),
+                  _config(1, 0.3, 0.5), _config(1, 0.9, 0.5)]
+    predictions = surrogate.predict(candidates)
+    assert list(np.argsort(predictions)) == [0, 1, 2, 3]
+
+def _search(min_samples:int, oversample:int)->FoldSearch:
+    space = {'policy_0_0': hp.choice('policy_0_0', [0, 1, 2]),
+             'prob_0_0': hp.uniform('prob_0_0', 0.0, 1.0),
+             'level_0_0': hp.uniform('level_0_0', 0.0, 1.0)}
+    trial_config = {'val_fold': 0, 'num_policy': 1, 'num_op': 1}
+    return FoldSearch(space, trial_config, 10, 'top1_valid',
+                      {'enabled': False, 'eta': 3},
+                      {'enabled': True, 'oversample': oversample,
+                       'min_samples': min_samples},
+                      store=None, ckpt_hash='')
+
+def _run(search:FoldSearch)->int:
+    trial_id, rung, config, _ = search.next_job()
+    search.on_result(trial_id, rung, {'top1_valid': _reward(config),
+                                      'fidelity': 1.0, 'elapsed_time': 1.0})
+    return trial_id
+
+def test_plain_tpe_until_min_samples():
+    search = _search(min_samples=3, oversample=4)
+    for i in range(3):
+        _run(search)
+        # one suggestion per trial
+        assert len(search._tpe) == i + 1 and not search._predictions
+
+    predict, predicted = search._surrogate.predict, []
+    def recording_predict(configs):
+        predictions = predict(configs)
+        predicted.append((configs, predictions))
+        return predictions
+    search._surrogate.predict = recording_predict
+    trial_id, _, config, _ = search.next_job()
+
+    # best of oversampled suggestions is kept, others are discarded
+    candidates, predictions = predicted[0]
+    assert len(candidates) == 4 and len(search._tpe) == 4
+    assert config is candidates[int(np.argmax(predictions))]
+    assert search._predictions[trial_id] == max(predictions)
@@ -0,0 +1,21 @@
+import pytest
+from hyperopt import hp
+
+from FastAutoAugment.data_aug.tpe_search import TpeSearch
+
+def test_discard():
+    tpe = TpeSearch({'x': hp.uniform('x', 0.0, 1.0)})
+    trial_ids = [tpe.suggest()[0] for _ in range(3)]
+    tpe.report(trial_ids[0], 0.5)
+    tpe.discard(trial_ids[1:2])
+
+    assert len(tpe) == 2
+    with pytest.raises(KeyError):
+        tpe.vals(trial_ids[1])
+    # kept trials still update TPE state and discarded ids are not reused
+    tpe.report(trial_ids[2], 0.7)
+    assert [d['result'].get('loss', None) for d in tpe._trials.trials] == \
+           [-0.5, -0.7]
+    trial_id, config = tpe.suggest()
+    assert trial_id not in trial_ids and 0.0 <= config['x'] <= 1.0
+    assert tpe.vals(trial_id) == {'x': config['x']}
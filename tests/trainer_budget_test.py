@@ -0,0 +1,134 @@
+import logging
+import tempfile
+import time
+
+import torch
+from torch import nn
+from torch.utils.data import DataLoader, TensorDataset
+
+from FastAutoAugment.common import common, utils
+from FastAutoAugment.common.config import Config
+from FastAutoAugment.common.common import SummaryWriterDummy
+from FastAutoAugment.common.trainer import Trainer
+from FastAutoAugment.common.check_point import CheckPoint
+
+def _trainer(epochs=100, lr_schedule=None)->Trainer:
+    common._logger = utils.setup_logging(level=logging.WARNING)
+    common._tb_writer = SummaryWriterDummy(None)
+    conf = Config(config_filepath='confs/darts_cifar.yaml', use_args=False)
+    conf_train = conf['nas']['eval']['trainer']
+    conf_train['epochs'] = epochs
+    conf_train['drop_path_prob'] = 0.0 # model has no drop path
+    conf_train['aux_weight'] = 0.0
+    conf_train['budget']['secs'] = 100.0
+    if lr_schedule is not None:
+        conf_train['lr_schedule'] = lr_schedule
+    trainer = Trainer(conf_train, nn.Linear(4, 10), torch.device('cpu'), None,
+                      aux_tower=False)
+    # what fit() sets up
+    trainer._optim = trainer.create_optimizer()
+    trainer._optim_steps = 3
+    trainer._sched, trainer._sched_on_epoch = \
+        trainer._create_scheduler(trainer._optim, trainer._optim_steps)
+    trainer._fit_start_epoch = 0
+    return trainer
+
+def test_restore_without_budget_state():
+    trainer = _trainer()
+    trainer.check_point = {'trainer': {'epoch': 1}} # saved without budget
+    trainer._restore_budget()
+    assert trainer._budget_spent == 0.0 and not trainer._budget_planned
+    assert trainer._epochs == 100
+
+def test_plan_and_stop():
+    trainer = _trainer()
+    elapsed = [0.0]
+    trainer._budget_elapsed = lambda all_ranks=True: elapsed[0]
+
+    elapsed[0] = 5.0 # first epoch with startup is not used for estimate
+    trainer._update_budget(1)
+    assert not trainer._budget_planned and trainer._epochs == 100
+    elapsed[0] = 7.0 # 2s per epoch, 93s left
+    trainer._update_budget(2)
+    assert trainer._budget_planned and not trainer._stop_training
+    assert trainer._epochs == 48 and trainer.get_metrics()[0].epochs == 48
+    assert trainer._sched.T_max == 48
+
+    elapsed[0] = 97.0 # next epoch ends at 99s
+    trainer._update_budget(47)
+    assert not trainer._stop_training and trainer._epochs == 48
+    elapsed[0] = 99.0 # next epoch would end after 100s
+    trainer._update_budget(47)
+    assert trainer._stop_training and trainer._epochs == 47
+
+def _step(trainer:Trainer, epochs:int)->None:
+    steps = epochs if trainer._sched_on_epoch \
+            else epochs * trainer._optim_steps
+    for _ in range(steps):
+        trainer._optim.step()
+        trainer._sched.step()
+
+def _lrs(trainer:Trainer):
+    return [(g['lr'], g.get('momentum')) for g in trainer._optim.param_groups]
+
+def test_replanned_schedule_matches_fresh():
+    for lr_schedule in [{'type': 'cosine', 'min_lr': 0.001},
+                        {'type': 'one_cycle', 'max_lr': 0.1}]:
+        trainer = _trainer(100, lr_schedule)
+        _step(trainer, 10)
+        trainer._set_epochs(40)
+        trainer._replan_scheduler(10)
+        fresh = _trainer(40, lr_schedule)
+        _step(fresh, 10)
+        assert _lrs(trainer) == _lrs(fresh)
+        _step(trainer, 25)
+        _step(fresh, 25)
+        assert _lrs(trainer) == _lrs(fresh)
+        unplanned = _trainer(100, lr_schedule)
+        _step(unplanned, 35)
+        assert _lrs(trainer) != _lrs(unplanned)
+
+def test_budget_checkpoint_round_trip():
+    trainer = _trainer()
+    trainer._fit_start_time = time.time()
+    trainer._budget_spent, trainer._budget_planned = 40.0, True
+    trainer._set_epochs(48)
+    trainer.check_point = {}
+    trainer.update_checkpoint(trainer.check_point)
+
+    resumed = _trainer()
+    resumed.check_point = trainer.check_point
+    resumed._restore_budget()
+    assert 40.0 <= resumed._budget_spent < 45.0 and resumed._budget_planned
+    assert resumed._epochs == 48 and resumed.get_metrics()[0].epochs == 48
+    # scheduler is created after restore, for planned epochs
+    sched, _ = resumed._create_scheduler(resumed._optim, resumed._optim_steps)
+    assert sched.T_max == 48
+
+def _check_point(expdir:str)->CheckPoint:
+    conf = Config()
+    conf['common'] = {'expdir': expdir}
+    Config.set(conf)
+    return CheckPoint({'filename': 'checkpoint.pth', 'freq': 10,
+                       'freq_secs': None, 'async_write': False,
+                       'incremental': False, 'chunk_mb': 1},
+                      load_existing=False)
+
+def test_stop_saves_checkpoint():
+    with tempfile.TemporaryDirectory() as expdir:
+        trainer = _trainer()
+        trainer.check_point = _check_point(expdir)
+        # epochs 1, 2 plan 10 epochs, epoch 3 is slower so epoch 4 won't fit
+        elapsed = iter([10.0, 20.0, 80.0, 80.0])
+        trainer._budget_elapsed = lambda all_ranks=True: next(elapsed)
+        dl = DataLoader(TensorDataset(torch.randn(4, 4),
+                                      torch.randint(0, 10, (4,))), batch_size=2)
+        trainer.fit(dl, None)
+        assert trainer.get_metrics()[0].epoch == 3
+
+        # checkpoint is saved at stop even though freq is 10
+        resumed = _check_point(expdir)
+        assert resumed.load_existing()
+        assert resumed['trainer']['metrics']['epoch'] == 3
+        assert resumed['trainer']['budget'] == {'spent': 80.0, 'epochs': 3,
+                                                'planned': True}